@@ -20,7 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import functools
 import itertools
+import os
+
+import pysam
 
 # BAM flags as defined in the BAM specification
 BAM_SUPPLEMENTARY_ALIGNMENT = 0x800
@@ -46,6 +50,26 @@ EXCLUDED_FLAGS = (
 )
 
 
+def index_statistics(filename):
+    """Returns the number of mapped and unmapped reads for each contig in an
+    indexed BAM file, as a tuple of (contig, mapped, unmapped, total) records.
+    These numbers are read directly from the BAI/CSI index, as with 'samtools
+    idxstats', and are cached using the path and modification time of the BAM.
+
+    A ValueError is raised if the BAM file has not been indexed."""
+    stat = os.stat(filename)
+
+    return _read_index_statistics(
+        os.path.abspath(filename), stat.st_mtime_ns, stat.st_size
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _read_index_statistics(filename, _mtime_ns, _size):
+    with pysam.AlignmentFile(filename) as handle:
+        return tuple(handle.get_index_statistics())
+
+
 class BAMRegionsIter:
     """Iterates over a BAM file, yield a separate iterator for each contig
     in the BAM or region in the list of regions if these are species, which in
@@ -272,6 +272,42 @@ def merge_bed_records(records):
             last_record._fields = record._fields[:3]
             results.append(last_record)
         else:
-            last_record.end = record.end
+            last_record.end = max(last_record.end, record.end)
 
     return results
+
+
+def split_bed_records(records, num_shards):
+    """Splits a sequence of records into N lists of records, such that the total
+    length of records in each list is (nearly) the same. The order of records is
+    preserved, and records spanning the boundary between two lists are split in
+    two. Only the contig, start, and end fields are retained. Lists are only empty
+    if the total length of all records is less than N.
+    """
+    if num_shards < 1:
+        raise ValueError("number of shards must be at least 1, not %r" % (num_shards,))
+
+    records = list(records)
+    total_length = sum(max(0, record.end - record.start) for record in records)
+
+    shards = [[] for _ in range(num_shards)]
+    shard_index = 0
+    shard_end = total_length // num_shards
+    offset = 0
+    for record in records:
+        start = record.start
+        while start < record.end:
+            end = min(record.end, start + shard_end - offset)
+            if end > start:
+                shard = BEDRecord()
+                shard._fields = [record.contig, start, end]
+                shards[shard_index].append(shard)
+
+                offset += end - start
+                start = end
+
+            if offset >= shard_end and shard_index + 1 < num_shards:
+                shard_index += 1
+                shard_end = (total_length * (shard_index + 1)) // num_shards
+
+    return shards
@@ -23,9 +23,11 @@
 import os
 import bz2
 import gzip
+import json
 import uuid
 import errno
 import shutil
+import logging
 
 from pathlib import Path
 from typing import Any, Callable, IO, Iterable, List, Optional, Tuple, Union
@@ -148,6 +150,47 @@ def open_ro(filename: Union[str, Path], mode: str = "rt") -> IO[str]:
         return open(filename, mode)
 
 
+def read_json_cache(filename: Union[str, Path], key: Any) -> Any:
+    """Reads a value written using 'write_json_cache'. Returns None if the cache
+    does not exist, cannot be read, or if it was written using a different key."""
+    try:
+        with open(filename, "rt", encoding="utf-8") as handle:
+            data = json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+    # Keys are compared in their JSON representation, e.g. tuples become lists
+    if not isinstance(data, dict) or data.get("key") != json.loads(json.dumps(key)):
+        return None
+
+    return data.get("value")
+
+
+def write_json_cache(filename: Union[str, Path], key: Any, value: Any) -> bool:
+    """Atomically writes a JSON encoded key/value pair to a cache file, creating
+    the destination folder if required. Failure to write the cache is logged
+    but not considered an error, as caches may be located in read-only folders.
+    The return value reflects whether or not the cache was written."""
+    text = json.dumps({"key": key, "value": value})
+    temp_file = "%s.%i.tmp" % (filename, os.getpid())
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open(temp_file, "wt", encoding="utf-8") as handle:
+            handle.write(text)
+        os.replace(temp_file, filename)
+    except OSError as error:
+        log = logging.getLogger(__name__)
+        log.debug("Could not write cache %r: %s", filename, error)
+
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+        return False
+
+    return True
+
+
 def try_remove(filename: Union[str, Path]) -> bool:
     """Tries to remove a file. Unlike os.remove, the function does not
     raise an exception if the file does not exist, but does raise
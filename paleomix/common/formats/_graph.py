@@ -20,7 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
-from paleomix.common.utilities import safe_coerce_to_frozenset, get_in, set_in
+from paleomix.common.utilities import safe_coerce_to_frozenset, set_in
 
 from paleomix.common.formats import FormatError
 
@@ -107,20 +107,18 @@ class _Graph:
 
         For a node to be pruned, both adjacent nodes must have a
         length specified, or both must not have a length specified."""
-        while True:
-            for (cur_node, connections) in self.connections.items():
-                if not self.names[cur_node] and (len(connections) == 2):
-                    conn_a, conn_b = connections
+        # Splicing out a node does not change the number of connections of the
+        # adjacent nodes, so every uninformative node is found in a single pass
+        for cur_node in list(self.connections):
+            connections = self.connections[cur_node]
+            if not self.names[cur_node] and (len(connections) == 2):
+                conn_a, conn_b = connections
 
-                    blength = self.get_path_length(conn_a, cur_node, conn_b)
+                blength = self.get_path_length(conn_a, cur_node, conn_b)
 
-                    # Splice out the current node
-                    self.remove_node(cur_node)
-                    self.add_connection(conn_a, conn_b, blength)
-                    break
-            else:
-                # Nothing was pruned this round, terminate
-                break
+                # Splice out the current node
+                self.remove_node(cur_node)
+                self.add_connection(conn_a, conn_b, blength)
 
     ################################################################################
     ################################################################################
@@ -140,28 +138,43 @@ class _Graph:
     def _find_longest_path(self):
         """This function determines the longest non-overlapping path possible,
         and returns a list of the sequence of nodes in this path, as well as
-        the total length of this path."""
-        path_blengths = {}
-        path_guides = {}
-
-        def _collect_paths(guide, length, p_node, c_node):
-            length += self.get_path_length(p_node, c_node)
-
-            guide.append(c_node)
-            key = frozenset(guide)
-            path_blengths[key] = length
-            path_guides[key] = guide
-
-            for other in self.connections[c_node]:
-                if other not in key:
-                    _collect_paths(list(guide), length, c_node, other)
-
-        for (p_node, connections) in self.connections.items():
-            for c_node in connections:
-                _collect_paths([p_node], 0, p_node, c_node)
+        the total length of this path. The longest path is found in linear time,
+        as the path from the node furthest from an arbitrary node, to the node
+        furthest from that node."""
+        path, _ = self._find_furthest_node(next(iter(self.connections)))
+
+        return self._find_furthest_node(path[-1])
+
+    def _find_furthest_node(self, root):
+        """Returns the path from 'root' to the node furthest away from 'root',
+        as well as the length of this path."""
+        parents = {root: root}
+        distances = {root: 0.0}
+        for (p_node, c_node) in self._collect_edges_from(root):
+            parents[c_node] = p_node
+            distances[c_node] = distances[p_node] + self.get_path_length(p_node, c_node)
+
+        node = max(distances, key=distances.get)
+        path = [node]
+        while node != root:
+            node = parents[node]
+            path.append(node)
+
+        path.reverse()
+
+        return path, distances[path[-1]]
+
+    def _collect_edges_from(self, root):
+        """Returns a list of (parent, child) pairs for every branch in the graph,
+        when the graph is rooted at 'root'. Pairs are ordered such that a node is
+        always found as a child before it is found as a parent."""
+        edges = [(root, c_node) for c_node in self.connections[root]]
+        for (p_node, c_node) in edges:
+            for n_node in self.connections[c_node]:
+                if n_node != p_node:
+                    edges.append((c_node, n_node))
 
-        key, length = max(path_blengths.items(), key=lambda item: item[1])
-        return path_guides[key], length
+        return edges
 
     def _create_root_at(self, path, root_at):
         """Finds the midpoint of a path through a tree, and
@@ -202,10 +215,9 @@ class _Graph:
         if not taxa:
             raise ValueError("No taxa in outgroup")
 
-        clades = self._collect_clades()
         root_on = self._collect_nodes_from_names(taxa)
         # Because None is the id of the root atm:
-        root = self._create_root_with_clade(clades, root_on)
+        root = self._create_root_with_clade(root_on)
 
         return self.rebuild_tree(root, root)
 
@@ -223,38 +235,44 @@ class _Graph:
         elif not (known_taxa - taxa):
             raise ValueError("Cannot root on every taxa in tree")
 
-        return frozenset(key for (key, name) in self.names.items() if name in taxa)
-
-    def _collect_clades(self):
-        clades = {}
-        for (node_a, connections) in self.connections.items():
-            for node_b in connections:
-                self._collect_clade_from(clades, node_a, node_b)
-        return clades
-
-    def _collect_clade_from(self, cache, p_node, c_node):
-        c_clade = get_in(cache, (p_node, c_node), set())
-        if not c_clade:
-            if self.is_leaf(c_node):
-                c_clade.add(c_node)
+        return frozenset(
+            key
+            for (key, name) in self.names.items()
+            if name in taxa and self.is_leaf(key)
+        )
+
+    def _create_root_with_clade(self, taxa):
+        """Creates a root on the branch splitting off the smallest clade that
+        contains every node in 'taxa'. Clades are counted (rather than collected)
+        for both sides of every branch, by rooting the graph at an arbitrary node,
+        and counting the leaves and taxa found below each node."""
+        root = next(iter(self.connections))
+        edges = self._collect_edges_from(root)
+
+        n_leaves = {node: int(self.is_leaf(node)) for node in self.connections}
+        n_taxa = {node: int(node in taxa) for node in self.connections}
+
+        for (p_node, c_node) in reversed(edges):
+            n_leaves[p_node] += n_leaves[c_node]
+            n_taxa[p_node] += n_taxa[c_node]
+
+        root_key, root_size = None, None
+        for (p_node, c_node) in edges:
+            if n_taxa[c_node] == n_taxa[root]:
+                # The clade below this branch contains every taxa
+                size = n_leaves[c_node]
+            elif not n_taxa[c_node]:
+                # The clade above this branch contains every taxa
+                size = n_leaves[root] - n_leaves[c_node]
+            else:
+                continue
 
-            for n_node in self.connections[c_node]:
-                if n_node != p_node:
-                    c_clade.update(self._collect_clade_from(cache, c_node, n_node))
-            set_in(cache, (p_node, c_node), frozenset(c_clade))
-        return c_clade
-
-    def _create_root_with_clade(self, clades, taxa):
-        root_key, root_clade, root_length = None, None, None
-        for (p_node, connections) in clades.items():
-            for (n_node, clade) in connections.items():
-                if (root_clade is None) or (len(clade) < len(root_clade)):
-                    if taxa.issubset(clade):
-                        root_key = (p_node, n_node)
-                        root_clade = clade
-                        root_length = self.get_path_length(p_node, n_node)
+            if (root_size is None) or (size < root_size):
+                root_key = (p_node, c_node)
+                root_size = size
 
         p_node, n_node = root_key
+        root_length = self.get_path_length(p_node, n_node)
         if root_length is not None:
             root_length = float(root_length) / 2.0
 
@@ -263,13 +281,3 @@ class _Graph:
         self.add_connection(None, n_node, root_length)
 
         return None
-
-    ################################################################################
-    ################################################################################
-    # Functions relating to calculating bootstrap support
-    def get_clade_names(self):
-        result = set()
-        for (_, connections) in self._collect_clades().items():
-            for (_, clade) in connections.items():
-                result.add(frozenset(self.names[node_id] for node_id in clade))
-        return result
@@ -20,6 +20,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import functools
+import io
+import struct
 import sys
 
 import pysam
@@ -28,6 +31,18 @@ from paleomix.common.utilities import fragment, split_before, Immutable, Totally
 from paleomix.common.fileutils import open_ro
 from paleomix.common.formats._common import FormatError
 
+# Number of columns per line when writing FASTA sequences
+_FASTA_COLUMNS = 60
+# Number of lines wrapped per call to struct.unpack when writing sequences
+_FASTA_WRAP_LINES = 1024
+_FASTA_WRAP_STRUCT = struct.Struct("%is" % (_FASTA_COLUMNS,) * _FASTA_WRAP_LINES)
+
+# Size of blocks read from FASTA files
+_FASTA_BLOCK_SIZE = 256 * 1024
+# (ASCII) whitespace other than newlines; such characters are stripped from the end
+# of lines when parsing FASTA files, so records containing these are parsed per line
+_FASTA_WHITESPACE = b"\t\x0b\x0c\x1c\x1d\x1e\x1f "
+
 
 class FASTAError(FormatError):
     pass
@@ -50,7 +65,13 @@ class FASTA(TotallyOrdered, Immutable):
         if self.meta:
             name = "%s %s" % (name, self.meta)
 
-        fileobj.write(">%s\n%s\n" % (name, "\n".join(fragment(60, self.sequence))))
+        # Long sequences are wrapped in bulk, rather than one line at a time
+        if len(self.sequence) < _FASTA_WRAP_STRUCT.size:
+            lines = "\n".join(fragment(_FASTA_COLUMNS, self.sequence))
+            fileobj.write(">%s\n%s\n" % (name, lines))
+        else:
+            fileobj.write(">%s\n" % (name,))
+            fileobj.writelines(_wrap_sequence(self.sequence))
 
     @classmethod
     def from_lines(cls, lines):
@@ -80,8 +101,8 @@ class FASTA(TotallyOrdered, Immutable):
         """Reads an unindexed FASTA file, returning a sequence of
         tuples containing the name and sequence of each entry in
         the file. The FASTA file may be GZIP/BZ2 compressed."""
-        with open_ro(filename) as fasta_file:
-            yield from FASTA.from_lines(fasta_file)
+        with open_ro(filename, "rb") as fasta_file:
+            yield from _parse_fasta_file(fasta_file)
 
     @classmethod
     def index_and_collect_contigs(cls, filename):
@@ -107,3 +128,106 @@ class FASTA(TotallyOrdered, Immutable):
 
     def __repr__(self):
         return "FASTA(%r, %r, %r)" % (self.name, self.meta, self.sequence)
+
+
+def _wrap_sequence(sequence):
+    """Yields blocks of text containing a sequence wrapped at 60 columns, with every
+    line (including the last) terminated by a newline. Lines are wrapped in bulk
+    using struct.unpack, rather than one slice at a time.
+    """
+    if not sequence.isascii():
+        yield "\n".join(fragment(_FASTA_COLUMNS, sequence)) + "\n"
+        return
+
+    # Blocks of lines are wrapped in turn, to avoid encoding the entire sequence
+    block_size = _FASTA_WRAP_STRUCT.size
+    full_blocks = len(sequence) - len(sequence) % block_size
+    for offset in range(0, full_blocks, block_size):
+        data = sequence[offset : offset + block_size].encode("ascii")
+        yield b"\n".join(_FASTA_WRAP_STRUCT.unpack(data) + (b"",)).decode("ascii")
+
+    if full_blocks < len(sequence):
+        yield "\n".join(fragment(_FASTA_COLUMNS, sequence[full_blocks:])) + "\n"
+
+
+def _read_fasta_blocks(handle):
+    """Reads a binary FASTA file in large blocks, each ending at a line break, and
+    with universal newlines translated to '\\n' (as when reading in text mode).
+    """
+    for block in iter(functools.partial(handle.read, _FASTA_BLOCK_SIZE), b""):
+        if not block.endswith(b"\n"):
+            block += handle.readline()
+
+        if b"\r" in block:
+            block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        yield block
+
+
+def _find_fasta_header(block, start):
+    """Returns the offset of the next line starting with '>' or the end of the block;
+    the line at 'start' is assumed not to be a header.
+    """
+    end = block.find(b">", start)
+    while end != -1 and block[end - 1] != ord("\n"):
+        end = block.find(b">", end + 1)
+
+    return len(block) if end == -1 else end
+
+
+def _parse_fasta_file(handle):
+    """Parses a binary FASTA file using bulk operations on blocks of lines, yielding
+    the same records (and raising the same errors) as FASTA.from_lines.
+    """
+    header = parts = None
+    for block in _read_fasta_blocks(handle):
+        start = 0
+        while start < len(block):
+            if block.startswith(b">", start):
+                if parts is not None:
+                    yield _new_fasta_record(header, parts)
+
+                end = block.find(b"\n", start) + 1 or len(block)
+                header, parts = block[start:end], []
+            elif parts is None:
+                raise FASTAError("Unnamed FASTA record")
+            else:
+                end = _find_fasta_header(block, start)
+                parts.append(_strip_fasta_lines(block[start:end]))
+
+            start = end
+
+    if parts is not None:
+        yield _new_fasta_record(header, parts)
+
+
+def _strip_fasta_lines(data):
+    """Joins lines of sequence after stripping trailing whitespace from each line."""
+    # Only newlines need to be removed if the text contains no other whitespace
+    if data.isascii() and not any(char in data for char in _FASTA_WHITESPACE):
+        return data.replace(b"\n", b"").decode("ascii")
+
+    return "".join(line.rstrip() for line in _decode_fasta_text(data).split("\n"))
+
+
+def _decode_fasta_text(data):
+    if data.isascii():
+        return data.decode("ascii")
+
+    # Use the same (default) encoding as when the file is opened in text mode
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+def _new_fasta_record(header, parts):
+    header = _decode_fasta_text(header).rstrip()
+    if len(header) == 1:
+        raise FASTAError("Unnamed FASTA record")
+    elif not parts:
+        raise FASTAError("FASTA record does not contain sequence: %s" % (header[1:],))
+
+    name_and_meta = header[1:].split(None, 1)
+    if len(name_and_meta) < 2:
+        name_and_meta.append("")
+    name, meta = name_and_meta
+
+    return FASTA(name=name, meta=meta, sequence="".join(parts))
@@ -20,11 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import re
 
 from collections import defaultdict
 
 from paleomix.common.sequences import split
-from paleomix.common.fileutils import open_ro
 from paleomix.common.formats.fasta import FASTA, FASTAError
 from paleomix.common.sequences import NT_CODES, encode_genotype
 from paleomix.common.utilities import safe_coerce_to_frozenset
@@ -34,6 +34,31 @@ class MSAError(FASTAError):
     pass
 
 
+# Translation table mapping uncalled bases to 0 and everything else to 1
+_CALLED_TABLE = bytearray([1]) * 256
+for _nt in b"Nn-":
+    _CALLED_TABLE[_nt] = 0
+_CALLED_TABLE = bytes(_CALLED_TABLE)
+
+# Translation table mapping IUPAC codes to 4-bit masks of the possible bases; the
+# uncalled bases ('N' and '-') are mapped to 0, as these are excluded from filtering
+_NT_MASKS = {"A": 1, "C": 2, "G": 4, "T": 8}
+_NT_MASK_TABLE = bytearray(256)
+for _code, _nts in NT_CODES.items():
+    if _code != "N":
+        for _nt in _nts:
+            _NT_MASK_TABLE[ord(_code)] |= _NT_MASKS[_nt]
+_NT_MASK_TABLE = bytes(_NT_MASK_TABLE)
+# Bases that may be represented using the table above
+_NT_MASK_VALID = "".join(NT_CODES).encode("ascii") + b"-"
+
+# Table of masks to (lower-case) IUPAC codes, with no bases mapping to 'n'
+_NT_MASK_TO_CODE = ["n"] * 16
+for _mask in range(1, 16):
+    _nts = [_nt for (_nt, _value) in _NT_MASKS.items() if _mask & _value]
+    _NT_MASK_TO_CODE[_mask] = encode_genotype(_nts).lower()
+
+
 class MSA(frozenset):
     """Represents a Multiple Sequence Alignment of FASTA records."""
 
@@ -69,44 +94,49 @@ class MSA(frozenset):
         return MSA(included)
 
     def reduce(self):
-        columns = []
-        uncalled = frozenset("Nn-")
-        for column in zip(*(record.sequence for record in self)):
-            if frozenset(column) - uncalled:
-                columns.append(column)
+        """Returns a new MSA with columns containing only uncalled bases ('N' and
+        '-') removed, or None if no columns contain called bases."""
+        # Column masks are OR'ed for all sequences, using ints as bit-vectors
+        called = 0
+        for record in self:
+            called |= int.from_bytes(
+                _encode(record.sequence).translate(_CALLED_TABLE), "big"
+            )
 
-        if not columns:
+        mask = called.to_bytes(self.seqlen(), "big")
+        # Runs of columns containing at least one called base
+        spans = [match.span() for match in re.finditer(b"\x01+", mask)]
+        if not spans:
             return None
 
         records = []
-        for (record, sequence) in zip(self, zip(*columns)):
-            records.append(FASTA(record.name, record.meta, "".join(sequence)))
+        for record in self:
+            sequence = "".join(record.sequence[start:end] for start, end in spans)
+            records.append(FASTA(record.name, record.meta, sequence))
 
         return MSA(records)
 
     def filter_singletons(self, to_filter, filter_using):
         included, excluded, to_filter = self._group(filter_using, to_filter)
 
-        sequence = list(to_filter.sequence)
-        sequences = [record.sequence.upper() for record in included]
-        for (index, nts) in enumerate(zip(*sequences)):
-            current_nt = sequence[index].upper()
-            if current_nt in "N-":
-                continue
+        allowed = 0
+        for record in included:
+            allowed |= _nucleotide_masks(record.sequence)
 
-            allowed_nts = set()
-            for allowed_nt in nts:
-                if allowed_nt not in "N-":
-                    allowed_nts.update(NT_CODES[allowed_nt])
-            filtered_nts = frozenset(NT_CODES[current_nt]) & allowed_nts
+        current = _nucleotide_masks(to_filter.sequence)
+        filtered = (allowed & current).to_bytes(self.seqlen(), "big")
+        changes = (allowed & current) ^ current
 
-            if not filtered_nts:
-                filtered_nts = "N"
+        sequence = to_filter.sequence
+        if changes:
+            sequence = list(sequence)
+            changes = changes.to_bytes(self.seqlen(), "big")
+            for match in re.finditer(b"[^\x00]", changes):
+                index = match.start()
+                sequence[index] = _NT_MASK_TO_CODE[filtered[index]]
+            sequence = "".join(sequence)
 
-            genotype = encode_genotype(filtered_nts)
-            if genotype != current_nt:
-                sequence[index] = genotype.lower()
-        new_record = FASTA(to_filter.name, to_filter.meta, "".join(sequence))
+        new_record = FASTA(to_filter.name, to_filter.meta, sequence)
 
         return MSA([new_record] + included + excluded)
 
@@ -160,13 +190,10 @@ class MSA(frozenset):
     def from_file(cls, filename):
         """Reads a MSA from the specified filename. The file may
         be uncompressed, gzipped or bzipped. See also 'MSA.from_lines'."""
-        fasta_file = open_ro(filename)
         try:
-            return MSA.from_lines(fasta_file)
+            return MSA(FASTA.from_file(filename))
         except MSAError as error:
             raise MSAError("%s in file %r" % (error, filename))
-        finally:
-            fasta_file.close()
 
     def to_file(self, fileobj):
         for fst in sorted(self):
@@ -227,3 +254,19 @@ class MSA(frozenset):
                 other = record
 
         return included, excluded, other
+
+
+def _encode(sequence):
+    # Non-ASCII characters are replaced with '?' to preserve column indices
+    return sequence.encode("ascii", "replace")
+
+
+def _nucleotide_masks(sequence):
+    """Returns a sequence encoded as 4-bit masks of possible bases (one byte per
+    base), as an int for use as a bit-vector."""
+    sequence = _encode(sequence.upper())
+    invalid = sequence.translate(None, _NT_MASK_VALID)
+    if invalid:
+        raise KeyError(chr(invalid[0]))
+
+    return int.from_bytes(sequence.translate(_NT_MASK_TABLE), "big")
@@ -20,9 +20,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import collections
 import re
 
-from paleomix.common.utilities import safe_coerce_to_tuple, Immutable, TotallyOrdered
+from paleomix.common.utilities import Immutable, TotallyOrdered
 from paleomix.common.formats._graph import GraphError, _Graph
 
 
@@ -57,24 +58,22 @@ class Newick(TotallyOrdered, Immutable):
         name = name or None
         length = length or None
         children = tuple(children or ())
-        nw_hash = hash((name, length, children))
-        Immutable.__init__(
-            self, name=name, length=length, children=children, _hash=nw_hash
-        )
-
-        if not (self.children or self.name or self.length):
+        if not (children or name or length):
             raise NewickError("Leaf nodes MUST have either a name or a length")
 
-        # Ensure that these values are hashable
-        hash(self.name)
-        hash(self.length)
-
-        weight = 0
-        for child in self.children:
+        for child in children:
             if not isinstance(child, Newick):
                 raise TypeError("Child nodes must be Newick nodes")
-            weight += 1
-        object.__setattr__(self, "_weight", weight)
+
+        # Also ensures that the name and length are hashable
+        nw_hash = hash((name, length, children))
+
+        # Attributes are set directly, since trees may consist of very many nodes
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "length", length)
+        object.__setattr__(self, "children", children)
+        object.__setattr__(self, "_hash", nw_hash)
+        object.__setattr__(self, "_weight", len(children))
 
     @property
     def is_leaf(self):
@@ -83,12 +82,13 @@ class Newick(TotallyOrdered, Immutable):
 
     def get_leaf_nodes(self):
         """Returns iterable for leaf-nodes accessible from this node."""
-        if not self.is_leaf:
-            for child in self.children:
-                for leaf in child.get_leaf_nodes():
-                    yield leaf
-        else:
-            yield self
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(reversed(node.children))
+            else:
+                yield node
 
     def get_leaf_names(self):
         for node in self.get_leaf_nodes():
@@ -136,28 +136,28 @@ class Newick(TotallyOrdered, Immutable):
 
         For example, typical percentage support-values can be realized by setting 'fmt'
         to the value "{Percentage:.0f}" to produce integer values.
+
+        Support trees may be any iterable, including generators, in which case only
+        a single support tree is kept in memory at a time. Alternatively, a
+        NewickSplits object may be passed, allowing the splits of a set of support
+        trees to be collected once and reused for multiple main trees.
         """
-        clade_counts = {}
-        leaf_names_lst = list(self.get_leaf_names())
-        leaf_names = frozenset(leaf_names_lst)
-        if len(leaf_names) != len(leaf_names_lst):
+        leaf_names = list(self.get_leaf_names())
+        if isinstance(bootstraps, NewickSplits):
+            splits = bootstraps
+        else:
+            splits = NewickSplits(leaf_names, bootstraps)
+
+        if len(set(leaf_names)) != len(leaf_names):
             raise NewickError(
                 "Cannot add support values to trees with duplicate leaf names"
             )
+        elif splits.leaf_bits.keys() != set(leaf_names):
+            raise NewickError("Support trees do not contain same set of leaf nodes")
 
-        bootstraps = safe_coerce_to_tuple(bootstraps)
-        for support_tree in bootstraps:
-            support_tree_names = frozenset(support_tree.get_leaf_names())
-            if leaf_names != support_tree_names:
-                raise NewickError(
-                    "Support tree does not contain same set of leaf nodes"
-                )
-
-            support_graph = _NewickGraph(support_tree)
-            for clade in support_graph.get_clade_names():
-                clade_counts[clade] = clade_counts.get(clade, 0) + 1
+        tree, _ = self._add_support(self, splits, fmt)
 
-        return self._add_support(self, len(bootstraps), clade_counts, fmt)
+        return tree
 
     @classmethod
     def from_string(cls, string):
@@ -167,16 +167,7 @@ class Newick(TotallyOrdered, Immutable):
         Note that implicit nodes, such as (), (A,), and the like are not
         allowed, as they cannot always be represented/parsed in an unambigious
         manner. Thus all leaf nodes must have a name and/or a length."""
-        tokens = _tokenize(string)
-        if tokens and tokens[0] == "(":
-            top_node = _parse_tokens(tokens)
-        else:
-            top_node = _parse_child(tokens)
-
-        if tokens != [";"]:
-            raise NewickParseError("Missing terminating semi-colon")
-
-        return top_node
+        return _parse_tokens(_tokenize(string))
 
     def __lt__(self, other):
         """See TotallyOrdered"""
@@ -215,94 +206,192 @@ class Newick(TotallyOrdered, Immutable):
             fields.append(str(self.length))
         return "".join(fields)
 
-    def _add_support(self, node, total, clade_counts, fmt):
+    def _add_support(self, node, splits, fmt):
         """Recursively annotates a subtree with support values,
         excepting leaf nodes (where the name is preserved) and
-        the root node (where the name is cleared)."""
+        the root node (where the name is cleared). Returns the
+        new node and the bit-mask of leaves in the subtree."""
         if node.is_leaf:
-            return node
+            return node, splits.leaf_bits[node.name]
+
+        clade = 0
+        children = []
+        for child in node.children:
+            child, child_clade = self._add_support(child, splits, fmt)
+
+            children.append(child)
+            clade |= child_clade
 
-        clade = frozenset(leaf.name for leaf in node.get_leaf_nodes())
-        support = clade_counts.get(clade, 0)
+        support = splits.count(clade)
+        total = splits.total
         name = fmt.format(
             Support=support,
             Percentage=(support * 100.0) / (total or 1),
             Fraction=(support * 1.0) / (total or 1),
         )
 
-        children = []
-        for child in node.children:
-            children.append(self._add_support(child, total, clade_counts, fmt))
-
-        return Newick(
+        node = Newick(
             name=(None if (node is self) else name),
             length=node.length,
             children=children,
         )
 
+        return node, clade
+
+
+class NewickSplits:
+    """Counts of the splits (bipartitions of leaves) found in a set of unrooted or
+    arbitrarily rooted trees, for use with Newick.add_support. Support trees may be
+    any iterable, including generators, in which case only a single support tree is
+    kept in memory at a time."""
+
+    def __init__(self, leaf_names, trees):
+        # Leaves are represented as bits, and clades as the bitwise OR of leaves
+        leaf_names = list(leaf_names)
+        self.leaf_bits = dict((name, 1 << idx) for (idx, name) in enumerate(leaf_names))
+        if len(self.leaf_bits) != len(leaf_names):
+            raise NewickError(
+                "Cannot add support values to trees with duplicate leaf names"
+            )
+
+        self._all_leaves = (1 << len(leaf_names)) - 1
+        if isinstance(trees, Newick):
+            trees = (trees,)
+
+        self.total = 0
+        self._counts = collections.Counter()
+        for tree in trees:
+            self._counts.update(_collect_splits(tree, self.leaf_bits, self._all_leaves))
+            self.total += 1
+
+    def count(self, clade):
+        """Returns the number of trees containing the split between the leaves in
+        the bit-mask 'clade' and all other leaves."""
+        return self._counts.get(_canonical_split(clade, self._all_leaves), 0)
+
+
+def _collect_splits(tree, leaf_bits, all_leaves):
+    """Returns the set of splits (bipartitions of leaves) found in a tree, with each
+    split represented as a bit-mask of leaves in canonical form; namely the side of
+    the split that does not contain the first leaf. The rooting of the tree is thus
+    ignored. Raises NewickError if the tree does not contain the expected leaves."""
+    splits = set()
+    observed = 0
+    # Post-order traversal; the clade of a node is known once all children are done
+    clades = []
+    stack = [(tree, False)]
+    while stack:
+        node, visited = stack.pop()
+        if node.is_leaf:
+            try:
+                clade = leaf_bits[node.name]
+            except KeyError:
+                raise NewickError(
+                    "Support tree does not contain same set of leaf nodes"
+                )
+
+            observed |= clade
+            clades.append(clade)
+        elif visited:
+            clade = 0
+            for _ in node.children:
+                clade |= clades.pop()
+
+            clades.append(clade)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+            continue
+
+        clade = _canonical_split(clade, all_leaves)
+        if clade:
+            splits.add(clade)
+
+    if observed != all_leaves:
+        raise NewickError("Support tree does not contain same set of leaf nodes")
+
+    return splits
+
+
+def _canonical_split(clade, all_leaves):
+    """Returns the side of a split that does not contain the first leaf."""
+    if clade & 1:
+        return clade ^ all_leaves
+
+    return clade
+
 
 ################################################################################
 ################################################################################
 # Functions related to NEWICK parsing
 
 _TOKENIZER = re.compile("([():,;])")
-_NODE_KEYS = frozenset(("name", "length", "children"))
+_DELIMITERS = frozenset("():,;")
 
 
 def _tokenize(string):
-    result = []
-    for field in _TOKENIZER.split(string):
-        field = field.strip()
-        if field:
-            result.append(field)
-    return result
+    return [field for field in map(str.strip, _TOKENIZER.split(string)) if field]
 
 
 def _parse_tokens(tokens):
-    assert tokens and tokens[0] == "("
-
-    tokens.pop(0)
-    child, children = None, []
-    while tokens and (tokens[0] not in ");"):
-        if tokens[0] == ",":
-            children.append(child)
-            tokens.pop(0)
-        child = _parse_child(tokens)
-    children.append(child)
-
-    if any(child is None for child in children):
-        raise NewickParseError(
-            "Implicit leaf nodes (no name OR length) are not allowed"
-        )
-    elif not tokens or (tokens[0] != ")"):
-        raise NewickParseError(
-            "Malformed Newick string, contains unbalanced parantheses"
-        )
-    tokens.pop(0)
-
-    return _parse_child(tokens, children=children)
-
+    """Parses a list of tokens using an explicit stack, rather than recursion, in
+    order to support arbitrarily deep trees. Returns the top node of the tree."""
+    # Lists of child nodes for each currently open parenthesis
+    stack = []
+    # Name, length, and children of the node currently being parsed
+    name = length = children = None
+
+    tokens = iter(tokens)
+    for token in tokens:
+        if token == "(":
+            if name is not None or length is not None or children is not None:
+                raise NewickParseError("Malformed Newick string, unexpected '('")
+
+            stack.append([])
+        elif token in ",);":
+            if name is None and length is None and children is None:
+                raise NewickParseError(
+                    "Implicit leaf nodes (no name OR length) are not allowed"
+                )
 
-def _parse_child(tokens, children=None):
-    if tokens and tokens[0] == "(":
-        return _parse_tokens(tokens)
+            node = Newick(name=name, length=length, children=children)
+            name = length = children = None
+
+            if token == ";":
+                if stack:
+                    raise NewickParseError(
+                        "Malformed Newick string, contains unbalanced parantheses"
+                    )
+                elif next(tokens, None) is not None:
+                    raise NewickParseError("Unexpected data after terminating ';'")
+
+                return node
+            elif not stack:
+                raise NewickParseError(
+                    "Malformed Newick string, contains unbalanced parantheses"
+                )
 
-    name, length = None, None
-    while tokens and (tokens[0] not in ",);"):
-        if tokens[0] == ":":
+            stack[-1].append(node)
+            if token == ")":
+                children = stack.pop()
+        elif token == ":":
             if length is not None:
                 raise NewickParseError("Node has multiple length values")
-            tokens.pop(0)
-            if tokens[0] in ",);":
+
+            length = next(tokens, ";")
+            if length in _DELIMITERS:
                 raise NewickParseError("Missing length value")
-            length = tokens.pop(0).strip()
+        elif name is None and length is None:
+            name = token
         else:
-            name = tokens.pop(0).strip()
+            raise NewickParseError("Malformed Newick string, unexpected %r" % (token,))
 
-    if not (name or length or children):
-        raise NewickParseError("Parsing of implicit nodes not supported")
+    if stack:
+        raise NewickParseError(
+            "Malformed Newick string, contains unbalanced parantheses"
+        )
 
-    return Newick(name=name, length=length, children=children)
+    raise NewickParseError("Missing terminating semi-colon")
 
 
 ################################################################################
@@ -21,7 +21,6 @@
 # SOFTWARE.
 #
 
-from paleomix.common.utilities import grouper
 from paleomix.common.formats.msa import MSA
 
 
@@ -35,36 +34,91 @@ _LINE_SIZE = _NUM_BLOCKS * _BLOCK_SIZE + (_NUM_BLOCKS - 1) * _BLOCK_SPACING
 
 def interleaved_phy(msa, add_flag=False, max_name_length=_MAX_NAME_LENGTH):
     MSA.validate(msa)
-    header = "%i %i" % (len(msa), msa.seqlen())
+    records = sorted(msa)
+    lines = _interleaved_phy_lines(
+        names=[record.name for record in records],
+        sequences=[record.sequence for record in records],
+        seqlen=msa.seqlen(),
+        add_flag=add_flag,
+        max_name_length=max_name_length,
+    )
+
+    return "\n".join(lines)
+
+
+def write_interleaved_phy(
+    handle,
+    names,
+    sequences,
+    seqlen,
+    add_flag=False,
+    max_name_length=_MAX_NAME_LENGTH,
+):
+    """Writes an interleaved PHYLIP file identical to that produced by
+    'interleaved_phy', but without requiring that the sequences are held in
+    memory. 'sequences' may be any objects that return strings when sliced,
+    each of length 'seqlen', and are written in the order given in 'names'."""
+    lines = _interleaved_phy_lines(
+        names=names,
+        sequences=sequences,
+        seqlen=seqlen,
+        add_flag=add_flag,
+        max_name_length=max_name_length,
+    )
+
+    handle.write(next(lines))
+    for line in lines:
+        handle.write("\n")
+        handle.write(line)
+
+
+def _interleaved_phy_lines(names, sequences, seqlen, add_flag, max_name_length):
+    header = "%i %i" % (len(names), seqlen)
     if add_flag:
         header += " I"
-    result = [header, ""]
 
-    padded_len = min(max_name_length, max(len(name) for name in msa.names())) + 2
+    yield header
+    yield ""
+
+    padded_len = min(max_name_length, max(len(name) for name in names)) + 2
     padded_len -= padded_len % -(_BLOCK_SIZE + _BLOCK_SPACING) + _BLOCK_SPACING
 
-    streams = []
-    spacing = " " * _BLOCK_SPACING
-    for record in sorted(msa):
-        name = record.name[:max_name_length]
-        padding = (padded_len - len(name)) * " "
-
-        lines = []
-        line = [name, padding]
-        for block in grouper(_BLOCK_SIZE, record.sequence, fillvalue=""):
-            block = "".join(block)
-            if sum(len(segment) for segment in line) >= _LINE_SIZE:
-                lines.append("".join(line))
-                line = [block]
-            else:
-                line.extend((spacing, block))
-
-        lines.append("".join(line))
-        streams.append(lines)
-
-    for rows in zip(*streams):
-        result.extend(row for row in rows)
-        result.append("")
-    result.pop()
-
-    return "\n".join(result)
+    prefixes = []
+    for name in names:
+        name = name[:max_name_length]
+        prefixes.append(name + (padded_len - len(name)) * " ")
+
+    # The first line of each sequence contains fewer bases, due to the name
+    start, end = 0, _blocks_per_line(padded_len) * _BLOCK_SIZE
+    for prefix, sequence in zip(prefixes, sequences):
+        row = _format_blocks(sequence[start:end])
+
+        yield prefix + _BLOCK_SPACING * " " + row if row else prefix
+
+    # Subsequent lines start with a block, rather than with spacing
+    line_size = _blocks_per_line(_BLOCK_SIZE - _BLOCK_SPACING) * _BLOCK_SIZE
+    while end < seqlen:
+        yield ""
+
+        start, end = end, end + line_size
+        for sequence in sequences:
+            yield _format_blocks(sequence[start:end])
+
+
+def _blocks_per_line(offset):
+    """Returns the number of blocks that fit on a line, following 'offset'
+    characters, with each block preceded by spacing."""
+    blocks = 0
+    while offset < _LINE_SIZE:
+        offset += _BLOCK_SPACING + _BLOCK_SIZE
+        blocks += 1
+
+    return blocks
+
+
+def _format_blocks(sequence):
+    blocks = []
+    for start in range(0, len(sequence), _BLOCK_SIZE):
+        blocks.append(sequence[start : start + _BLOCK_SIZE])
+
+    return (_BLOCK_SPACING * " ").join(blocks)
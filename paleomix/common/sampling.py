@@ -49,7 +49,10 @@ def weighted_sampling(choices, weights, rng=random):
         yield choices[index]
 
 
-def reservoir_sampling(items, downsample_to, rng=random):
+def reservoir_sampling(items, downsample_to, rng=random, reservoir=None):
+    """Returns a random sample of at most 'downsample_to' items. If 'reservoir'
+    is specified, this (empty) list-like object (e.g. an array.array) is used
+    to store the sampled items, and is returned instead of a new list."""
     if not isinstance(downsample_to, int):
         raise TypeError(
             "Unexpected type for 'downsample_to': %r" % (type(downsample_to),)
@@ -57,7 +60,9 @@ def reservoir_sampling(items, downsample_to, rng=random):
     elif downsample_to < 0:
         raise ValueError("Negative value for 'downsample_to': %i" % (downsample_to,))
 
-    reservoir = []
+    if reservoir is None:
+        reservoir = []
+
     for (index, item) in enumerate(items):
         if index >= downsample_to:
             index = rng.randint(0, index)
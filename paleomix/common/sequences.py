@@ -34,6 +34,8 @@ for (_a, _b) in _COMPL:
         _COMPL_TABLE[ord(_func(_a))] = _func(_b)
         _COMPL_TABLE[ord(_func(_b))] = _func(_a)
 _COMPL_TABLE = "".join(_COMPL_TABLE)
+# Translation table for complementing (ASCII encoded) bytes/bytearrays
+_COMPL_BYTES_TABLE = _COMPL_TABLE.encode("ascii")
 
 
 # Table of nt codes (IUPAC codes) used to encode (ambigious) bases:
@@ -66,10 +68,12 @@ for (_abr, _nts) in NT_CODES:
 
 NT_CODES = dict(NT_CODES)
 
-
 def complement(sequence):
-    """Returns the complement of a DNA sequence (string)."""
-    return sequence.translate(_COMPL_TABLE)
+    """Returns the complement of a DNA sequence (string, bytes, or bytearray)."""
+    if isinstance(sequence, str):
+        return sequence.translate(_COMPL_TABLE)
+
+    return sequence.translate(_COMPL_BYTES_TABLE)
 
 
 def reverse_complement(sequence):
@@ -101,12 +105,39 @@ def split(sequence, split_by="123"):
     if not split_by:
         raise ValueError("No split_by specified")
 
-    results = dict((key, []) for key in split_by)
-    keys = itertools.chain(itertools.cycle(split_by))
-    for (key, nucleotide) in zip(keys, sequence):
-        results[key].append(nucleotide)
-
-    for key in results:
-        results[key] = "".join(results[key])
+    step = len(split_by)
+    results = {}
+    for key in split_by:
+        if key not in results:
+            offsets = [idx for idx, value in enumerate(split_by) if value == key]
+            if len(offsets) == 1:
+                results[key] = sequence[offsets[0] :: step]
+            else:
+                # Interleave positions belonging to the same partition
+                slices = [sequence[offset::step] for offset in offsets]
+                results[key] = _interleave(slices)
 
     return results
+
+
+def _interleave(slices):
+    """Interleaves the values in a list of strings/bytes, the lengths of which must
+    be non-increasing and differ by at most one (as is the case when slicing a
+    sequence). ASCII text is interleaved using strided assignment to a bytearray.
+    """
+    if isinstance(slices[0], str):
+        if not all(value.isascii() for value in slices):
+            return "".join(
+                "".join(nucleotides)
+                for nucleotides in itertools.zip_longest(*slices, fillvalue="")
+            )
+
+        slices = [value.encode("ascii") for value in slices]
+
+        return _interleave(slices).decode("ascii")
+
+    result = bytearray(sum(map(len, slices)))
+    for offset, value in enumerate(slices):
+        result[offset :: len(slices)] = value
+
+    return bytes(result)
@@ -204,9 +204,9 @@ def _trim_chunk(options, chunk):
 
 
 def _group_indels_near_position(indels, distance):
-    """Returns a dictionary of positions that are either directly covered by, or
-    adjacent to indels, given some arbitrary distance. For each position, a list
-    of adjacent/overlapping indels are provided."""
+    """Returns a dictionary of (contig, position) pairs that are either directly
+    covered by, or adjacent to indels, given some arbitrary distance. For each
+    position, a list of adjacent/overlapping indels are provided."""
     positions = collections.defaultdict(list)
     if not distance:
         return positions
@@ -224,7 +224,7 @@ def _group_indels_near_position(indels, distance):
         end = vcf.pos + 1 + distance + length
 
         for position in range(start, end + 1):
-            positions[position].append(vcf)
+            positions[(vcf.contig, position)].append(vcf)
 
     return positions
 
@@ -259,10 +259,10 @@ def _filter_by_indels(options, chunk):
 
     for vcf in chunk:
         if vcfwrap.is_indel(vcf):
-            blacklisted = indel_blacklist.get(vcf.pos + 1, [vcf])
+            blacklisted = indel_blacklist.get((vcf.contig, vcf.pos + 1), [vcf])
             if vcf is not _select_best_indel(blacklisted):
                 _mark_as_filtered(vcf, "W:%i" % distance_between)
-        elif (vcf.alt != ".") and (vcf.pos in snp_blacklist):
+        elif (vcf.alt != ".") and ((vcf.contig, vcf.pos) in snp_blacklist):
             # TODO: How to handle heterozygous SNPs near
             _mark_as_filtered(vcf, "w:%i" % distance_to)
 
@@ -252,12 +252,20 @@ class Node:
 
 
 class CommandNode(Node):
-    def __init__(self, command, description=None, threads=1, dependencies=()):
+    def __init__(
+        self, command, description=None, threads=1, dependencies=(), output_files=None
+    ):
+        """Creates a node that runs the specified command. The output files of the
+        node are those of the command, unless a different set of 'output_files'
+        is specified, e.g. for files moved into place by the node itself."""
+        if output_files is None:
+            output_files = command.output_files
+
         Node.__init__(
             self,
             description=description,
             input_files=command.input_files,
-            output_files=command.output_files,
+            output_files=output_files,
             auxiliary_files=command.auxiliary_files,
             executables=command.executables,
             requirements=command.requirements,
@@ -271,18 +279,35 @@ class CommandNode(Node):
         """Runs the command object provided in the constructor, and waits for it to
         terminate. If any errors during the running of the command, this function
         raises a NodeError detailing the returned error-codes."""
+        self._run_command(self._command, temp)
+
+    def _teardown(self, config, temp):
+        self._check_temp_files(
+            temp, self._command.expected_temp_files, self._command.optional_temp_files
+        )
+
+        self._command.commit(temp)
+
+        Node._teardown(self, config, temp)
+
+    @classmethod
+    def _run_command(cls, command, temp):
+        """Runs a command object in the folder 'temp' and waits for it to terminate;
+        raises a CmdNodeError if the command could not be run or if it failed."""
         try:
-            self._command.run(temp)
+            command.run(temp)
         except CmdError as error:
-            raise CmdNodeError("%s\n\n%s" % (str(self._command), error))
+            raise CmdNodeError("%s\n\n%s" % (str(command), error))
 
-        return_codes = self._command.join()
+        return_codes = command.join()
         if any(return_codes):
-            raise CmdNodeError(str(self._command))
+            raise CmdNodeError(str(command))
 
-    def _teardown(self, config, temp):
-        required_files = self._command.expected_temp_files
-        optional_files = self._command.optional_temp_files
+    @classmethod
+    def _check_temp_files(cls, temp, required_files, optional_files=frozenset()):
+        """Checks that all required files were created in the folder 'temp', and
+        that no files were created other than the required and optional files;
+        raises a CmdNodeError otherwise."""
         current_files = set(os.listdir(temp))
 
         missing_files = required_files - current_files
@@ -305,10 +330,6 @@ class CommandNode(Node):
                 % (temp, "\n\t    - ".join(sorted(map(repr, extra_files))))
             )
 
-        self._command.commit(temp)
-
-        Node._teardown(self, config, temp)
-
 
 # Types that are allowed for the 'description' property
 _DESC_TYPES = (str, type(None))
@@ -25,17 +25,29 @@
 Each node is equivalent to a particular command:
     $ paleomix [...]
 """
-from paleomix.node import CommandNode, Node
+import os
+import random
+
+import pysam
+
+from paleomix.node import CommandNode, Node, NodeError
 from paleomix.atomiccmd.command import AtomicCmd
 from paleomix.atomiccmd.sets import ParallelCmds
 from paleomix.atomiccmd.builder import (
     AtomicCmdBuilder,
     apply_options,
 )
+from paleomix.common.bedtools import (
+    merge_bed_records,
+    read_bed_file,
+    split_bed_records,
+    BEDRecord,
+)
 from paleomix.common.fileutils import describe_files, reroot_path, move_file
 from paleomix.nodes.samtools import merge_bam_files_command, BCFTOOLS_VERSION
 
 import paleomix.tools.bam_stats.coverage as coverage
+import paleomix.tools.depths as depths
 import paleomix.tools.factory as factory
 
 
@@ -118,6 +130,87 @@ class DepthHistogramNode(CommandNode):
         )
 
 
+class EstimateMaxDepthNode(Node):
+    """Estimates the maximum read depth to use when genotyping a BAM file, based on
+    the read depths of a random sample of sites in a set of regions (or in the entire
+    genome, if no regions are given). The result is written as a depth histogram in
+    the same format as 'paleomix depths', for use with 'vcf_filter'.
+    """
+
+    def __init__(
+        self,
+        target_name,
+        input_file,
+        output_file,
+        regions_file=None,
+        fraction=0.01,
+        index_format=".bai",
+        dependencies=(),
+    ):
+        if not (0 < fraction <= 1):
+            raise ValueError("fraction must be in the range (0, 1]: %r" % (fraction,))
+
+        self._target_name = target_name
+        self._input_file = input_file
+        self._output_file = output_file
+        self._regions_file = regions_file
+        self._fraction = fraction
+
+        input_files = [input_file, input_file + index_format]
+        if regions_file:
+            input_files.append(regions_file)
+
+        Node.__init__(
+            self,
+            description="<EstimateMaxDepth: %s -> '%s'>" % (input_file, output_file),
+            input_files=input_files,
+            output_files=[output_file],
+            dependencies=dependencies,
+        )
+
+    def _run(self, _config, temp):
+        regions = None
+        if self._regions_file:
+            regions = list(read_bed_file(self._regions_file))
+
+        # A fixed seed is used, so that results do not change when re-run
+        with pysam.AlignmentFile(self._input_file) as handle:
+            counts, num_sites = depths.sample_depth_counts(
+                handle=handle,
+                regions=regions,
+                fraction=self._fraction,
+                rng=random.Random(0),
+            )
+
+        # A histogram without a MaxDepth value cannot be used by 'vcf_filter', so
+        # fail here rather than when the histogram is read during genotyping
+        if depths.calc_max_depth(counts) == "NA":
+            raise NodeError(
+                "Could not estimate MaxDepth for %r from the read depths of %i "
+                "sampled sites" % (self._input_file, num_sites)
+            )
+
+        # The BAM is identified for reference only; the node is re-run by the
+        # pipeline whenever the BAM is newer than the histogram
+        stat = os.stat(self._input_file)
+        comments = (
+            "Estimated from %i sampled sites in %r" % (num_sites, self._input_file),
+            "BAM size = %i, BAM mtime = %i" % (stat.st_size, stat.st_mtime_ns),
+        )
+
+        temp_file = reroot_path(temp, self._output_file)
+        with open(temp_file, "w") as handle:
+            depths.write_table(
+                handle=handle,
+                name=self._target_name,
+                totals={("*", "*", "*"): counts},
+                lengths={"*": num_sites},
+                comments=comments,
+            )
+
+        move_file(temp_file, self._output_file)
+
+
 class FilterCollapsedBAMNode(CommandNode):
     def __init__(
         self, config, input_bams, output_bam, keep_dupes=True, dependencies=()
@@ -140,14 +233,33 @@ class FilterCollapsedBAMNode(CommandNode):
 
 
 class VCFFilterNode(CommandNode):
-    def __init__(self, infile, outfile, regions, options, dependencies=()):
+    def __init__(
+        self,
+        infile,
+        outfile,
+        regions,
+        options,
+        threads=1,
+        max_read_depth_file=None,
+        dependencies=(),
+    ):
         vcffilter = factory.new("vcf_filter")
         vcffilter.add_value("%(IN_VCF)s")
 
+        if max_read_depth_file is not None:
+            # Depth histogram (e.g. from EstimateMaxDepthNode) read at run time
+            vcffilter.set_option("--max-read-depth-file", "%(IN_MAX_DEPTH)s")
+            vcffilter.set_kwargs(IN_MAX_DEPTH=max_read_depth_file)
+
         for contig in regions["HomozygousContigs"]:
             vcffilter.add_option("--homozygous-chromosome", contig)
         vcffilter.set_kwargs(IN_VCF=infile, OUT_STDOUT=AtomicCmd.PIPE)
 
+        if threads > 1:
+            # Multi-threaded filtering requires random access to the VCF
+            vcffilter.set_option("--threads", threads)
+            vcffilter.set_kwargs(IN_TABIX=infile + ".tbi")
+
         apply_options(vcffilter, options)
 
         bgzip = AtomicCmdBuilder(["bgzip"], IN_STDIN=vcffilter, OUT_STDOUT=outfile)
@@ -157,6 +269,7 @@ class VCFFilterNode(CommandNode):
             self,
             description=description,
             command=ParallelCmds([vcffilter.finalize(), bgzip.finalize()]),
+            threads=threads,
             dependencies=dependencies,
         )
 
@@ -212,6 +325,91 @@ class GenotypeRegionsNode(CommandNode):
         )
 
 
+class SplitRegionsNode(Node):
+    """Splits a set of regions into N BED files, each covering (nearly) the same
+    number of bases, in order to allow regions to be genotyped in parallel. Regions
+    are read from a BED file, in which case overlapping regions are merged, or from
+    the FASTA index of the reference sequence, in order to split the entire genome.
+    """
+
+    def __init__(self, outfiles, bedfile=None, fai_file=None, dependencies=()):
+        if (bedfile is None) == (fai_file is None):
+            raise ValueError("either a BED file or a FASTA index must be specified")
+        elif not outfiles:
+            raise ValueError("no output files specified")
+
+        self._bedfile = bedfile
+        self._fai_file = fai_file
+        self._outfiles = tuple(outfiles)
+
+        infile = bedfile or fai_file
+        Node.__init__(
+            self,
+            description="<SplitRegions: '%s' -> %i shards>"
+            % (infile, len(self._outfiles)),
+            input_files=[infile],
+            output_files=self._outfiles,
+            dependencies=dependencies,
+        )
+
+    def _run(self, _config, temp):
+        if self._bedfile is not None:
+            records = merge_bed_records(read_bed_file(self._bedfile))
+        else:
+            records = []
+            with open(self._fai_file) as handle:
+                for line in handle:
+                    name, length, _ = line.split("\t", 2)
+                    records.append(BEDRecord("%s\t0\t%s" % (name, length)))
+
+        shards = split_bed_records(records, len(self._outfiles))
+        if not all(shards):
+            # Shards are genotyped separately, and must each contain some regions
+            raise NodeError(
+                "Cannot split %i bp of regions in %r into %i non-empty shards"
+                % (
+                    sum(record.end - record.start for record in records),
+                    self._bedfile or self._fai_file,
+                    len(self._outfiles),
+                )
+            )
+
+        for outfile, shard in zip(self._outfiles, shards):
+            with open(reroot_path(temp, outfile), "w") as handle:
+                for record in shard:
+                    print(record, file=handle)
+
+    def _teardown(self, _config, temp):
+        for outfile in self._outfiles:
+            move_file(reroot_path(temp, outfile), outfile)
+
+
+class ConcatVCFNode(CommandNode):
+    """Concatenates bgzip compressed VCF files generated for consecutive regions,
+    using 'bcftools concat --naive'. The BGZF blocks of the input files are copied
+    without being re-compressed, and only the header of the first file is kept;
+    input files should therefore have identical headers, e.g. by generating them
+    using the '--no-version' option.
+    """
+
+    def __init__(self, infiles, outfile, dependencies=()):
+        concat = AtomicCmdBuilder(
+            ("bcftools", "concat", "--naive"),
+            OUT_VCF=outfile,
+            CHECK_VERSION=BCFTOOLS_VERSION,
+        )
+
+        concat.set_option("--output", "%(OUT_VCF)s")
+        concat.add_multiple_values(infiles)
+
+        CommandNode.__init__(
+            self,
+            description="<ConcatVCF: %s -> '%s'>" % (describe_files(infiles), outfile),
+            command=concat.finalize(),
+            dependencies=dependencies,
+        )
+
+
 class BuildRegionsNode(CommandNode):
     def __init__(self, infile, bedfile, outfile, padding, options={}, dependencies=()):
         params = factory.new("vcf_to_fasta")
@@ -237,6 +435,46 @@ class BuildRegionsNode(CommandNode):
         )
 
 
+class BuildRegionsBatchNode(CommandNode):
+    """Builds consensus sequences for multiple sets of regions of interest from
+    a single VCF file, using a single pass over the VCF file."""
+
+    def __init__(
+        self,
+        infile,
+        bedfiles,
+        outfiles,
+        padding,
+        options={},
+        threads=1,
+        dependencies=(),
+    ):
+        params = factory.new("vcf_to_fasta")
+        params.set_option("--padding", padding)
+        params.set_option("--genotype", "%(IN_VCFFILE)s")
+        params.set_option("--threads", threads)
+        params.add_multiple_options(
+            "--intervals", bedfiles, template="IN_INTERVALS_%02i"
+        )
+        params.add_multiple_options("--output", outfiles, template="OUT_FASTA_%02i")
+
+        params.set_kwargs(IN_VCFFILE=infile, IN_TABIX=infile + ".tbi")
+
+        apply_options(params, options)
+
+        description = "<BuildRegions: '%s' -> %s>" % (
+            infile,
+            describe_files(outfiles),
+        )
+        CommandNode.__init__(
+            self,
+            description=description,
+            command=params.finalize(),
+            threads=threads,
+            dependencies=dependencies,
+        )
+
+
 def _apply_samtools_options(builder, options, argument):
     for (key, value) in dict(options).items():
         sam_argument = key
@@ -20,12 +20,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import contextlib
 import copy
+import mmap
+import os
 
-from paleomix.node import Node
+from paleomix.node import Node, NodeError
 from paleomix.common.fileutils import move_file, reroot_path
-from paleomix.common.formats.msa import MSA
-from paleomix.common.formats.phylip import interleaved_phy
+from paleomix.common.formats.msa import MSA, MSAError
+from paleomix.common.formats.phylip import write_interleaved_phy
 
 from paleomix.common.utilities import safe_coerce_to_frozenset, safe_coerce_to_tuple
 
@@ -85,7 +88,63 @@ class FastaToPartitionedInterleavedPhyNode(Node):
         )
 
     def _run(self, _config, temp):
-        merged_msas = []
+        # Pass one: Partitions are merged and reduced one gene at a time, and the
+        # resulting sequences are appended to temporary, per-taxon files
+        names = None
+        partitions = []
+        with contextlib.ExitStack() as stack:
+            handles = {}
+            for name, msa in self._read_partitions():
+                if names is None:
+                    names = sorted(msa.names())
+                    for idx, taxon in enumerate(names):
+                        filename = os.path.join(temp, "%i.sequence" % (idx,))
+                        handles[taxon] = stack.enter_context(open(filename, "wb"))
+                elif msa.names() != set(names):
+                    raise MSAError(
+                        "Some sequences not found in all MSAs: '%s'"
+                        % ("', '".join(msa.names().symmetric_difference(names)),)
+                    )
+
+                for record in msa:
+                    handles[record.name].write(record.sequence.encode("ascii"))
+
+                partitions.append((name, msa.seqlen()))
+
+        if names is None:
+            raise NodeError("No sequences left after filtering/reducing alignments")
+
+        # Pass two: The interleaved blocks are written using the per-taxon files
+        seqlen = sum(length for (_, length) in partitions)
+        filenames = [
+            os.path.join(temp, "%i.sequence" % (idx,)) for idx in range(len(names))
+        ]
+
+        out_fname_phy = reroot_path(temp, self._out_prefix + ".phy")
+        with contextlib.ExitStack() as stack:
+            sequences = []
+            for filename in filenames:
+                sequences.append(stack.enter_context(_MappedSequence(filename)))
+
+            with open(out_fname_phy, "w") as output_phy:
+                write_interleaved_phy(output_phy, names, sequences, seqlen)
+
+        for filename in filenames:
+            os.remove(filename)
+
+        partition_end = 0
+        out_fname_parts = reroot_path(temp, self._out_prefix + ".partitions")
+        with open(out_fname_parts, "w") as output_part:
+            for (name, length) in partitions:
+                output_part.write(
+                    "DNA, %s = %i-%i\n"
+                    % (name, partition_end + 1, partition_end + length)
+                )
+                partition_end += length
+
+    def _read_partitions(self):
+        """Yields the name and merged (and optionally reduced) MSA of each
+        partition, reading the input files for one gene at a time."""
         for (name, files_dd) in sorted(self._infiles.items()):
             partitions = files_dd["partitions"]
             msas = dict((key, []) for key in partitions)
@@ -104,23 +163,7 @@ class FastaToPartitionedInterleavedPhyNode(Node):
                     merged_msa = merged_msa.reduce()
 
                 if merged_msa is not None:
-                    merged_msas.append(("%s_%s" % (name, key), merged_msa))
-
-        out_fname_phy = reroot_path(temp, self._out_prefix + ".phy")
-        with open(out_fname_phy, "w") as output_phy:
-            final_msa = MSA.join(*(msa for (_, msa) in merged_msas))
-            output_phy.write(interleaved_phy(final_msa))
-
-        partition_end = 0
-        out_fname_parts = reroot_path(temp, self._out_prefix + ".partitions")
-        with open(out_fname_parts, "w") as output_part:
-            for (name, msa) in merged_msas:
-                length = msa.seqlen()
-                output_part.write(
-                    "DNA, %s = %i-%i\n"
-                    % (name, partition_end + 1, partition_end + length)
-                )
-                partition_end += length
+                    yield "%s_%s" % (name, key), merged_msa
 
     def _teardown(self, _config, temp):
         move_file(
@@ -130,3 +173,30 @@ class FastaToPartitionedInterleavedPhyNode(Node):
             reroot_path(temp, self._out_prefix + ".partitions"),
             self._out_prefix + ".partitions",
         )
+
+
+class _MappedSequence:
+    """Memory-mapped sequence, returning strings when sliced."""
+
+    def __init__(self, filename):
+        self._handle = open(filename, "rb")
+        self._mmap = None
+        if os.fstat(self._handle.fileno()).st_size:
+            self._mmap = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getitem__(self, key):
+        if self._mmap is None:
+            return ""
+
+        return self._mmap[key].decode("ascii")
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        self.close()
@@ -22,7 +22,7 @@
 #
 import os
 
-from paleomix.common.formats.newick import Newick
+from paleomix.common.formats.newick import Newick, NewickSplits
 from paleomix.common.utilities import safe_coerce_to_tuple
 from paleomix.common.fileutils import describe_files, move_file
 from paleomix.node import Node
@@ -89,12 +89,18 @@ class NewickSupportNode(Node):
 
     def _run(self, _config, temp):
         main_trees = _read_tree_files(self._main_tree_files)
-        support_trees = _read_tree_files(self._support_tree_files)
 
         lines = []
-        for main_tree in main_trees:
-            supported_tree = main_tree.add_support(support_trees)
-            lines.append(str(supported_tree))
+        if main_trees:
+            # Support trees are read one at a time, to limit memory usage, and the
+            # splits are collected once and reused for every main tree
+            support_trees = _iter_tree_files(self._support_tree_files)
+            leaf_names = main_trees[0].get_leaf_names()
+            splits = NewickSplits(leaf_names, support_trees)
+
+            for main_tree in main_trees:
+                supported_tree = main_tree.add_support(splits)
+                lines.append(str(supported_tree))
         lines = "\n".join(lines) + "\n"
 
         temp_output_file = os.path.join(temp, os.path.basename(self._output_file))
@@ -105,9 +111,11 @@ class NewickSupportNode(Node):
 
 
 def _read_tree_files(filenames):
-    trees = []
+    return list(_iter_tree_files(filenames))
+
+
+def _iter_tree_files(filenames):
     for filename in filenames:
         with open(filename) as handle:
             for line in handle:
-                trees.append(Newick.from_string(line))
-    return trees
+                yield Newick.from_string(line)
@@ -25,10 +25,13 @@ import random
 
 from paleomix.node import Node, NodeError
 from paleomix.common.fileutils import move_file, reroot_path
+from paleomix.common.utilities import safe_coerce_to_tuple
 
 
 class PHYLIPBootstrapNode(Node):
-    """Generates a bootstrap alignment for a partition PHYLIP file;
+    """Generates one or more bootstrap alignments for a partition PHYLIP file;
+    the input alignment is only read once, regardless of the number of
+    bootstrap alignments generated.
 
     Note that only the PHYLIP / partitions format produced by the Node
     FastaToPartitionedInterleavedPhyNode is supported, in addition to the
@@ -37,9 +40,12 @@ class PHYLIPBootstrapNode(Node):
     Parameters:
       -- input_alignment  - The input alignment file in PHYLIP format
       -- input_partition  - The input partition file in RAxML format
-      -- output_alignment - The output alignment file in PHYLIP format
+      -- output_alignment - The output alignment file(s) in PHYLIP format;
+                            one bootstrap alignment is generated per file.
                             The simple (RAxML like) sequential format is used.
-      -- seed             - RNG seed for selecting alignment columns."""
+      -- seed             - RNG seed for selecting alignment columns; either a
+                            single seed, from which a seed is drawn for each
+                            output file, or a list of seeds (one per file)."""
 
     def __init__(
         self,
@@ -49,53 +55,90 @@ class PHYLIPBootstrapNode(Node):
         seed=None,
         dependencies=(),
     ):
+        output_alignment = safe_coerce_to_tuple(output_alignment)
+        if isinstance(seed, (list, tuple)):
+            seeds = tuple(seed)
+        else:
+            rng = random.Random(seed)
+            seeds = tuple(rng.getrandbits(32) for _ in output_alignment)
+
+        if len(seeds) != len(output_alignment):
+            raise ValueError("Number of seeds does not match number of alignments")
+
         self._input_phy = input_alignment
         self._input_part = input_partition
         self._output_phy = output_alignment
-        self._seed = seed
+        self._seeds = seeds
+
+        if len(output_alignment) == 1:
+            (description,) = output_alignment
+            description = repr(description)
+        else:
+            description = "%i alignments" % (len(output_alignment),)
 
         Node.__init__(
             self,
-            description="<PHYLIPBootstrap: %r -> %r>"
-            % (input_alignment, output_alignment),
+            description="<PHYLIPBootstrap: %r -> %s>" % (input_alignment, description),
             input_files=(input_alignment, input_partition),
-            output_files=(output_alignment,),
+            output_files=output_alignment,
             dependencies=dependencies,
         )
 
     def _run(self, _config, temp):
-        if self._seed is not None:
-            rng = random.Random(self._seed)
         partitions = _read_partitions(self._input_part)
         header, names, sequences = _read_sequences(self._input_phy)
-        bootstraps = self._bootstrap_sequences(sequences, partitions, rng)
+        header = header.encode("ascii")
+        names = [("%s " % (name,)).encode("ascii") for name in names]
+        columns = self._build_columns(sequences)
+        # Sequences are no longer needed, as columns hold copies of all bases
+        del sequences[:]
+
+        for filename, seed in zip(self._output_phy, self._seeds):
+            rng = random.Random(seed)
+            bootstrap = self._bootstrap_columns(columns, len(names), partitions, rng)
+
+            temp_fpath = reroot_path(temp, filename)
+            with open(temp_fpath, "wb") as output_phy:
+                output_phy.write(header)
 
-        temp_fpath = reroot_path(temp, self._output_phy)
-        with open(temp_fpath, "w") as output_phy:
-            output_phy.write(header)
+                # Every Nth base in the bootstrap belongs to the same sequence
+                for idx, name in enumerate(names):
+                    output_phy.write(name)
+                    output_phy.write(bootstrap[idx :: len(names)])
+                    output_phy.write(b"\n")
 
-            for (name, fragments) in zip(names, bootstraps):
-                output_phy.write(name)
-                output_phy.write(" ")
-                for sequence in fragments:
-                    output_phy.write(sequence)
-                output_phy.write("\n")
+    def _teardown(self, config, temp):
+        for filename in self._output_phy:
+            move_file(reroot_path(temp, filename), filename)
 
-        move_file(temp_fpath, self._output_phy)
+        Node._teardown(self, config, temp)
 
     @classmethod
-    def _bootstrap_sequences(cls, sequences, partitions, rng):
-        final_partitions = [[] for _ in sequences]
-        for (start, end) in partitions:
-            # Convert alignment to columns, and randomly select among those
-            columns = list(zip(*(sequence[start:end] for sequence in sequences)))
-            bootstrap_partition = (rng.choice(columns) for _ in columns)
+    def _build_columns(cls, sequences):
+        """Returns the alignment as a single, column-major buffer, in which the
+        Nth column is located at offset N * len(sequences)."""
+        num_sequences = len(sequences)
+        if not num_sequences:
+            return bytearray()
+
+        buffer = bytearray(num_sequences * len(sequences[0]))
+        for idx, sequence in enumerate(sequences):
+            buffer[idx::num_sequences] = sequence.encode("ascii")
+
+        return buffer
 
-            # Convert randomly selected columns back into sequences
-            for (dest, partition) in zip(final_partitions, zip(*bootstrap_partition)):
-                dest.append("".join(partition))
+    @classmethod
+    def _bootstrap_columns(cls, columns, num_sequences, partitions, rng):
+        """Randomly selects columns (with replacement) for each partition, and
+        returns the bootstrapped alignment as a single, column-major buffer."""
+        columns = memoryview(columns)
+        bootstrap = []
+        for (start, end) in partitions:
+            for column in rng.choices(range(start, end), k=end - start):
+                offset = column * num_sequences
+                bootstrap.append(columns[offset : offset + num_sequences])
 
-        return final_partitions
+        return b"".join(bootstrap)
 
 
 _RE_PARTITION = re.compile(r"^[A-Z]+, [^ ]+ = (\d+)-(\d+)$")
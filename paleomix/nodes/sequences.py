@@ -25,12 +25,9 @@
 import os
 import copy
 
-import pysam
-
 import paleomix.common.fileutils as fileutils
 import paleomix.common.utilities as utilities
 
-from paleomix.common.formats.fasta import FASTA
 from paleomix.common.formats.msa import MSA
 from paleomix.node import NodeError, Node
 
@@ -40,6 +37,10 @@ class CollectSequencesNode(Node):
         """
         fasta_files -- { taxon_name_1 : filename_1, ... }
         sequences   -- { interval_name_1, ... }
+
+        Sequences are read directly from the (uncompressed) FASTA files using the
+        offsets listed in the .fai index files; to distribute the work across
+        multiple nodes, the set of sequences may simply be split into subsets.
         """
 
         self._infiles = copy.deepcopy(fasta_files)
@@ -68,36 +69,51 @@ class CollectSequencesNode(Node):
 
     def _setup(self, _config, _temp):
         for filename in self._infiles.values():
-            with open(filename + ".fai") as handle:
-                sequences = set()
-                for line in handle:
-                    sequences.add(line.split("\t", 1)[0])
-
-                missing_sequences = list(self._sequences - sequences)
-                if missing_sequences:
-                    if len(missing_sequences) >= 4:
-                        missing_sequences = missing_sequences[:3]
-                        missing_sequences.append("...")
-
-                    message = (
-                        "FASTA file does not contain expected "
-                        "sequences:\n  File =  %r\n  "
-                        "Sequences = %s\n"
-                    ) % (filename, ", ".join(missing_sequences))
-                    raise NodeError(message)
+            sequences = _read_fasta_index(filename)
+
+            missing_sequences = list(self._sequences - frozenset(sequences))
+            if missing_sequences:
+                if len(missing_sequences) >= 4:
+                    missing_sequences = missing_sequences[:3]
+                    missing_sequences.append("...")
+
+                message = (
+                    "FASTA file does not contain expected "
+                    "sequences:\n  File =  %r\n  "
+                    "Sequences = %s\n"
+                ) % (filename, ", ".join(missing_sequences))
+                raise NodeError(message)
 
     def _run(self, _config, temp):
         fasta_files = []
         for (name, filename) in sorted(self._infiles.items()):
-            fasta_files.append((name, pysam.FastaFile(filename)))
+            fasta_files.append((name, filename, _read_fasta_index(filename)))
+
+        # Sequences are collected in the order they are found in the first FASTA
+        # file; as all FASTA files are typically generated from the same set of
+        # regions, this means that every file is read (mostly) sequentially.
+        _, _, first_index = fasta_files[0]
+        sequences = sorted(
+            self._sequences, key=lambda name: _parse_index_entry(first_index[name])[1]
+        )
 
-        for sequence_name in sorted(self._sequences):
-            filename = os.path.join(temp, sequence_name + ".fasta")
-            with open(filename, "w") as out_handle:
-                for (sample, fasta_file) in fasta_files:
-                    sequence = fasta_file.fetch(sequence_name)
-                    fasta = FASTA(sample, sequence_name, sequence)
-                    fasta.write(out_handle)
+        handles = []
+        try:
+            for (sample, filename, index) in fasta_files:
+                handles.append((sample.encode(), open(filename, "rb"), index))
+
+            for sequence_name in sequences:
+                filename = os.path.join(temp, sequence_name + ".fasta")
+                header = b" %s\n" % (sequence_name.encode(),)
+                with open(filename, "wb") as out_handle:
+                    for (sample, in_handle, index) in handles:
+                        entry = _parse_index_entry(index[sequence_name])
+
+                        out_handle.write(b">" + sample + header)
+                        out_handle.write(_read_fasta_sequence(in_handle, entry))
+        finally:
+            for (_, handle, _) in handles:
+                handle.close()
 
     def _teardown(self, _config, temp):
         for destination in sorted(self._outfiles):
@@ -105,6 +121,46 @@ class CollectSequencesNode(Node):
             fileutils.move_file(source, destination)
 
 
+def _read_fasta_index(filename):
+    """Returns {name: entry} for the sequences listed in the .fai file for a FASTA
+    file; entries are only parsed on demand, using '_parse_index_entry'."""
+    index = {}
+    with open(filename + ".fai") as handle:
+        for line in handle:
+            name, entry = line.split("\t", 1)
+            index[name] = entry
+
+    return index
+
+
+def _parse_index_entry(entry):
+    """Returns (length, offset, line bases, line width) for a .fai entry."""
+    return tuple(map(int, entry.split("\t", 4)[:4]))
+
+
+def _read_fasta_sequence(handle, index_entry):
+    """Reads a sequence from an uncompressed FASTA file using a .fai entry, and
+    returns it wrapped at 60 columns (as done by FASTA.write)."""
+    length, offset, line_bases, line_width = index_entry
+    if not length:
+        return b"\n"
+
+    # Number of bytes used by full lines, plus the partial final line (if any)
+    full_lines, remaining = divmod(length, line_bases)
+    handle.seek(offset)
+    data = handle.read(full_lines * line_width + remaining)
+
+    if line_bases != 60 or line_width != 61:
+        data = b"".join(data.split())
+        data = b"\n".join(data[idx : idx + 60] for idx in range(0, length, 60))
+    elif not remaining and data.endswith(b"\n"):
+        # Sequences are already formatted, including the trailing newline, unless
+        # this is the last sequence in a file without a trailing newline
+        return data
+
+    return data + b"\n"
+
+
 class FilterSingletonsNode(Node):
     def __init__(self, input_file, output_file, filter_by, dependencies):
         self._input_file = input_file
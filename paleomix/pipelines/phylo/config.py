@@ -73,6 +73,37 @@ def build_parser():
         type=int,
         help="Maximum number of threads to use for each instance of ExaML [%(default)s]",
     )
+    group.add_argument(
+        "--vcf-filter-max-threads",
+        default=1,
+        type=int,
+        help="Maximum number of threads to use for each instance of vcf_filter; "
+        "multiple threads are used by filtering regions in parallel "
+        "[%(default)s]",
+    )
+    group.add_argument(
+        "--vcf-to-fasta-max-threads",
+        default=1,
+        type=int,
+        help="Maximum number of threads to use when building consensus sequences "
+        "for multiple regions of interest from the same VCF [%(default)s]",
+    )
+    group.add_argument(
+        "--genotyping-shards",
+        default=1,
+        type=int,
+        help="Number of tasks across which the regions (or genome) are split when "
+        "genotyping a sample; tasks are run in parallel and the resulting VCFs "
+        "are concatenated [%(default)s]",
+    )
+    group.add_argument(
+        "--collect-sequences-shards",
+        default=1,
+        type=int,
+        help="Number of tasks across which sequences are split when collecting "
+        "sequences for multiple sequence alignment; tasks are run in parallel "
+        "[%(default)s]",
+    )
     group.add_argument(
         "--max-threads",
         type=int,
@@ -87,6 +118,26 @@ def build_parser():
         "and no tasks are executed.",
     )
 
+    group = parser.add_argument_group("Genotyping")
+    group.add_argument(
+        "--max-depth-sample-fraction",
+        type=float,
+        default=0.01,
+        help="If 'MaxReadDepth' is set to 'auto', but no depth histogram is found "
+        "for a sample, then 'MaxReadDepth' is estimated from the read depths at "
+        "this fraction of sites in the genotyped regions, sampled at random; at "
+        "least 1,000,000 sites are sampled, if possible [%(default)s]",
+    )
+
+    group = parser.add_argument_group("Phylogenetic inference")
+    group.add_argument(
+        "--bootstrap-seed",
+        type=int,
+        default=None,
+        help="Seed used when generating bootstrap alignments for ExaML; if not "
+        "set, a random seed is used [%(default)s]",
+    )
+
     group = parser.add_argument_group("Required paths")
     group.add_argument(
         "--temp-root",
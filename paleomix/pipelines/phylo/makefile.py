@@ -20,6 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import concurrent.futures
+import hashlib
 import logging
 import os
 
@@ -49,13 +51,18 @@ from paleomix.common.makefile import (
     Not,
 )
 
-from paleomix.common.fileutils import swap_ext
+from paleomix.common.fileutils import read_json_cache, swap_ext, write_json_cache
 from paleomix.common.utilities import fill_dict
 from paleomix.common.text import parse_padded_table
 from paleomix.common.bedtools import read_bed_file, BEDError
 from paleomix.common.formats.fasta import FASTA
 
 
+# Incremented when the format of the BAM validation cache changes
+_BAM_CACHE_VERSION = 2
+_BAM_CACHE_FILENAME = "bam_headers.json"
+
+
 def read_makefiles(options, commands):
     logger = logging.getLogger(__name__)
     steps = frozenset(key for (key, _) in commands)
@@ -352,6 +359,10 @@ def _check_bam_sequences(options, mkfile, steps):
     check is only done if genotyping is to be carried out, to reduce the
     overhead of reading the BAM file headers.
 
+    BAM headers are read in parallel, and BAM files that passed validation are
+    recorded in the makefile (keyed by their path, size, and modification time),
+    to be written to a cache file in the destination folder by 'write_bam_cache',
+    so that unchanged BAM files need not be re-read.
     """
     if ("genotype" not in steps) and ("genotyping" not in steps):
         return
@@ -368,30 +379,82 @@ def _check_bam_sequences(options, mkfile, steps):
             if os.path.exists(filename):
                 bam_files[filename] = _collect_fasta_contigs(regions["FASTA"])
 
+    cache_file = os.path.join(options.destination, _BAM_CACHE_FILENAME)
+    cache = read_json_cache(cache_file, _BAM_CACHE_VERSION)
+    if not isinstance(cache, dict):
+        cache = {}
+
+    unvalidated = {}
     for (filename, contigs) in bam_files.items():
-        with pysam.AlignmentFile(filename) as handle:
-            bam_contigs = dict(list(zip(handle.references, handle.lengths)))
+        key = _bam_cache_key(filename, contigs)
+        if cache.get(os.path.abspath(filename)) != key:
+            unvalidated[filename] = key
 
-            for (contig, length) in contigs.items():
-                bam_length = bam_contigs.get(contig)
+    if not unvalidated:
+        return
 
-                if bam_length is None:
-                    message = (
-                        "Reference sequence missing from BAM file; "
-                        "BAM file aligned against different prefix?\n"
-                        "    BAM file = %s\n    Sequence name = %s"
-                    ) % (filename, contig)
-                    raise MakefileError(message)
-                elif bam_length != length:
-                    message = (
-                        "Length of reference sequence in FASTA differs "
-                        "from length of sequence in BAM file; BAM file "
-                        "aligned against different prefix?\n"
-                        "    BAM file = %s\n"
-                        "    Length in FASTA = %s\n"
-                        "    Length in BAM = %s"
-                    ) % (filename, length, bam_length)
-                    raise MakefileError(message)
+    log.info("Reading headers of %i BAM files", len(unvalidated))
+    max_workers = max(1, min(options.max_threads, len(unvalidated)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        headers = executor.map(_read_bam_contigs, unvalidated)
+
+        # Errors are reported in a deterministic order, namely that of samples
+        for (filename, bam_contigs) in zip(unvalidated, headers):
+            _validate_bam_contigs(filename, bam_files[filename], bam_contigs)
+
+            cache[os.path.abspath(filename)] = unvalidated[filename]
+
+    mkfile["BAMCache"] = cache
+
+
+def write_bam_cache(options, makefiles):
+    """Writes the BAM files validated while reading the makefiles to the cache file
+    in the destination folder. This is done separately from the validation, so that
+    the cache is only written when the pipeline is run, and not for dry runs."""
+    cache = {}
+    for mkfile in makefiles:
+        cache.update(mkfile.get("BAMCache", {}))
+
+    if cache:
+        cache_file = os.path.join(options.destination, _BAM_CACHE_FILENAME)
+        write_json_cache(cache_file, _BAM_CACHE_VERSION, cache)
+
+
+def _read_bam_contigs(filename):
+    with pysam.AlignmentFile(filename) as handle:
+        return dict(zip(handle.references, handle.lengths))
+
+
+def _validate_bam_contigs(filename, contigs, bam_contigs):
+    for (contig, length) in contigs.items():
+        bam_length = bam_contigs.get(contig)
+
+        if bam_length is None:
+            message = (
+                "Reference sequence missing from BAM file; "
+                "BAM file aligned against different prefix?\n"
+                "    BAM file = %s\n    Sequence name = %s"
+            ) % (filename, contig)
+            raise MakefileError(message)
+        elif bam_length != length:
+            message = (
+                "Length of reference sequence in FASTA differs "
+                "from length of sequence in BAM file; BAM file "
+                "aligned against different prefix?\n"
+                "    BAM file = %s\n"
+                "    Length in FASTA = %s\n"
+                "    Length in BAM = %s"
+            ) % (filename, length, bam_length)
+            raise MakefileError(message)
+
+
+def _bam_cache_key(filename, contigs):
+    """Returns a key identifying a BAM file validated against a set of contigs;
+    changes to the BAM file are detected using the size and modification time."""
+    stat = os.stat(filename)
+    digest = hashlib.sha256(repr(sorted(contigs.items())).encode("utf-8"))
+
+    return [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
 
 
 def _check_sexes(mkfile):
@@ -488,24 +551,24 @@ def _read_max_depths(options, prefix, required_keys):
     for sample in required_keys:
         fname = "%s.%s.depths" % (sample, prefix)
         fpath = os.path.join(options.samples_root, fname)
-        max_depths[sample] = fpath
 
-        if not os.path.exists(fpath):
+        if os.path.exists(fpath):
+            max_depths[sample] = _read_max_depth(fpath, prefix, sample)
+        else:
+            # Estimated at run-time from a sample of sites; see parts/genotype.py
+            max_depths[sample] = "auto"
             missing.append((sample, fpath))
 
     if missing:
-        raise MakefileError(
-            "Could not determine 'MaxReadDepth' values "
-            "automatically; .depth files are missing for one "
-            "or more samples: \n  - "
-            + "\n  - ".join("%s: %s" % item for item in missing)
-            + "\n\nEnsure that the .depth files are available, "
-            "or specify a value for 'MaxReadDepth' manually."
+        log = logging.getLogger(__name__)
+        log.warning(
+            "Depth histograms not found for %i sample(s); 'MaxReadDepth' will be "
+            "estimated by sampling %.1f%% of sites in the BAM files:\n  - %s",
+            len(missing),
+            options.max_depth_sample_fraction * 100,
+            "\n  - ".join("%s: %s" % item for item in sorted(missing)),
         )
 
-    for sample, fpath in max_depths.items():
-        max_depths[sample] = _read_max_depth(fpath, prefix, sample)
-
     return max_depths
 
 
@@ -99,7 +99,8 @@ Genotyping:
     VCF_Filter:
       # Maximum coverage acceptable for genotyping calls; if set to zero, the
       # default vcf_filter value is used; if set to 'auto', the MaxDepth value
-      # will be read from the depth histograms generated by the BAM pipeline.
+      # will be read from the depth histograms generated by the BAM pipeline,
+      # or estimated from a random sample of sites if no histogram is found.
       MaxReadDepth: 0
 
       # Minimum coverage acceptable for genotyping calls
@@ -26,10 +26,16 @@ from copy import deepcopy
 
 from paleomix.nodes.samtools import TabixIndexNode, FastaIndexNode, BAMIndexNode
 from paleomix.nodes.bedtools import PaddedBedNode
+from paleomix.common.bedtools import merge_bed_records, read_bed_file
 from paleomix.common.fileutils import swap_ext, add_postfix
+from paleomix.common.formats.fasta import FASTA
 from paleomix.nodes.commands import (
+    ConcatVCFNode,
+    EstimateMaxDepthNode,
+    SplitRegionsNode,
     VCFFilterNode,
     BuildRegionsNode,
+    BuildRegionsBatchNode,
     GenotypeRegionsNode,
 )
 
@@ -42,6 +48,8 @@ _BAI_CACHE = {}
 _FAI_CACHE = {}
 _BED_CACHE = {}
 _VCF_CACHE = {}
+# Number of bases genotyped for each set of regions, used to limit the number of shards
+_BASES_CACHE = {}
 
 
 def build_bam_index_node(bamfile):
@@ -83,11 +91,124 @@ def build_regions_nodes(regions, padding, dependencies=()):
 
 def _get_vcf_filter_options(genotyping, sample):
     options = dict(genotyping["VCF_Filter"])
-    if options["MaxReadDepth"][sample]:
-        options["--max-read-depth"] = options["MaxReadDepth"][sample]
+    max_read_depth = options["MaxReadDepth"][sample]
+    # 'auto' values are determined by sampling the BAM; see build_max_depth_node
+    if max_read_depth and max_read_depth != "auto":
+        options["--max-read-depth"] = max_read_depth
     return options
 
 
+def build_max_depth_node(options, genotyping, sample, bamfile, bedfile, prefix, deps):
+    """Returns the filename of a depth histogram from which the max read depth
+    should be read by vcf_filter, and the node generating this file, if the max read
+    depth for a sample is to be estimated at run-time (depth-histogram missing).
+    Otherwise (None, ()) is returned. Estimates are made using the regions being
+    genotyped, or the entire genome if 'GenotypeEntirePrefix' is enabled.
+    """
+    if genotyping["VCF_Filter"]["MaxReadDepth"][sample] != "auto":
+        return None, ()
+
+    depths_file = swap_ext(prefix, ".depths")
+    node = EstimateMaxDepthNode(
+        target_name=sample,
+        input_file=bamfile,
+        output_file=depths_file,
+        regions_file=bedfile,
+        fraction=options.max_depth_sample_fraction,
+        dependencies=deps,
+    )
+
+    return depths_file, (node,)
+
+
+def build_genotype_regions_nodes(
+    options, genotyping, regions, bamfile, bedfile, outfile, prefix, dependencies
+):
+    """Returns a node genotyping a BAM file using bcftools. If --genotyping-shards is
+    greater than 1, then the regions (or the entire genome, if no BED file is given)
+    are split into N shards of (nearly) the same total length, which are genotyped
+    in parallel, and the resulting VCFs are concatenated in order.
+    """
+    num_shards = options.genotyping_shards
+    if num_shards > 1:
+        # Shards must not be empty, which would be the case if there are fewer bases
+        # than shards; the (padded) BED file may not exist yet, but contains at
+        # least as many bases as the unpadded regions
+        num_shards = min(num_shards, _count_genotyped_bases(regions, bedfile))
+
+    if num_shards <= 1:
+        return GenotypeRegionsNode(
+            reference=regions["FASTA"],
+            bedfile=bedfile,
+            infile=bamfile,
+            outfile=outfile,
+            mpileup_options=genotyping["MPileup"],
+            bcftools_options=genotyping["BCFTools"],
+            dependencies=dependencies,
+        )
+
+    shards_dir = swap_ext(prefix, ".shards")
+    shard_bedfiles = []
+    shard_vcfs = []
+    for shard in range(num_shards):
+        shard_bedfiles.append(os.path.join(shards_dir, "%03i.bed" % (shard,)))
+        shard_vcfs.append(os.path.join(shards_dir, "%03i.vcf.bgz" % (shard,)))
+
+    if bedfile is None:
+        fai_node = build_fasta_index_node(regions["FASTA"])
+        splitter = SplitRegionsNode(
+            outfiles=shard_bedfiles,
+            fai_file=regions["FASTA"] + ".fai",
+            dependencies=dependencies + (fai_node,),
+        )
+    else:
+        splitter = SplitRegionsNode(
+            outfiles=shard_bedfiles,
+            bedfile=bedfile,
+            dependencies=dependencies,
+        )
+
+    # The command-lines (and timestamps) otherwise recorded in the VCF headers differ
+    # between shards, but 'concat --naive' requires compatible headers
+    mpileup_options = dict(genotyping["MPileup"])
+    mpileup_options["--no-version"] = True
+    bcftools_options = dict(genotyping["BCFTools"])
+    bcftools_options["--no-version"] = True
+
+    shard_nodes = []
+    for shard_bedfile, shard_vcf in zip(shard_bedfiles, shard_vcfs):
+        shard_nodes.append(
+            GenotypeRegionsNode(
+                reference=regions["FASTA"],
+                bedfile=shard_bedfile,
+                infile=bamfile,
+                outfile=shard_vcf,
+                mpileup_options=mpileup_options,
+                bcftools_options=bcftools_options,
+                dependencies=dependencies + (splitter,),
+            )
+        )
+
+    return ConcatVCFNode(infiles=shard_vcfs, outfile=outfile, dependencies=shard_nodes)
+
+
+def _count_genotyped_bases(regions, bedfile):
+    """Returns the number of bases in the (merged) regions of interest, or in the
+    reference sequence if the entire prefix is genotyped (bedfile is None). The
+    result is cached, as the same regions are genotyped for every sample."""
+    key = (regions["FASTA"], None if bedfile is None else regions["BED"])
+    if key not in _BASES_CACHE:
+        if bedfile is None:
+            count = sum(FASTA.index_and_collect_contigs(regions["FASTA"]).values())
+        else:
+            records = merge_bed_records(read_bed_file(regions["BED"]))
+            count = sum(record.end - record.start for record in records)
+
+        _BASES_CACHE[key] = count
+
+    return _BASES_CACHE[key]
+
+
 def build_genotyping_bedfile_nodes(options, genotyping, sample, regions, dependencies):
     bamfile = "%s.%s.bam" % (sample, regions["Prefix"])
     bamfile = os.path.join(options.samples_root, bamfile)
@@ -130,14 +251,23 @@ def build_genotyping_nodes_cached(options, genotyping, sample, regions, dependen
     Output files are generated in ./results/PROJECT/genotyping. If the option
     for 'GenotypeEntirePrefix' is enabled, the following files are generated:
         SAMPLE.PREFIX.vcf.bgz: Unfiltered calls for variant/non-variant sites.
+        SAMPLE.PREFIX.vcf.bgz.tbi: Tabix index for the unfiltered calls; only
+                                   generated if --vcf-filter-max-threads > 1.
         SAMPLE.PREFIX.filtered.vcf.bgz: Variant calls filtered with vcf_filter.
         SAMPLE.PREFIX.filtered.vcf.bgz.tbi: Tabix index for the filtered VCF.
+        SAMPLE.PREFIX.depths: Depth histogram for sampled sites; only generated
+                              if 'MaxReadDepth' is 'auto' and no histogram was
+                              found for the sample.
+        SAMPLE.PREFIX.shards/: BED files and unfiltered calls for each shard;
+                               only generated if --genotyping-shards > 1.
 
     If 'GenotypeEntirePrefix' is not enabled for a given ROI, the following
     files are generated for that ROI (see descriptions above):
         SAMPLE.PREFIX.ROI.filtered.vcf.bgz
         SAMPLE.PREFIX.ROI.filtered.vcf.bgz.tbi
         SAMPLE.PREFIX.ROI.vcf.bgz
+        SAMPLE.PREFIX.ROI.depths
+        SAMPLE.PREFIX.ROI.shards/
 
     In addition, the following files are generated for each set of
     RegionsOfInterest (ROI), regardless of the 'GenotypeEntirePrefix' option:
@@ -155,24 +285,38 @@ def build_genotyping_nodes_cached(options, genotyping, sample, regions, dependen
     calls = swap_ext(output_prefix, ".vcf.bgz")
     filtered = swap_ext(output_prefix, ".filtered.vcf.bgz")
 
-    # 1. Call samtools mpilup | bcftools view on the bam
-    genotype = GenotypeRegionsNode(
-        reference=regions["FASTA"],
+    # 1. Call samtools mpilup | bcftools view on the bam; regions are
+    #    optionally split into multiple shards that are genotyped in parallel
+    genotype = build_genotype_regions_nodes(
+        options=options,
+        genotyping=genotyping,
+        regions=regions,
+        bamfile=bamfile,
         bedfile=bedfile,
-        infile=bamfile,
         outfile=calls,
-        mpileup_options=genotyping["MPileup"],
-        bcftools_options=genotyping["BCFTools"],
+        prefix=output_prefix,
         dependencies=dependencies,
     )
 
-    # 2. Filter all sites using the 'vcf_filter' command
+    # 2. Filter all sites using the 'vcf_filter' command; when using multiple
+    #    threads, the calls are first indexed to allow per-region filtering
+    threads = options.vcf_filter_max_threads
+    if threads > 1:
+        genotype = TabixIndexNode(infile=calls, preset="vcf", dependencies=genotype)
+
+    #    The max read depth is optionally estimated from a sample of sites
+    max_depth_file, max_depth_nodes = build_max_depth_node(
+        options, genotyping, sample, bamfile, bedfile, output_prefix, dependencies
+    )
+
     vcffilter = VCFFilterNode(
         infile=calls,
         outfile=filtered,
         regions=regions,
         options=_get_vcf_filter_options(genotyping, sample),
-        dependencies=genotype,
+        threads=threads,
+        max_read_depth_file=max_depth_file,
+        dependencies=(genotype,) + max_depth_nodes,
     )
 
     # 3. Tabix index. This allows random-access to the VCF file when building
@@ -183,68 +327,102 @@ def build_genotyping_nodes_cached(options, genotyping, sample, regions, dependen
     return filtered, tabix
 
 
-def build_genotyping_nodes(options, genotyping, sample, regions, dependencies):
-    """Builds the nodes required for genotyping a BAM, in part or in whole.
+def _get_builder_options(regions):
+    builder_options = {}
+    if regions["ProteinCoding"]:
+        builder_options["--whole-codon-indels-only"] = None
+    if not regions["IncludeIndels"]:
+        builder_options["--ignore-indels"] = None
+
+    return builder_options
 
-    By default, only the region of interest (including padding) will be
-    genotyped. However, if option 'GenotypeEntirePrefix' is enabled, the entire
-    genome is genotyped, and reused between different areas of interest.
 
-    In addition to the files generated by 'build_genotyping_nodes_cached', this
-    function generates the following files:
+def build_consensus_nodes(options, infile, sample, regions_batch, dependencies):
+    """Builds the nodes required for generating consensus sequences for one or
+    more sets of RegionsOfInterest, using a single filtered VCF. When multiple
+    sets of regions are given, these are built using a single pass over the
+    VCF, rather than one pass per set of regions.
+
+    The following files are generated for each set of RegionsOfInterest:
         SAMPLE.PREFIX.ROI.fasta: FASTA containing each named region.
         SAMPLE.PREFIX.ROI.fasta.fai: Index file built using "samtools faidx"
 
     The function returns a sequence of the top-level nodes generating the files.
 
     """
-    # 1. Get path of the filtered VCF file, and the assosiated node
-    filtered, node = build_genotyping_nodes_cached(
-        options=options,
-        genotyping=genotyping,
-        sample=sample,
-        regions=regions,
-        dependencies=dependencies,
-    )
-
-    # 2. Generate consensus sequence from filtered VCF
-    output_fasta = regions["Genotypes"][sample]
-    builder_options = {}
-    if regions["ProteinCoding"]:
-        builder_options["--whole-codon-indels-only"] = None
-    if not regions["IncludeIndels"]:
-        builder_options["--ignore-indels"] = None
+    genotyping, builder_options, _ = regions_batch[0]
+    bedfiles = [regions["BED"] for (_, _, regions) in regions_batch]
+    outfiles = [regions["Genotypes"][sample] for (_, _, regions) in regions_batch]
+
+    # 1. Generate consensus sequence(s) from filtered VCF
+    if len(regions_batch) == 1:
+        builder = BuildRegionsNode(
+            infile=infile,
+            bedfile=bedfiles[0],
+            outfile=outfiles[0],
+            padding=genotyping["Padding"],
+            options=builder_options,
+            dependencies=dependencies,
+        )
+    else:
+        builder = BuildRegionsBatchNode(
+            infile=infile,
+            bedfiles=bedfiles,
+            outfiles=outfiles,
+            padding=genotyping["Padding"],
+            options=builder_options,
+            threads=options.vcf_to_fasta_max_threads,
+            dependencies=dependencies,
+        )
 
-    builder = BuildRegionsNode(
-        infile=filtered,
-        bedfile=regions["BED"],
-        outfile=output_fasta,
-        padding=genotyping["Padding"],
-        options=builder_options,
-        dependencies=node,
+    # 2. Index sequences to make retrival easier for MSA
+    return tuple(
+        FastaIndexNode(infile=output_fasta, dependencies=builder)
+        for output_fasta in outfiles
     )
 
-    # 3. Index sequences to make retrival easier for MSA
-    faidx = FastaIndexNode(infile=output_fasta, dependencies=builder)
 
-    return (faidx,)
+def build_sample_nodes(options, genotyping, regions_sets, sample, dependencies=()):
+    """Builds the nodes required for genotyping a BAM, in part or in whole.
 
+    By default, only the region of interest (including padding) will be
+    genotyped. However, if option 'GenotypeEntirePrefix' is enabled, the entire
+    genome is genotyped, and reused between different areas of interest. In
+    that case, consensus sequences for all RegionsOfInterest sharing both the
+    genotypes and the same settings are built by a single node.
 
-def build_sample_nodes(options, genotyping, regions_sets, sample, dependencies=()):
-    nodes = []
+    """
+    batches = {}
     for regions in regions_sets.values():
         regions = deepcopy(regions)
 
         # Enforce homozygous contigs based on sex tag
         regions["HomozygousContigs"] = regions["HomozygousContigs"][sample["Sex"]]
+        settings = genotyping[regions["Name"]]
+
+        # Get path of the filtered VCF file, and the assosiated node
+        filtered, node = build_genotyping_nodes_cached(
+            options=options,
+            genotyping=settings,
+            sample=sample["Name"],
+            regions=regions,
+            dependencies=dependencies,
+        )
 
+        builder_options = _get_builder_options(regions)
+        key = (filtered, settings["Padding"], tuple(sorted(builder_options)))
+        batch = batches.setdefault(key, (node, []))
+        batch[-1].append((settings, builder_options, regions))
+
+    nodes = []
+    for (filtered, _, _), (node, regions_batch) in batches.items():
         nodes.extend(
-            build_genotyping_nodes(
+            build_consensus_nodes(
                 options=options,
-                genotyping=genotyping[regions["Name"]],
+                infile=filtered,
                 sample=sample["Name"],
-                regions=regions,
-                dependencies=dependencies,
+                regions_batch=regions_batch,
+                dependencies=node,
             )
         )
 
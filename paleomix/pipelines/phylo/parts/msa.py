@@ -36,15 +36,22 @@ def build_msa_nodes(options, settings, regions, filtering, dependencies):
     # Run on full set of sequences
     sequences = regions["Sequences"][None]
 
-    node = CollectSequencesNode(
-        fasta_files=regions["Genotypes"],
-        destination=sequencedir,
-        sequences=sequences,
-        dependencies=dependencies,
-    )
+    # Sequences are optionally split across multiple nodes, to allow these
+    # to be collected in parallel when there are many genes and/or samples
+    collect_nodes = {}
+    for subset in _split_sequences(sequences, options.collect_sequences_shards):
+        node = CollectSequencesNode(
+            fasta_files=regions["Genotypes"],
+            destination=sequencedir,
+            sequences=subset,
+            dependencies=dependencies,
+        )
+
+        for sequence in subset:
+            collect_nodes[sequence] = node
 
+    fasta_files = {}
     if settings["Enabled"]:
-        fasta_files = {}
         algorithm = settings["MAFFT"]["Algorithm"]
         for sequence in sequences:
             input_file = os.path.join(sequencedir, sequence + ".fasta")
@@ -55,10 +62,12 @@ def build_msa_nodes(options, settings, regions, filtering, dependencies):
                 output_file=output_file,
                 algorithm=algorithm,
                 options=settings["MAFFT"],
-                dependencies=node,
+                dependencies=collect_nodes[sequence],
             )
     else:
-        fasta_files = dict((filename, node) for filename in node.output_files)
+        for node in frozenset(collect_nodes.values()):
+            for filename in node.output_files:
+                fasta_files[filename] = node
 
     if not any(filtering.values()):
         return list(fasta_files.values())
@@ -81,6 +90,20 @@ def build_msa_nodes(options, settings, regions, filtering, dependencies):
     return filtered_nodes
 
 
+def _split_sequences(sequences, num_subsets):
+    """Splits a set of sequence names into at most 'num_subsets' non-empty lists of
+    (sorted) names of roughly equal size."""
+    sequences = sorted(sequences)
+    num_subsets = max(1, min(num_subsets, len(sequences)))
+    subset_size, remainder = divmod(len(sequences), num_subsets)
+
+    start = 0
+    for idx in range(num_subsets):
+        end = start + subset_size + (idx < remainder)
+        yield sequences[start:end]
+        start = end
+
+
 def chain(_pipeline, options, makefiles):
     destination = options.destination  # Move to makefile
     for makefile in makefiles:
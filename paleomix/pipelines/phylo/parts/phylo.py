@@ -147,36 +147,49 @@ def _build_examl_bootstraps(
     bootstrap_destination = os.path.join(destination, "bootstraps")
     bootstrap_template = os.path.join(bootstrap_destination, "bootstrap.%04i.phy")
 
+    # Seeds are drawn per bootstrap, so that results do not depend on batching
+    rng = random.Random(options.bootstrap_seed)
+    bootstrap_alignments = []
     for bootstrap_num in range(num_bootstraps):
         bootstrap_alignment = bootstrap_template % (bootstrap_num,)
+        bootstrap_alignments.append((bootstrap_alignment, rng.getrandbits(32)))
+
+    # Bootstraps are generated in batches, each reading the alignment only once
+    num_batches = max(1, min(num_bootstraps, options.max_threads))
+    for batch_num in range(num_batches):
+        batch = bootstrap_alignments[batch_num::num_batches]
+        if not batch:
+            continue
+
         bootstrap = PHYLIPBootstrapNode(
             input_alignment=input_alignment,
             input_partition=input_partition,
-            output_alignment=bootstrap_alignment,
-            seed=random.randint(1, 2 ** 32 - 1),
+            output_alignment=[filename for filename, _ in batch],
+            seed=[seed for _, seed in batch],
             dependencies=dependencies,
         )
 
-        bootstrap_binary = swap_ext(bootstrap_alignment, ".binary")
-        bootstrap_final = swap_ext(bootstrap_alignment, ".%s")
-        bs_binary = ExaMLParserNode(
-            input_alignment=bootstrap_alignment,
-            input_partition=input_partition,
-            output_file=bootstrap_binary,
-            dependencies=bootstrap,
-        )
-
-        bootstraps.append(
-            _examl_nodes(
-                options=options,
-                settings=phylo,
+        for bootstrap_alignment, _ in batch:
+            bootstrap_binary = swap_ext(bootstrap_alignment, ".binary")
+            bootstrap_final = swap_ext(bootstrap_alignment, ".%s")
+            bs_binary = ExaMLParserNode(
                 input_alignment=bootstrap_alignment,
-                input_partitions=input_partition,
-                input_binary=bootstrap_binary,
-                output_template=bootstrap_final,
-                dependencies=bs_binary,
+                input_partition=input_partition,
+                output_file=bootstrap_binary,
+                dependencies=bootstrap,
+            )
+
+            bootstraps.append(
+                _examl_nodes(
+                    options=options,
+                    settings=phylo,
+                    input_alignment=bootstrap_alignment,
+                    input_partitions=input_partition,
+                    input_binary=bootstrap_binary,
+                    output_template=bootstrap_final,
+                    dependencies=bs_binary,
+                )
             )
-        )
 
     if bootstraps:
         return _build_rerooted_trees(bootstraps, phylo["RootTreesOn"])
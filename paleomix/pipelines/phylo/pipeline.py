@@ -34,7 +34,11 @@ import paleomix.yaml
 
 from paleomix.pipeline import Pypeline
 from paleomix.pipelines.phylo.config import build_parser
-from paleomix.pipelines.phylo.makefile import MakefileError, read_makefiles
+from paleomix.pipelines.phylo.makefile import (
+    MakefileError,
+    read_makefiles,
+    write_bam_cache,
+)
 
 
 _COMMANDS = {
@@ -77,6 +81,14 @@ def main(argv):
 
         commands.append((key, func))
 
+    if config.genotyping_shards < 1:
+        log.error("--genotyping-shards must be at least 1")
+        return 1
+
+    if not (0 < config.max_depth_sample_fraction <= 1):
+        log.error("--max-depth-sample-fraction must be in the range (0, 1]")
+        return 1
+
     if not os.path.exists(config.temp_root):
         try:
             os.makedirs(config.temp_root)
@@ -122,6 +134,9 @@ def main(argv):
         pipeline.print_required_executables()
         return 0
 
+    if not config.dry_run:
+        write_bam_cache(config, makefiles)
+
     if not pipeline.run(max_threads=config.max_threads, dry_run=config.dry_run):
         return 1
     return 0
@@ -21,6 +21,7 @@
 # SOFTWARE.
 import argparse
 import datetime
+import multiprocessing
 import os
 import sys
 
@@ -30,6 +31,7 @@ from paleomix.common.sequences import NT_CODES
 
 import paleomix.common.fileutils as fileutils
 import paleomix.pipelines.zonkey.common as common
+import paleomix.pipelines.zonkey.database as database
 
 
 _CHUNK_SIZE = 1000000
@@ -81,6 +83,13 @@ then
     SIM_TXT=""
 fi
 
+GENO_BIN="genotypes.bin"
+if [ ! -e "${GENO_BIN}" ];
+then
+    echo "WARNING: Binary genotype panel ('${GENO_BIN}') not found!"
+    GENO_BIN=""
+fi
+
 EXAMPLES="examples"
 if [ ! -d "${EXAMPLES}" ];
 then
@@ -89,7 +98,8 @@ then
 fi
 
 FILENAME="zonkey{REVISION}.tar"
-SOURCES="settings.yaml contigs.txt samples.txt ${MITO_FA} ${SIM_TXT} ${EXAMPLES} genotypes.txt build.sh"
+SOURCES="settings.yaml contigs.txt samples.txt ${MITO_FA} ${SIM_TXT} ${EXAMPLES}"
+SOURCES="${SOURCES} genotypes.txt ${GENO_BIN} build.sh"
 
 rm -vf "${FILENAME}"
 
@@ -102,6 +112,17 @@ fi
 """
 
 
+# Bitmasks (A = 1, C = 2, G = 4, T = 8) of the nucleotides for each IUPAC code;
+# unexpected characters are mapped to 0
+_ALLELE_MASKS = bytearray(256)
+for _code, _nucleotides in NT_CODES.items():
+    _ALLELE_MASKS[ord(_code)] = sum(1 << "ACGT".index(nuc) for nuc in _nucleotides)
+_ALLELE_MASKS = bytes(_ALLELE_MASKS)
+
+# Number of bits set in each value of a byte
+_POPCOUNTS = bytes(bin(value).count("1") for value in range(256))
+
+
 class ZonkeyError(RuntimeError):
     pass
 
@@ -132,46 +153,110 @@ def _write_genotypes(args, data, filename):
 
     samples = data["samples"]
     keys = tuple(sorted(samples))
+    filenames = [samples[key]["filename"] for key in keys]
 
-    ref_handle = pysam.FastaFile(args.reference)
+    tasks = []
+    for contig, size in sorted(data["contigs"].items()):
+        # Skip non-autosomal contigs
+        if not isinstance(contig, int):
+            continue
+
+        real_names = [samples[key]["contigs"][contig] for key in keys]
+        for pos in range(0, size, _CHUNK_SIZE):
+            tasks.append((contig, size, pos, real_names))
 
     with open(filename, "w") as handle:
         header = ("Chrom", "Pos", "Ref", ";".join(keys))
         handle.write("%s\n" % ("\t".join(header)))
 
-        for contig, size in sorted(data["contigs"].items()):
-            # Skip non-autosomal contigs
-            if not isinstance(contig, int):
-                continue
-
-            sys.stderr.write("  - %s:   0%%\r" % (contig,))
-            for pos in range(0, size, _CHUNK_SIZE):
+        if args.threads > 1:
+            pool = multiprocessing.Pool(
+                args.threads, _init_worker, (args.reference, filenames)
+            )
+            results = pool.imap(_find_biallelic_sites, tasks)
+        else:
+            pool = None
+            _init_worker(args.reference, filenames)
+            results = map(_find_biallelic_sites, tasks)
+
+        try:
+            for (contig, size, pos, _), lines in zip(tasks, results):
                 sys.stderr.write("  - %s: % 3i%%\r" % (contig, (100 * pos) / size))
+                handle.write(lines)
+
+                if pos + _CHUNK_SIZE >= size:
+                    sys.stderr.write("  - %s: 100%%\n" % (contig,))
+
+            if pool is not None:
+                # Wait for workers to exit, so that they are only terminated on errors
+                pool.close()
+                pool.join()
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+
+# Handles for the reference and sample FASTA files opened by each process
+_WORKER_HANDLES = {}
 
-                chunks = []
-                for key in keys:
-                    real_name = samples[key]["contigs"][contig]
-                    fasta_handle = samples[key]["handle"]
-                    chunk = fasta_handle.fetch(real_name, pos, pos + _CHUNK_SIZE)
 
-                    chunks.append(chunk)
+def _init_worker(reference, filenames):
+    _WORKER_HANDLES["reference"] = pysam.FastaFile(reference)
+    _WORKER_HANDLES["samples"] = [pysam.FastaFile(value) for value in filenames]
 
-                ref_chunk = ref_handle.fetch(real_name, pos, pos + _CHUNK_SIZE)
 
-                for idx, row in enumerate(zip(*chunks)):
-                    if "N" in row:
-                        continue
+def _find_biallelic_sites(task):
+    """Returns the rows of the genotypes table for a chunk of a contig, namely
+    those sites where every sample has been called and where exactly two
+    different nucleotides are observed across samples. Sites are found by
+    translating each sample sequence into (4-bit) allele masks, which are
+    combined across samples using a bitwise OR on the masks as integers.
+    """
+    contig, _, pos, real_names = task
 
-                    nucleotides = set()
-                    for nuc in row:
-                        nucleotides.update(NT_CODES[nuc])
+    chunks = []
+    combined = 0
+    for real_name, fasta_handle in zip(real_names, _WORKER_HANDLES["samples"]):
+        chunk = fasta_handle.fetch(real_name, pos, pos + _CHUNK_SIZE)
+        masks = chunk.encode("ascii").translate(_ALLELE_MASKS)
+        if 0 in masks:
+            unexpected = set(chunk) - set(NT_CODES)
+            raise ZonkeyError(
+                "Unexpected nucleotide(s) in %r: %s"
+                % (real_name, ", ".join(map(repr, sorted(unexpected))))
+            )
 
-                    if len(nucleotides) == 2:
-                        handle.write(
-                            "%s\t%i\t%s\t%s\n"
-                            % (contig, pos + idx + 1, ref_chunk[idx], "".join(row))
-                        )
-            sys.stderr.write("  - %s: 100%%\n" % (contig,))
+        combined |= int.from_bytes(masks, "big")
+        chunks.append(chunk)
+
+    # Sample sequences map one-to-one to the reference sequences
+    ref_chunk = _WORKER_HANDLES["reference"].fetch(real_name, pos, pos + _CHUNK_SIZE)
+
+    # Number of alleles observed for each site; sites with Ns count as 4
+    n_alleles = combined.to_bytes(len(chunks[0]), "big").translate(_POPCOUNTS)
+
+    lines = []
+    idx = n_alleles.find(2)
+    while idx != -1:
+        lines.append(
+            "%s\t%i\t%s\t%s\n"
+            % (contig, pos + idx + 1, ref_chunk[idx], "".join(c[idx] for c in chunks))
+        )
+
+        idx = n_alleles.find(2, idx + 1)
+
+    return "".join(lines)
+
+
+def _write_genotype_panel(args, txt_filename, bin_filename):
+    sys.stderr.write("Writing %r\n" % (bin_filename,))
+    if os.path.exists(bin_filename) and not args.overwrite:
+        sys.stderr.write("  File exists; skipping.\n")
+        return
+
+    with open(txt_filename) as in_handle:
+        with open(bin_filename, "wb") as out_handle:
+            database.write_genotype_panel(in_handle, out_handle)
 
 
 def _write_settings(args, contigs, filename):
@@ -204,9 +289,9 @@ def _write_contigs(args, filename):
         for pos in range(0, size, _CHUNK_SIZE):
             sys.stderr.write("  - %s: % 3i%%\r" % (name, (100 * pos) / size))
             chunk = fasta_handle.fetch(real_name, pos, pos + _CHUNK_SIZE)
-            n_uncalled += chunk.count("n")
-            n_uncalled += chunk.count("N")
-            n_uncalled += chunk.count("-")
+            chunk = chunk.encode("ascii")
+            # Uncalled bases are counted in a single pass
+            n_uncalled += len(chunk) - len(chunk.translate(None, b"nN-"))
 
         sys.stderr.write("  - %s: 100%%\n" % (name,))
         lines.append("%s\t%i\t%i\t%s" % (name, size, n_uncalled, "NA"))
@@ -290,7 +375,7 @@ def _collect_samples(reference, filenames):
         if not contigs:
             raise ZonkeyError("No usable contigs found in %r." % (filename,))
 
-        samples[basename] = {"handle": handle, "contigs": contigs}
+        samples[basename] = {"filename": filename, "handle": handle, "contigs": contigs}
 
     return _process_contigs(reference, samples)
 
@@ -311,6 +396,12 @@ def parse_args(argv):
         "be homologus to the same position in the "
         "reference sequence.",
     )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of processes used to identify variable sites [%(default)s].",
+    )
     parser.add_argument(
         "--overwrite",
         default=False,
@@ -336,6 +427,11 @@ def main(argv):
     _write_samples(args, data["samples"], os.path.join(args.root, "samples.txt"))
     _write_settings(args, data["contigs"], os.path.join(args.root, "settings.yaml"))
     _write_genotypes(args, data, os.path.join(args.root, "genotypes.txt"))
+    _write_genotype_panel(
+        args,
+        os.path.join(args.root, "genotypes.txt"),
+        os.path.join(args.root, "genotypes.bin"),
+    )
     _write_build_sh(args, os.path.join(args.root, "build.sh"))
 
 
@@ -144,10 +144,16 @@ def parse_args(argv):
 
 def main(argv):
     args = parse_args(argv)
-    data = database.ZonkeyDB(args.database)
-    sequences = data.mitochondria
     log = logging.getLogger(__name__)
 
+    try:
+        data = database.ZonkeyDB(args.database).validate()
+    except database.ZonkeyDBError as error:
+        log.error("Error reading database file %r: %s", args.database, error)
+        return 1
+
+    sequences = data.mitochondria
+
     try:
         handle = pysam.AlignmentFile(args.bam)
     except (IOError, ValueError) as error:
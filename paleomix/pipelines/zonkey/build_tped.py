@@ -20,8 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import argparse
+import array
+import bisect
 import collections
+import contextlib
+import functools
 import itertools
+import multiprocessing
 import os
 import random
 import sys
@@ -39,7 +44,20 @@ import paleomix.common.fileutils as fileutils
 import paleomix.pipelines.zonkey.database as database
 
 
-_TRANSITIONS = frozenset((("C", "T"), ("T", "C"), ("G", "A"), ("A", "G")))
+_TRANSITIONS = frozenset((frozenset("CT"), frozenset("AG")))
+
+# CIGAR operations consuming both query and reference (M, =, X), only the query
+# (I, S), or only the reference (D, N); other operations consume neither
+_CIGAR_ALIGNED = frozenset((0, 7, 8))
+_CIGAR_QUERY_ONLY = frozenset((1, 4))
+_CIGAR_REFERENCE_ONLY = frozenset((2, 3))
+
+# Maximum number of distinct (encoded) panel genotypes cached by decode_genotypes
+_DECODED_GENOTYPES_CACHE_SIZE = 2 ** 16
+
+DecodedGenotypes = collections.namedtuple(
+    "DecodedGenotypes", ("nucleotides", "text", "is_transition")
+)
 
 
 def _filter_records(handle, flags=bamtools.EXCLUDED_FLAGS):
@@ -49,9 +67,15 @@ def _filter_records(handle, flags=bamtools.EXCLUDED_FLAGS):
 
 
 class DownsampledBAM:
-    def __init__(self, handle, downsample, included_references):
-        self._records = collections.defaultdict(list)
-
+    """Downsamples the (filtered) records in a BAM file using two passes: In
+    the first pass, the indices of the selected records are sampled using
+    reservoir sampling, while recording the file offset of each reference. In
+    the second pass, the selected records are read on demand for each
+    reference. Records are returned in the same order (by position, and by
+    position in the reservoir for ties) as if all records were sampled at once.
+    """
+
+    def __init__(self, handle, downsample, included_references, rng=random):
         references = handle.references
         if len(references) != len(included_references):
             raise ValueError(
@@ -59,99 +83,240 @@ class DownsampledBAM:
                 "number of references in BAM file."
             )
 
-        records = _filter_records(handle)
-        for record in reservoir_sampling(records, downsample):
-            key = references[record.tid]
-            self._records[key].append(record)
-
         self.references = references
 
-        self._records = dict(self._records)
-        for value in self._records.values():
-            value.sort(key=lambda rec: rec.pos)
+        self._handle = handle
+        # Offset in file, and index of first filtered record, for each tid
+        self._offsets = {}
+
+        reservoir = reservoir_sampling(
+            self._index_records(handle),
+            downsample,
+            rng=rng,
+            reservoir=array.array("q"),
+        )
+
+        # Selected indices combined with the position in the reservoir
+        self._downsample = downsample
+        self._selected = array.array(
+            "q",
+            sorted(
+                index * downsample + slot for (slot, index) in enumerate(reservoir)
+            ),
+        )
 
     def fetch(self, chrom):
-        return self._records.get(chrom, ())
+        tid = self.references.index(chrom)
+        if tid not in self._offsets:
+            return
+
+        offset, index = self._offsets[tid]
+        selected = self._selected
+        downsample = self._downsample
+        selected_idx = bisect.bisect_left(selected, index * downsample)
+        if selected_idx >= len(selected):
+            return
+
+        self._handle.seek(offset)
+        group, group_pos = [], None
+        for record in _filter_records(self._handle):
+            if record.tid != tid:
+                break
+
+            next_index, slot = divmod(selected[selected_idx], downsample)
+            if index == next_index:
+                if record.pos != group_pos:
+                    yield from _sorted_group(group)
+                    group, group_pos = [], record.pos
+
+                group.append((slot, record))
+
+                selected_idx += 1
+                if selected_idx >= len(selected):
+                    break
+
+            index += 1
+
+        yield from _sorted_group(group)
+
+    def _index_records(self, handle):
+        index = 0
+        last_tid = None
+        while True:
+            offset = handle.tell()
+            record = next(handle, None)
+            if record is None:
+                break
+            elif record.flag & bamtools.EXCLUDED_FLAGS:
+                continue
+            elif record.tid != last_tid:
+                self._offsets[record.tid] = (offset, index)
+                last_tid = record.tid
+
+            yield index
+            index += 1
+
+
+def _sorted_group(records):
+    """Returns records sorted by the (unique) position in the reservoir."""
+    records.sort(key=lambda pair: pair[0])
+
+    return [record for (_, record) in records]
 
 
 class GenotypeSites:
-    def __init__(self, records):
+    def __init__(self, positions, genotypes):
+        """Takes a sorted sequence of 0-based positions and a sequence of the
+        corresponding (IUPAC encoded) genotypes in the reference panel."""
+        self._positions = positions
+        self._genotypes = genotypes
+
+    @classmethod
+    def from_records(cls, records):
         last_chrom = None
         sites = []
 
         # chrom, pos, ref, ..., nucleotides
         for chrom, pos, line in records:
+            # Fields are expected to contain at least 2 columns, the first being
+            # the reference nucleotide, and the last being the sample genotypes
+            _, encoded_genotypes = line.strip().rsplit("\t", 1)
             # Convert pos from 1-based to 0-based (same as BAM.pos)
-            sites.append((int(pos) - 1, line, []))
+            sites.append((int(pos) - 1, encoded_genotypes))
 
             assert last_chrom is None or chrom == last_chrom, (chrom, last_chrom)
             last_chrom = chrom
 
         sites.sort()
-        self._sites = collections.deque(sites)
+        positions = array.array("l", (pos for pos, _ in sites))
+        genotypes = [genotypes for _, genotypes in sites]
+
+        return cls(positions, genotypes)
 
     def process(self, records, statistics):
+        """Collects the nucleotides observed at each site in a set of records
+        sorted by position, and yields (pos, genotypes, nucleotides) for each
+        site at which one or more (non-N) nucleotides were observed. Sites are
+        matched against aligned blocks of each read using binary searches,
+        rather than by walking every aligned position of the read.
+        """
         count_used = 0
         count_total = 0
-        sites = self._sites
+        positions = self._positions
+        genotypes = self._genotypes
+        num_sites = len(positions)
+        observations = [None] * num_sites
+        # Sites before this site are not covered by the remaining records
+        first_site = 0
+
         for record_id, record in enumerate(records):
             count_total += 1
 
             # TODO: Check sorted
-            while sites and sites[0][0] < record.pos:
-                yield sites.popleft()
-
+            last_site = bisect.bisect_left(positions, record.pos, first_site)
+            for site in range(first_site, last_site):
+                nucleotides = observations[site]
+                if nucleotides is not None:
+                    observations[site] = None
+                    yield positions[site], genotypes[site], nucleotides
+
+            first_site = last_site
+            if first_site >= num_sites:
+                break
+
+            read_used = False
             sequence = record.seq
-            sites_iter = iter(sites).__next__
-            alignment_iter = iter(record.get_aligned_pairs()).__next__
-            alignment_end = record.aend
-
-            try:
-                read_used = False
-                site_pos, _, nucleotides = sites_iter()
-                query_pos, ref_pos = alignment_iter()
-
-                while alignment_end > site_pos:
-                    if ref_pos is None or query_pos is None or site_pos > ref_pos:
-                        query_pos, ref_pos = alignment_iter()
-                    elif site_pos < ref_pos:
-                        site_pos, _, nucleotides = sites_iter()
-                    else:
-                        assert ref_pos == site_pos, (ref_pos, site_pos)
-                        nucleotide = sequence[query_pos]
+            ref_pos = record.pos
+            query_pos = 0
+            for operation, length in record.cigartuples:
+                if operation in _CIGAR_ALIGNED:
+                    block_end = ref_pos + length
+                    site = bisect.bisect_left(positions, ref_pos, first_site)
+                    while site < num_sites and positions[site] < block_end:
+                        nucleotide = sequence[query_pos + positions[site] - ref_pos]
                         if nucleotide != "N":
+                            nucleotides = observations[site]
+                            if nucleotides is None:
+                                nucleotides = observations[site] = []
+
                             nucleotides.append((record_id, nucleotide))
                             read_used = True
 
-                        query_pos, ref_pos = alignment_iter()
-                        site_pos, _, nucleotides = sites_iter()
-            except StopIteration:
-                if not sites:
-                    break
-            finally:
-                if read_used:
-                    count_used += 1
+                        site += 1
 
-        while sites:
-            yield sites.popleft()
+                    ref_pos = block_end
+                    query_pos += length
+                elif operation in _CIGAR_QUERY_ONLY:
+                    query_pos += length
+                elif operation in _CIGAR_REFERENCE_ONLY:
+                    ref_pos += length
+
+            if read_used:
+                count_used += 1
+
+        for site in range(first_site, num_sites):
+            nucleotides = observations[site]
+            if nucleotides is not None:
+                yield positions[site], genotypes[site], nucleotides
 
         statistics["n_reads"] += count_total
         statistics["n_reads_used"] += count_used
 
 
+class GenotypeMatrix:
+    """Sequence of encoded genotypes for each site in a flat (sites x samples)
+    matrix of bytes, as stored in a binary genotype panel."""
+
+    def __init__(self, matrix, num_samples):
+        self._matrix = matrix
+        self._num_samples = num_samples
+
+    def __getitem__(self, index):
+        start = index * self._num_samples
+
+        return str(self._matrix[start : start + self._num_samples], "ascii")
+
+    def __len__(self):
+        return len(self._matrix) // self._num_samples
+
+
 class GenotypeReader:
+    """Reads the genotype panel from a Zonkey database, using the binary panel
+    (genotypes.bin) if available, and the genotypes table otherwise."""
+
     def __init__(self, filename):
-        self._tar_handle = tarfile.open(filename)
-        self._handle = TextIOWrapper(self._tar_handle.extractfile("genotypes.txt"))
-        self._header = self._handle.readline().rstrip("\r\n").split("\t")
-        self.samples = self._header[-1].split(";")
+        self._tar_handle = None
+        self._handle = None
+
+        try:
+            self._panel = database.GenotypePanel.from_tarfile(filename)
+        except (KeyError, tarfile.ReadError):
+            # The binary panel is not available or the database is compressed
+            self._panel = None
+            self._tar_handle = tarfile.open(filename)
+            self._handle = TextIOWrapper(self._tar_handle.extractfile("genotypes.txt"))
+            self._header = self._handle.readline().rstrip("\r\n").split("\t")
+            self.samples = self._header[-1].split(";")
+        else:
+            self.samples = list(self._panel.samples)
 
     def __iter__(self):
-        for chrom, records in itertools.groupby(
-            self._read_records(), lambda rec: rec[0]
-        ):
-            sys.stderr.write("Reading contig %r information\n" % (chrom,))
-            yield chrom, GenotypeSites(records)
+        if self._panel is not None:
+            num_samples = len(self.samples)
+            for contig in self._panel.contigs:
+                sys.stderr.write("Reading contig %r information\n" % (contig["name"],))
+                positions = self._panel.positions(contig)
+                genotypes = self._panel.genotypes(contig)
+
+                yield contig["name"], GenotypeSites(
+                    positions, GenotypeMatrix(genotypes, num_samples)
+                )
+        else:
+            for chrom, records in itertools.groupby(
+                self._read_records(), lambda rec: rec[0]
+            ):
+                sys.stderr.write("Reading contig %r information\n" % (chrom,))
+                yield chrom, GenotypeSites.from_records(records)
 
     def _read_records(self):
         for line in self._handle:
@@ -161,19 +326,24 @@ class GenotypeReader:
         return self
 
     def __exit__(self, type, value, traceback):
-        self._handle.close()
-        self._tar_handle.close()
+        if self._panel is not None:
+            self._panel.close()
+        if self._handle is not None:
+            self._handle.close()
+        if self._tar_handle is not None:
+            self._tar_handle.close()
 
 
 def process_record(
     chrom,
     pos,
-    line,
+    encoded_genotypes,
     nucleotides,
     statistics,
     records,
     out_incl_ts=sys.stdout,
     out_excl_ts=sys.stdout,
+    rng=random,
 ):
     # Filter reads that have already been used
     nucleotides = [
@@ -186,12 +356,37 @@ def process_record(
         # Avoid unnessary random() call in 'random.choice'
         record_id, nucleotide = nucleotides[0]
     else:
-        record_id, nucleotide = random.choice(nucleotides)
+        record_id, nucleotide = rng.choice(nucleotides)
+
+    genotypes = decode_genotypes(encoded_genotypes)
+
+    if nucleotide not in genotypes.nucleotides:
+        # Exclude SNPs not observed in the reference panel
+        return
+
+    # Convert from 0-based to 1-based
+    pos += 1
+
+    # Chromosome, SNP identifier, (dummy) pos in (centi)Morgans, position
+    output = "{0} chr{0}_{1} 0 {1} {2} {3} {3}\n".format(
+        chrom, pos, genotypes.text, nucleotide
+    )
+
+    statistics["n_sites_incl_ts"] += 1
+    out_incl_ts.write(output)
 
-    # Fields are expected to contain at least 2 columns, the first being the
-    # reference nucleotide, and the last being the sample genotypes
-    _, encoded_genotypes = line.strip().rsplit("\t", 1)
+    if not genotypes.is_transition:
+        statistics["n_sites_excl_ts"] += 1
+        out_excl_ts.write(output)
+
+    records.add(record_id)
 
+
+@functools.lru_cache(maxsize=_DECODED_GENOTYPES_CACHE_SIZE)
+def decode_genotypes(encoded_genotypes):
+    """Decodes a string of IUPAC encoded, bi-allelic genotypes (one per sample)
+    from the reference panel. Results are cached, since the same combinations
+    of genotypes are typically observed for a large number of sites."""
     genotypes = []
     for encoded_nucleotide in encoded_genotypes:
         decoded_nucleotides = NT_CODES.get(encoded_nucleotide, ())
@@ -205,28 +400,13 @@ def process_record(
                 "Invalid nucleotide, not bi-allelic: %r" % (encoded_nucleotide,)
             )
 
-    if nucleotide not in genotypes:
-        # Exclude SNPs not observed in the reference panel
-        return
-
-    # Convert from 0-based to 1-based
-    pos += 1
-
-    # Chromosome, SNP identifier, (dummy) pos in (centi)Morgans, position
-    output = [chrom, "chr{}_{}".format(chrom, pos), "0", str(pos)]
-    output.extend(genotypes)
-    output.append(nucleotide)
-    output.append(nucleotide)
-    output = " ".join(output)
-
-    statistics["n_sites_incl_ts"] += 1
-    out_incl_ts.write("{}\n".format(output))
+    nucleotides = frozenset(genotypes)
 
-    if tuple(set(genotypes)) not in _TRANSITIONS:
-        statistics["n_sites_excl_ts"] += 1
-        out_excl_ts.write("{}\n".format(output))
-
-    records.add(record_id)
+    return DecodedGenotypes(
+        nucleotides=nucleotides,
+        text=" ".join(genotypes),
+        is_transition=nucleotides in _TRANSITIONS,
+    )
 
 
 def write_tfam(filename, data, samples, bam_sample):
@@ -240,65 +420,114 @@ def write_tfam(filename, data, samples, bam_sample):
         handle.write("{0} {0} 0 0 0 -9\n".format(bam_sample))
 
 
-def write_summary(args, filename, statistics):
+def write_summary(args, filename, bamfile, statistics):
     with open(filename, "w") as handle:
         handle.write("name: %s\n" % (args.name,))
-        handle.write("filename: %s\n" % (os.path.abspath(args.bam),))
+        handle.write("filename: %s\n" % (os.path.abspath(bamfile),))
 
         for key in ("n_reads", "n_reads_used", "n_sites_incl_ts", "n_sites_excl_ts"):
             handle.write("%s: %s\n" % (key, statistics.get(key, "MISSING")))
 
 
-def process_bam(args, data, bam_handle, mapping):
-    reverse_mapping = dict(zip(mapping.values(), mapping))
-    raw_references = bam_handle.references
-    references = [reverse_mapping.get(name, name) for name in raw_references]
+class TPEDSample:
+    """Input BAM, output files, and statistics for a single sample."""
 
-    if args.downsample:
-        sys.stderr.write("Downsampling to at most %i BAM records\n" % (args.downsample))
-        bam_handle = DownsampledBAM(bam_handle, args.downsample, references)
+    def __init__(self, args, root, bamfile, handle, mapping):
+        reverse_mapping = dict(zip(mapping.values(), mapping))
 
-    statistics = {
-        "n_reads": 0,
-        "n_reads_used": 0,
-        "n_sites_incl_ts": 0,
-        "n_sites_excl_ts": 0,
-    }
+        self.root = root
+        self.bamfile = bamfile
+        self.raw_references = handle.references
+        self.references = [
+            reverse_mapping.get(name, name) for name in handle.references
+        ]
 
-    fileutils.make_dirs(args.root)
+        # Each sample is processed as if it was processed by itself
+        self.rng = random.Random(args.seed)
 
-    with open(os.path.join(args.root, "incl_ts.tped"), "w") as output_incl:
-        with open(os.path.join(args.root, "excl_ts.tped"), "w") as output_excl:
-            with GenotypeReader(args.database) as reader:
-                for ref, sites in reader:
+        if args.downsample:
+            sys.stderr.write(
+                "Downsampling %r to at most %i BAM records\n"
+                % (bamfile, args.downsample)
+            )
+            handle = DownsampledBAM(handle, args.downsample, self.references, self.rng)
+
+        self.handle = handle
+        self.statistics = {
+            "n_reads": 0,
+            "n_reads_used": 0,
+            "n_sites_incl_ts": 0,
+            "n_sites_excl_ts": 0,
+        }
+
+    def fetch(self, ref):
+        raw_ref = self.raw_references[self.references.index(ref)]
+
+        sys.stderr.write("Reading %r from %r\n" % (raw_ref, self.bamfile))
+        return self.handle.fetch(raw_ref)
+
+
+def process_samples(args, samples):
+    """Builds TPED files for one or more samples, using a single pass over the
+    reference panel; the sites for each contig are read once and are then
+    compared against the reads of each sample in turn."""
+    with contextlib.ExitStack() as stack:
+        outputs = []
+        for sample in samples:
+            fileutils.make_dirs(sample.root)
+
+            outputs.append(
+                (
+                    stack.enter_context(
+                        open(os.path.join(sample.root, "incl_ts.tped"), "w")
+                    ),
+                    stack.enter_context(
+                        open(os.path.join(sample.root, "excl_ts.tped"), "w")
+                    ),
+                )
+            )
+
+        with GenotypeReader(args.database) as reader:
+            for ref, sites in reader:
+                for sample, (output_incl, output_excl) in zip(samples, outputs):
                     records = set()
-                    raw_ref = raw_references[references.index(ref)]
+                    statistics = sample.statistics
 
-                    sys.stderr.write("Reading %r from BAM\n" % (raw_ref,))
-                    raw_sites = bam_handle.fetch(raw_ref)
-                    for pos, line, nucleotides in sites.process(raw_sites, statistics):
+                    raw_sites = sample.fetch(ref)
+                    for pos, genotypes, nucleotides in sites.process(
+                        raw_sites, statistics
+                    ):
                         process_record(
                             ref,
                             pos,
-                            line,
+                            genotypes,
                             nucleotides,
                             out_incl_ts=output_incl,
                             out_excl_ts=output_excl,
                             statistics=statistics,
                             records=records,
+                            rng=sample.rng,
                         )
 
-                write_summary(
-                    args,
-                    os.path.join(args.root, "common.summary"),
-                    statistics=statistics,
-                )
-                write_tfam(
-                    os.path.join(args.root, "common.tfam"),
-                    data,
-                    reader.samples,
-                    args.name,
-                )
+    for sample in samples:
+        write_summary(
+            args,
+            os.path.join(sample.root, "common.summary"),
+            sample.bamfile,
+            statistics=sample.statistics,
+        )
+
+
+def process_bams(args, items):
+    """Builds TPED files for a list of (root, BAM filename, contig mapping)."""
+    with contextlib.ExitStack() as stack:
+        samples = []
+        for root, bamfile, mapping in items:
+            handle = stack.enter_context(pysam.AlignmentFile(bamfile))
+
+            samples.append(TPEDSample(args, root, bamfile, handle, mapping))
+
+        process_samples(args, samples)
 
 
 def parse_args(argv):
@@ -308,10 +537,18 @@ def parse_args(argv):
         metavar="output_folder",
         help="Output folder in which output files are "
         "to be placed; is created if it does not "
-        "already exist.",
+        "already exist. If more than one BAM file is "
+        "specified, the output files for the Nth BAM file "
+        "are placed in the sub-folder 'output_folder/N'.",
     )
     parser.add_argument("database", help="Zonkey database file.")
-    parser.add_argument("bam", help="Sorted BAM file.")
+    parser.add_argument(
+        "bams",
+        nargs="+",
+        metavar="bam",
+        help="One or more sorted BAM files; the reference panel is only read "
+        "once per process when multiple BAM files are specified.",
+    )
     parser.add_argument(
         "--seed",
         type=int,
@@ -329,35 +566,70 @@ def parse_args(argv):
     parser.add_argument(
         "--name", default="Sample", help="Name of sample to be used in output."
     )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of processes used when processing multiple BAM files; each "
+        "process reads the reference panel once [%(default)s].",
+    )
 
     return parser.parse_args(argv)
 
 
 def main(argv):
     args = parse_args(argv)
-    random.seed(args.seed)
+    if args.threads < 1:
+        sys.stderr.write("ERROR: --threads must be at least 1\n")
+        return 1
 
     print("Reading reference information from %r" % (args.database,))
 
     try:
-        data = database.ZonkeyDB(args.database)
+        data = database.ZonkeyDB(args.database).validate()
     except database.ZonkeyDBError as error:
         sys.stderr.write(
             "Error reading database file %r:\n%s\n" % (args.database, error)
         )
         return 1
 
-    with pysam.AlignmentFile(args.bam) as bam_handle:
-        bam_info = data.validate_bam_handle(bam_handle)
-        if not bam_info:
-            return 1
-        elif not bam_info.is_nuclear:
-            sys.stderr.write(
-                "ERROR: BAM file does not contain " "identifiable nuclear alignments.\n"
-            )
-            return 1
+    items = []
+    for idx, bamfile in enumerate(args.bams, start=1):
+        with pysam.AlignmentFile(bamfile) as bam_handle:
+            bam_info = data.validate_bam_handle(bam_handle)
+            if not bam_info:
+                return 1
+            elif not bam_info.is_nuclear:
+                sys.stderr.write(
+                    "ERROR: BAM file %r does not contain identifiable nuclear "
+                    "alignments.\n" % (bamfile,)
+                )
+                return 1
+
+        root = args.root
+        if len(args.bams) > 1:
+            root = os.path.join(args.root, str(idx))
+
+        items.append((root, bamfile, bam_info.nuclear_contigs))
+
+    threads = min(args.threads, len(items))
+    if threads > 1:
+        # Samples are split between processes, each reading the panel once
+        batches = [items[idx::threads] for idx in range(threads)]
+        pool = multiprocessing.Pool(threads)
+        try:
+            pool.map(functools.partial(process_bams, args), batches)
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+    else:
+        process_bams(args, items)
 
-        process_bam(args, data, bam_handle, bam_info.nuclear_contigs)
+    for root, _, _ in items:
+        write_tfam(
+            os.path.join(root, "common.tfam"), data, data.sample_order, args.name
+        )
 
     return 0
 
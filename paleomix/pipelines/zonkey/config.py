@@ -126,6 +126,30 @@ def add_run_command(subparsers):
         help="Number of admixture replicates to run, before "
         "the result with the highest likelihood [%(default)s]",
     )
+    group.add_argument(
+        "--admixture-threads",
+        type=int,
+        default=0,
+        help="Number of threads used by each admixture replicate; if 0, the "
+        "number of threads is chosen such that all replicates for a sample "
+        "can be run at once using --max-threads threads [%(default)s]",
+    )
+    group.add_argument(
+        "--admixture-convergence",
+        type=int,
+        default=0,
+        help="If greater than 0, admixture replicates are run one at a time, "
+        "stopping once the best log-likelihood has been obtained by this many "
+        "replicates, or once --admixture-replicates replicates have been run "
+        "[%(default)s]",
+    )
+    group.add_argument(
+        "--admixture-tolerance",
+        type=float,
+        default=0.1,
+        help="Log-likelihoods that differ by at most this value are considered "
+        "identical when using --admixture-convergence [%(default)s]",
+    )
     group.add_argument(
         "--treemix-k",
         type=int,
@@ -145,6 +169,15 @@ def add_run_command(subparsers):
         "not execute.",
     )
 
+    group.add_argument(
+        "--cohort",
+        default=False,
+        action="store_true",
+        help="When running multiple samples, build the input for PLINK for all "
+        "samples using a single pass over the reference panel, processing up "
+        "to --max-threads samples in parallel.",
+    )
+
     group.add_argument(
         "--admixture-only", help=SUPPRESS, default=False, action="store_true",
     )
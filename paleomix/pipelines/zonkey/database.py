@@ -19,16 +19,25 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import array
+import bisect
 import collections
+import itertools
+import json
 import logging
+import mmap
 import os
 import re
+import struct
+import sys
 import tarfile
 
 from io import TextIOWrapper
 
 import pysam
 
+import paleomix.common.bamfiles as bamfiles
+import paleomix.common.fileutils as fileutils
 import paleomix.yaml
 from paleomix.common.formats.fasta import FASTA
 from paleomix.pipelines.zonkey.common import contig_name_to_plink_name, get_sample_names
@@ -82,44 +91,179 @@ _SAMPLES_TABLE_COLUMNS = frozenset(("ID", "Species", "Sex", "SampleID", "Publica
 # Regular expression for parsing Group(K) columns in samples.txt
 _SAMPLES_TABLE_GROUP = re.compile(r"^Group\((?P<K>.+)\)$")
 
+# Optional binary representation of 'genotypes.txt'; see 'write_genotype_panel'
+GENOTYPE_PANEL_FILENAME = "genotypes.bin"
+# Magic value and offset of the (JSON) index of the binary genotype panel
+_GENOTYPE_PANEL_HEADER = struct.Struct("<8sQ")
+_GENOTYPE_PANEL_MAGIC = b"ZKYPANL\x01"
+
 
 class ZonkeyDBError(RuntimeError):
     pass
 
 
+# Tables in a ZonkeyDB, each loaded using the corresponding '_load_*' method
+_ZONKEY_DB_TABLES = (
+    "settings",
+    "contigs",
+    "samples",
+    "mitochondria",
+    "simulations",
+    "sample_order",
+)
+
+
+class _LazyMember:
+    """Descriptor for members of a ZonkeyDB that are loaded on first access;
+    a table may provide multiple members (e.g. 'samples' and 'groups')."""
+
+    def __init__(self, table):
+        self._table = table
+        self._key = None
+
+    def __set_name__(self, owner, name):
+        self._key = name
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+
+        return obj._load_table(self._table)[self._key]
+
+
 class ZonkeyDB:
+    """Zonkey reference panel stored in an uncompressed tar file. Tables are
+    read and validated on first use, and the results are cached in a sidecar
+    folder next to the database ('database.tar.cache'), which is keyed by the
+    size and modification time of the database. Only the path of the database
+    is kept when a ZonkeyDB object is pickled (e.g. when passed to nodes), and
+    members are (re)loaded from the cache on demand.
+    """
+
+    settings = _LazyMember("settings")
+    contigs = _LazyMember("contigs")
+    samples = _LazyMember("samples")
+    groups = _LazyMember("samples")
+    mitochondria = _LazyMember("mitochondria")
+    simulations = _LazyMember("simulations")
+    sample_order = _LazyMember("sample_order")
+
+    # Incremented when the format/type of cached members changes
+    _CACHE_VERSION = 2
+
     def __init__(self, filename):
         self.filename = filename
 
-        log = logging.getLogger(__name__)
-        log.info("Reading Zonkey database from %r" % (filename,))
-
         try:
             # Require that the file is not gzip / bzip2 compressed
             _check_file_compression(filename)
-
-            with tarfile.open(filename, "r:") as tar_handle:
-                log.info("Reading settings")
-                self.settings = self._read_settings(tar_handle, "settings.yaml")
-                log.info("Reading list of contigs")
-                self.contigs = self._read_contigs_table(tar_handle, "contigs.txt")
-                log.info("Reading list of samples")
-                self.samples, self.groups = self._read_samples_table(
-                    tar_handle, "samples.txt"
-                )
-                log.info("Reading mitochondrial sequences")
-                self.mitochondria = self._read_mitochondria(
-                    tar_handle, "mitochondria.fasta"
-                )
-                log.info("Reading emperical admixture distribution")
-                self.simulations = self._read_simulations(tar_handle, "simulations.txt")
-                log.info("Determining sample order")
-                self.sample_order = self._read_sample_order(tar_handle, "genotypes.txt")
-        except (OSError, tarfile.TarError) as error:
+        except OSError as error:
             raise ZonkeyDBError(str(error))
 
+    def validate(self):
+        """Loads and cross-validates all tables in the database, raising a
+        ZonkeyDBError if the database is invalid."""
+        log = logging.getLogger(__name__)
+        log.info("Reading Zonkey database from %r" % (self.filename,))
+
+        for table in _ZONKEY_DB_TABLES:
+            log.info("Reading %s", table)
+            self._load_table(table)
+
         self._cross_validate()
 
+        return self
+
+    def __getstate__(self):
+        return {"filename": self.filename}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def _load_table(self, table):
+        cache_key = self._cache_key()
+        cache_file = os.path.join(self.filename + ".cache", table + ".json")
+
+        members = fileutils.read_json_cache(cache_file, cache_key)
+        if members is not None:
+            members = {
+                key: self._member_from_json(key, value)
+                for key, value in members.items()
+            }
+        else:
+            try:
+                with tarfile.open(self.filename, "r:") as tar_handle:
+                    members = getattr(self, "_load_" + table)(tar_handle)
+            except (OSError, tarfile.TarError) as error:
+                raise ZonkeyDBError(str(error))
+
+            encoded = {
+                key: self._member_to_json(key, value) for key, value in members.items()
+            }
+            fileutils.write_json_cache(cache_file, cache_key, encoded)
+
+        # Subsequent lookups are satisfied by the instance dictionary
+        self.__dict__.update(members)
+
+        return members
+
+    def _cache_key(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError as error:
+            raise ZonkeyDBError(str(error))
+
+        return (self._CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def _member_to_json(cls, key, value):
+        if key == "groups":
+            # JSON objects only support string keys
+            return [[k_groups, group] for k_groups, group in value.items()]
+        elif key == "mitochondria" and value is not None:
+            return [
+                [record.name, record.meta, record.sequence] for record in value.values()
+            ]
+        elif key == "simulations" and value is not None:
+            return value.to_json()
+
+        return value
+
+    @classmethod
+    def _member_from_json(cls, key, value):
+        if key == "groups":
+            return {k_groups: group for k_groups, group in value}
+        elif key == "mitochondria" and value is not None:
+            return {name: FASTA(name, meta, sequence) for name, meta, sequence in value}
+        elif key == "simulations" and value is not None:
+            return Simulations.from_json(value)
+        elif key == "sample_order":
+            return tuple(value)
+
+        return value
+
+    def _load_settings(self, tar_handle):
+        return {"settings": self._read_settings(tar_handle, "settings.yaml")}
+
+    def _load_contigs(self, tar_handle):
+        return {"contigs": self._read_contigs_table(tar_handle, "contigs.txt")}
+
+    def _load_samples(self, tar_handle):
+        samples, groups = self._read_samples_table(tar_handle, "samples.txt")
+
+        return {"samples": samples, "groups": groups}
+
+    def _load_mitochondria(self, tar_handle):
+        mitochondria = self._read_mitochondria(tar_handle, "mitochondria.fasta")
+
+        return {"mitochondria": mitochondria}
+
+    def _load_simulations(self, tar_handle):
+        return {"simulations": self._read_simulations(tar_handle, "simulations.txt")}
+
+    def _load_sample_order(self, tar_handle):
+        return {"sample_order": self._read_sample_order(tar_handle, "genotypes.txt")}
+
     def validate_bam(self, filename):
         """Validates a sample BAM file, checking that it is either a valid
         mitochondrial BAM (aligned against one of the referenc mt sequences),
@@ -257,9 +401,14 @@ class ZonkeyDB:
 
         return samples, groups
 
-    @classmethod
-    def _read_sample_order(cls, tar_handle, filename):
-        cls._check_required_file(tar_handle, filename)
+    def _read_sample_order(self, tar_handle, filename):
+        self._check_required_file(tar_handle, filename)
+
+        try:
+            with GenotypePanel.from_tarfile(self.filename) as panel:
+                return panel.samples
+        except KeyError:
+            pass
 
         handle = TextIOWrapper(tar_handle.extractfile(filename))
         header = handle.readline().rstrip("\r\n").split("\t")
@@ -406,56 +555,71 @@ class ZonkeyDB:
                 "required columns; columns %r are missing!" % (filename, missing_keys)
             )
 
-        result = []
+        # Fields are collected in a flat list, from which columns are sliced
+        fields = []
         for linenum, line in enumerate(handle, start=2):
-            fields = line.strip().split("\t")
-            if len(fields) != len(header):
+            row = line.strip().split("\t")
+            if len(row) != len(header):
                 raise ZonkeyDBError(
                     "Line %i in simulations table %r, does "
                     "not contain the expected number of "
                     "columns; expected %i, but found %i!"
-                    % (linenum, filename, len(header), len(fields))
+                    % (linenum, filename, len(header), len(row))
                 )
 
-            row = dict(zip(header, fields))
+            fields.extend(row)
 
-            if row["HasTS"] not in ("TRUE", "FALSE"):
-                pass
+        columns = {}
+        for idx, key in enumerate(header):
+            columns[key] = fields[idx :: len(header)]
 
-            row["HasTS"] = row["HasTS"] == "TRUE"
+        columns["HasTS"] = [value == "TRUE" for value in columns["HasTS"]]
 
-            for key in ("NReads", "K"):
-                try:
-                    row[key] = int(row[key])
-                except ValueError:
+        for key, func in (("NReads", int), ("K", int)):
+            columns[key] = self._convert_column(filename, columns, key, func, "int")
+
+        for key, func in (("Percentile", float), ("Value", float)):
+            columns[key] = self._convert_column(filename, columns, key, func, "float")
+
+        for key in ("Sample1", "Sample2"):
+            for k_groups, group in set(zip(columns["K"], columns[key])):
+                groups = frozenset(self.groups.get(k_groups, {}).values())
+
+                if group not in groups and group != "-":
                     raise ZonkeyDBError(
-                        "Malformed value for column %r at "
-                        "line %i in simulations table %r; "
-                        "expected int, found %r" % (key, linenum, filename, row[key])
+                        "Invalid group in column %r in "
+                        "simulations table %r: %r" % (key, filename, group)
                     )
 
-            for key in ("Percentile", "Value"):
+        return Simulations(
+            k_groups=columns["K"],
+            has_ts=columns["HasTS"],
+            sample1=columns["Sample1"],
+            sample2=columns["Sample2"],
+            nreads=columns["NReads"],
+            percentile=columns["Percentile"],
+            value=columns["Value"],
+        )
+
+    @classmethod
+    def _convert_column(cls, filename, columns, key, func, typename):
+        values = columns[key]
+
+        try:
+            return list(map(func, values))
+        except ValueError:
+            for linenum, value in enumerate(values, start=2):
                 try:
-                    row[key] = float(row[key])
+                    func(value)
                 except ValueError:
                     raise ZonkeyDBError(
                         "Malformed value for column %r at "
                         "line %i in simulations table %r; "
-                        "expected float, found %r" % (key, linenum, filename, row[key])
-                    )
-
-            for key in ("Sample1", "Sample2"):
-                groups = frozenset(self.groups[int(row["K"])].values())
-
-                if row[key] not in groups and row[key] != "-":
-                    raise ZonkeyDBError(
-                        "Invalid group in column %r in "
-                        "simulations table %r: %r" % (key, filename, row[key])
+                        "expected %s, found %r"
+                        % (key, linenum, filename, typename, value)
                     )
 
-            result.append(row)
-
-        return result
+            raise
 
     @classmethod
     def _check_required_file(cls, tar_handle, filename):
@@ -517,6 +681,241 @@ class ZonkeyDB:
         return result
 
 
+class Simulations:
+    """Index of simulated admixture proportions, keyed by the number of
+    ancestral groups (K), whether or not transitions were included, and the
+    (unordered) pair of groups. For each key, the simulated read-counts are
+    stored in sorted order, along with the simulated values sorted by
+    percentile, allowing percentile ranges to be found using binary searches.
+    """
+
+    def __init__(self, k_groups, has_ts, sample1, sample2, nreads, percentile, value):
+        """Takes the columns of the simulations table as equal-length lists."""
+        # Pairs of groups are unordered
+        pairs = [(a, b) if a <= b else (b, a) for a, b in zip(sample1, sample2)]
+
+        tables = collections.defaultdict(list)
+        keys = zip(k_groups, has_ts, pairs, nreads)
+        for key, row in zip(keys, zip(percentile, value)):
+            tables[key].append(row)
+
+        self.nreads = tuple(sorted(set(nreads)))
+        self._tables = {}
+        for key, table in tables.items():
+            table.sort()
+
+            percentiles = [percentile for percentile, _ in table]
+            values = [value for _, value in table]
+            # Running maximum / minimum of values from the start / end of the
+            # table, used to find the first value above and the last value
+            # below a given value in a table sorted by percentiles
+            running_max = list(itertools.accumulate(values, max))
+            running_min = list(itertools.accumulate(reversed(values), min))
+            running_min.reverse()
+
+            self._tables[key] = (percentiles, running_max, running_min)
+
+    def to_json(self):
+        """Returns a JSON compatible representation of the index."""
+        return {
+            "nreads": self.nreads,
+            "tables": [
+                [k_groups, has_ts, pair, nreads, *table]
+                for (k_groups, has_ts, pair, nreads), table in self._tables.items()
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """Recreates an index from the output of 'to_json'."""
+        obj = cls.__new__(cls)
+        obj.nreads = tuple(data["nreads"])
+        obj._tables = {}
+        for k_groups, has_ts, pair, nreads, *table in data["tables"]:
+            obj._tables[(k_groups, has_ts, tuple(pair), nreads)] = tuple(table)
+
+        return obj
+
+    def nreads_bounds(self, nreads):
+        """Returns the largest and the smallest number of simulated reads less
+        than or equal to and greater than or equal to 'nreads', respectively;
+        either value is None if no such simulations exist."""
+        lower = bisect.bisect_right(self.nreads, nreads)
+        upper = bisect.bisect_left(self.nreads, nreads)
+
+        return (
+            self.nreads[lower - 1] if lower else None,
+            self.nreads[upper] if upper < len(self.nreads) else None,
+        )
+
+    def percentile_range(self, sample1, sample2, nreads, k_groups, has_ts, value):
+        """Returns the range of percentiles of simulated values for the given
+        parameters, between which 'value' is located; returns (0.0, 1.0) if no
+        matching simulations exist."""
+        pair = (sample1, sample2) if sample1 <= sample2 else (sample2, sample1)
+        key = (k_groups, has_ts, pair, nreads)
+        percentiles, running_max, running_min = self._tables.get(key, ((), (), ()))
+
+        # Percentile preceding the first (by percentile) value above 'value'
+        index = bisect.bisect_right(running_max, value)
+        lower_bound = percentiles[index - 1] if index else 0.0
+
+        # Percentile following the last (by percentile) value below 'value'
+        index = bisect.bisect_left(running_min, value)
+        upper_bound = percentiles[index] if index < len(percentiles) else 1.0
+
+        return lower_bound, upper_bound
+
+
+class GenotypePanel:
+    """Read-only, memory-mapped view of a binary genotype panel written using
+    'write_genotype_panel'; the panel may be located at an arbitrary offset in
+    the file, allowing it to be read directly from an uncompressed tar file.
+
+    Sequences returned by 'positions' and 'genotypes' are views of the panel,
+    and can no longer be used once the panel has been closed. If the buffer is
+    a memory map, then it is closed along with the panel.
+    """
+
+    def __init__(self, buffer, offset=0, size=None):
+        self._buffer = buffer
+        self._views = []
+        with memoryview(buffer) as view:
+            end = len(view) if size is None else offset + size
+            self._view = view[offset:end]
+
+        try:
+            self.samples, self.contigs = self._read_index()
+        except ZonkeyDBError:
+            self.close()
+            raise
+
+    @classmethod
+    def from_file(cls, filename, offset=0, size=None):
+        """Memory-maps the panel located at the given offset in a file."""
+        with open(filename, "rb") as handle:
+            mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls(mapping, offset, size)
+
+    @classmethod
+    def from_tarfile(cls, filename):
+        """Memory-maps the panel stored in an uncompressed tar file. Raises a
+        KeyError if the tar file does not contain a binary genotype panel, and
+        a tarfile.ReadError if the tar file is compressed, since offsets in
+        compressed archives do not correspond to offsets in the file."""
+        with tarfile.open(filename, "r:") as tar_handle:
+            member = tar_handle.getmember(GENOTYPE_PANEL_FILENAME)
+
+        return cls.from_file(filename, member.offset_data, member.size)
+
+    def positions(self, contig):
+        """Returns the sorted, 0-based positions of sites on a contig."""
+        start = contig["positions"]
+        view = self._view[start : start + 4 * contig["sites"]]
+        if sys.byteorder == "little":
+            return self._add_view(view.cast("i"))
+
+        positions = array.array("i", view)
+        positions.byteswap()
+        view.release()
+
+        return positions
+
+    def genotypes(self, contig):
+        """Returns a (sites x samples) matrix of IUPAC encoded genotypes for a
+        contig, as a flat sequence of bytes in row-major order."""
+        start = contig["genotypes"]
+        end = start + contig["sites"] * len(self.samples)
+
+        return self._add_view(self._view[start:end])
+
+    def close(self):
+        """Releases all views of the panel and closes the memory map, if any."""
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self._view.release()
+
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def _add_view(self, view):
+        self._views.append(view)
+
+        return view
+
+    def _read_index(self):
+        if len(self._view) < _GENOTYPE_PANEL_HEADER.size:
+            raise ZonkeyDBError("Binary genotype panel is truncated")
+
+        magic, index_offset = _GENOTYPE_PANEL_HEADER.unpack_from(self._view)
+        if magic != _GENOTYPE_PANEL_MAGIC:
+            raise ZonkeyDBError("File is not a binary genotype panel")
+
+        try:
+            index = json.loads(bytes(self._view[index_offset:]).decode("utf-8"))
+        except ValueError as error:
+            raise ZonkeyDBError("Malformed binary genotype panel: %s" % (error,))
+
+        return tuple(index["samples"]), tuple(index["contigs"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def write_genotype_panel(lines, handle):
+    """Writes a binary representation of the genotypes table (genotypes.txt) to
+    a binary file handle. The file consists of a header (a magic value and the
+    offset of the index), followed by the sorted 0-based positions (int32),
+    the reference nucleotides (uint8), and a (sites x samples) matrix of IUPAC
+    encoded genotypes (uint8) for each contig, and lastly a JSON encoded index
+    listing the samples and the offsets of the tables for each contig.
+    """
+    lines = iter(lines)
+    header = next(lines).rstrip("\r\n").split("\t")
+    samples = header[-1].split(";")
+
+    handle.write(_GENOTYPE_PANEL_HEADER.pack(_GENOTYPE_PANEL_MAGIC, 0))
+
+    contigs = []
+    rows = (line.rstrip("\r\n").split("\t") for line in lines)
+    for chrom, chrom_rows in itertools.groupby(rows, lambda row: row[0]):
+        sites = sorted((int(row[1]) - 1, row[2], row[-1]) for row in chrom_rows)
+        for pos, _, genotypes in sites:
+            if len(genotypes) != len(samples):
+                raise ZonkeyDBError(
+                    "Expected %i genotypes at %s:%i, found %i"
+                    % (len(samples), chrom, pos + 1, len(genotypes))
+                )
+
+        positions = array.array("i", (pos for pos, _, _ in sites))
+        if sys.byteorder != "little":
+            positions.byteswap()
+
+        contig = {"name": chrom, "sites": len(sites)}
+        contig["positions"] = handle.tell()
+        positions.tofile(handle)
+        contig["reference"] = handle.tell()
+        handle.write("".join(ref for _, ref, _ in sites).encode("ascii"))
+        contig["genotypes"] = handle.tell()
+        handle.write("".join(genotypes for _, _, genotypes in sites).encode("ascii"))
+        # Ensure that the next table of positions is aligned
+        handle.write(b"\0" * (-handle.tell() % 4))
+
+        contigs.append(contig)
+
+    index_offset = handle.tell()
+    index = {"samples": samples, "contigs": contigs}
+    handle.write(json.dumps(index).encode("utf-8"))
+
+    handle.seek(0)
+    handle.write(_GENOTYPE_PANEL_HEADER.pack(_GENOTYPE_PANEL_MAGIC, index_offset))
+
+
 def _validate_mito_bam(data, handle, info):
     if data.mitochondria is None:
         # No mitochondrial data .. skip phylogeny
@@ -542,22 +941,19 @@ def _validate_mito_bam(data, handle, info):
             return False
 
         filename = handle.filename.decode("utf-8")
-        if not os.path.exists(filename + ".bai"):
+        try:
+            statistics = bamfiles.index_statistics(filename)
+        except ValueError:
             log.info("Indexing BAM file %r" % (filename,))
             pysam.index(filename)
+            statistics = bamfiles.index_statistics(filename)
 
-        # Workaround for pysam < 0.9 returning list, >= 0.9 returning str
-        for line in "".join(pysam.idxstats(filename)).split("\n"):
-            line = line.strip()
-            if not line:
-                continue
-
-            name, _, hits, _ = line.split("\t")
-            if (name == bam_contig) and not int(hits):
+        for record in statistics:
+            if (record.contig == bam_contig) and not record.mapped:
                 log.warning(
                     "Mitochondrial BAM (%r) does not contain "
                     "any reads aligned to contig %r; inferring an "
-                    "phylogeny is not possible." % (filename, name)
+                    "phylogeny is not possible." % (filename, record.contig)
                 )
                 return True
 
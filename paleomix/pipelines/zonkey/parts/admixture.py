@@ -56,84 +56,25 @@ def read_admixture_results(filename, data, k_groups, cutoff=CUTOFF):
 def get_percentiles(data, sample1, sample2, nreads, k_groups, has_ts, value):
     results = {"Sample1": sample1, "Sample2": sample2}
 
-    nreads_lower = set(
-        row["NReads"] for row in data.simulations if row["NReads"] <= nreads
-    )
-    nreads_upper = set(
-        row["NReads"] for row in data.simulations if row["NReads"] >= nreads
-    )
-
-    if nreads_lower:
-        selection = _select_simulations(
-            data=data,
-            sample1=sample1,
-            sample2=sample2,
-            nreads=max(nreads_lower),
-            k_groups=k_groups,
-            has_ts=has_ts,
-        )
-        lower_bound, upper_bound = _get_percentile_range(selection, value)
-        results["Lower"] = {
-            "NReads": max(nreads_lower),
-            "Lower": lower_bound,
-            "Upper": upper_bound,
-        }
-
-    if nreads_upper:
-        selection = _select_simulations(
-            data=data,
-            sample1=sample1,
-            sample2=sample2,
-            nreads=min(nreads_upper),
-            k_groups=k_groups,
-            has_ts=has_ts,
-        )
-        lower_bound, upper_bound = _get_percentile_range(selection, value)
-        results["Upper"] = {
-            "NReads": min(nreads_upper),
-            "Lower": lower_bound,
-            "Upper": upper_bound,
-        }
-
-    return results
-
-
-def _select_simulations(data, sample1, sample2, nreads, k_groups, has_ts):
-    selection = []
-    samples = frozenset((sample1, sample2))
-    for row in data.simulations:
-        if row["K"] != k_groups or row["HasTS"] != has_ts:
-            continue
-        elif row["NReads"] != nreads:
-            continue
-        elif frozenset((row["Sample1"], row["Sample2"])) != samples:
-            continue
-
-        selection.append(row)
-
-    return selection
-
-
-def _get_percentile_range(selection, value):
-    selection = [(row["Percentile"], row["Value"]) for row in selection]
-    selection.sort()
-
-    lower_bound = 0.0
-    upper_bound = 1.0
-
-    for cur_pct, cur_value in selection:
-        if cur_value > value:
-            break
-
-        lower_bound = cur_pct
-
-    for cur_pct, cur_value in reversed(selection):
-        if cur_value < value:
-            break
+    nreads_lower, nreads_upper = data.simulations.nreads_bounds(nreads)
+    for key, bound in (("Lower", nreads_lower), ("Upper", nreads_upper)):
+        if bound is not None:
+            lower_bound, upper_bound = data.simulations.percentile_range(
+                sample1=sample1,
+                sample2=sample2,
+                nreads=bound,
+                k_groups=k_groups,
+                has_ts=has_ts,
+                value=value,
+            )
 
-        upper_bound = cur_pct
+            results[key] = {
+                "NReads": bound,
+                "Lower": lower_bound,
+                "Upper": upper_bound,
+            }
 
-    return lower_bound, upper_bound
+    return results
 
 
 def _admixture_read_results(filename, samples):
@@ -20,14 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import gzip
 import hashlib
-import itertools
 import math
 import os
 import random
 
-import pysam
-
+import paleomix.common.bamfiles as bamfiles
 import paleomix.common.fileutils as fileutils
 import paleomix.common.rtools as rtools
 import paleomix.common.versions as versions
@@ -93,6 +92,87 @@ class BuildTPEDFilesNode(CommandNode):
         )
 
 
+class BuildCohortTPEDFilesNode(CommandNode):
+    """Builds TPED files for multiple samples using a single invocation of
+    'zonkey:tped', in order to share passes over the reference panel. Output
+    files for the Nth BAM file are written to the sub-folder 'N' of the temporary
+    folder, and are moved to the corresponding output root on completion."""
+
+    _FILENAMES = ("common.tfam", "common.summary", "incl_ts.tped", "excl_ts.tped")
+
+    def __init__(
+        self, output_roots, table, bamfiles, downsample, threads=1, dependencies=()
+    ):
+        if len(output_roots) != len(bamfiles):
+            raise ValueError("Number of output roots must match number of BAMs")
+        elif len(bamfiles) < 2:
+            raise ValueError("Cohorts must consist of at least two BAMs")
+
+        cmd = factory.new("zonkey:tped")
+        cmd.set_option("--name", "Sample")
+        cmd.set_option("--downsample", downsample)
+        cmd.set_option("--threads", threads)
+        cmd.add_value("%(TEMP_DIR)s")
+        cmd.add_value("%(IN_TABLE)s")
+        cmd.add_multiple_values(bamfiles, template="IN_BAM_%02i")
+
+        if not downsample:
+            # Needed for random access (chromosomes are read 1 ... 31)
+            cmd.add_multiple_kwargs(
+                [filename + ".bai" for filename in bamfiles], template="IN_BAI_%02i"
+            )
+
+        cmd.set_kwargs(IN_TABLE=table)
+
+        self._output_roots = tuple(output_roots)
+        description = "<BuildCohortTPEDFiles -> %i samples>" % (len(bamfiles),)
+
+        CommandNode.__init__(
+            self,
+            description=description,
+            command=cmd.finalize(),
+            threads=threads,
+            dependencies=dependencies,
+            # Output files are not known to the command, as they share basenames
+            output_files=[
+                os.path.join(root, filename)
+                for root in self._output_roots
+                for filename in self._FILENAMES
+            ],
+        )
+
+    def _teardown(self, config, temp):
+        sample_temps = [
+            os.path.join(temp, str(idx))
+            for idx in range(1, len(self._output_roots) + 1)
+        ]
+
+        # Output for every sample is checked before any files are moved, so that
+        # either all samples or no samples are committed
+        self._check_temp_files(
+            temp,
+            self._command.expected_temp_files
+            | frozenset(map(os.path.basename, sample_temps)),
+            self._command.optional_temp_files,
+        )
+
+        for sample_temp in sample_temps:
+            self._check_temp_files(sample_temp, frozenset(self._FILENAMES))
+
+        for sample_temp, output_root in zip(sample_temps, self._output_roots):
+            for filename in self._FILENAMES:
+                fileutils.move_file(
+                    os.path.join(sample_temp, filename),
+                    os.path.join(output_root, filename),
+                )
+
+            os.rmdir(sample_temp)
+
+        self._command.commit(temp)
+
+        Node._teardown(self, config, temp)
+
+
 class BuildBEDFilesNode(CommandNode):
     def __init__(
         self, output_prefix, tfam, tped, plink_parameters=None, dependencies=()
@@ -141,12 +221,52 @@ class BuildBEDFilesNode(CommandNode):
 
 
 class AdmixtureNode(CommandNode):
-    def __init__(self, input_file, k_groups, output_root, groups, dependencies=()):
+    def __init__(
+        self, input_file, k_groups, output_root, groups, threads=1, dependencies=()
+    ):
         self._groups = groups
         self._input_file = input_file
 
+        CommandNode.__init__(
+            self,
+            description="<Admixture -> '%s.*''>"
+            % (self._output_prefix(input_file, k_groups, output_root),),
+            command=self._build_command(input_file, k_groups, output_root, threads),
+            threads=threads,
+            dependencies=dependencies,
+        )
+
+    def _setup(self, config, temp):
+        CommandNode._setup(self, config, temp)
+
+        self._setup_temp_dir(temp)
+
+    def _setup_temp_dir(self, temp):
+        input_files = [
+            self._input_file,
+            fileutils.swap_ext(self._input_file, ".bim"),
+            fileutils.swap_ext(self._input_file, ".fam"),
+        ]
+
+        for filename in input_files:
+            basename = os.path.basename(filename)
+            os.symlink(os.path.abspath(filename), os.path.join(temp, basename))
+
+        fam_filename = fileutils.swap_ext(self._input_file, ".fam")
+        pop_filename = fileutils.swap_ext(fam_filename, ".pop")
+        pop_filename = fileutils.reroot_path(temp, pop_filename)
+
+        with open(fam_filename) as fam_handle:
+            with open(pop_filename, "w") as pop_handle:
+                for line in fam_handle:
+                    sample, _ = line.split(None, 1)
+
+                    pop_handle.write("%s\n" % (self._groups.get(sample, "-"),))
+
+    @classmethod
+    def _build_command(cls, input_file, k_groups, output_root, threads):
         prefix = os.path.splitext(os.path.basename(input_file))[0]
-        output_prefix = os.path.join(output_root, "%s.%i" % (prefix, k_groups))
+        output_prefix = cls._output_prefix(input_file, k_groups, output_root)
 
         cmd = AtomicCmdBuilder(
             "admixture",
@@ -165,41 +285,110 @@ class AdmixtureNode(CommandNode):
         )
 
         cmd.set_option("-s", random.randint(0, 2 ** 16 - 1))
+        cmd.set_option("-j", threads, sep="")
         cmd.set_option("--supervised")
 
         cmd.add_value("%(TEMP_OUT_FILE_BED)s")
         cmd.add_value(int(k_groups))
 
-        CommandNode.__init__(
+        return cmd.finalize()
+
+    @classmethod
+    def _output_prefix(cls, input_file, k_groups, output_root):
+        prefix = os.path.splitext(os.path.basename(input_file))[0]
+
+        return os.path.join(output_root, "%s.%i" % (prefix, k_groups))
+
+
+class AdmixtureConvergenceNode(AdmixtureNode):
+    """Runs up to 'max_replicates' replicates of ADMIXTURE one after the other,
+    stopping once the best log-likelihood observed so far has been reached by
+    'min_hits' replicates (within 'tolerance'). The output of the replicate with
+    the best log-likelihood is kept, as is done by SelectBestAdmixtureNode."""
+
+    def __init__(
+        self,
+        input_file,
+        k_groups,
+        output_root,
+        groups,
+        max_replicates,
+        min_hits,
+        tolerance,
+        threads=1,
+        dependencies=(),
+    ):
+        if max_replicates < 1:
+            raise ValueError("max_replicates must be >= 1, not %r" % (max_replicates,))
+        elif min_hits < 1:
+            raise ValueError("min_hits must be >= 1, not %r" % (min_hits,))
+
+        AdmixtureNode.__init__(
             self,
-            description="<Admixture -> '%s.*''>" % (output_prefix,),
-            command=cmd.finalize(),
+            input_file=input_file,
+            k_groups=k_groups,
+            output_root=output_root,
+            groups=groups,
+            threads=threads,
             dependencies=dependencies,
         )
 
+        # Each replicate is run with a different random seed; commands for all
+        # replicates are built up front, and that of the best replicate is kept
+        self._replicates = [self._command]
+        for _ in range(1, max_replicates):
+            self._replicates.append(
+                self._build_command(input_file, k_groups, output_root, threads)
+            )
+
+        self._log_file = self._output_prefix(input_file, k_groups, output_root)
+        self._log_file = os.path.basename(self._log_file + ".log")
+        self._min_hits = min_hits
+        self._tolerance = tolerance
+        self._best_command = None
+        self._best_temp = None
+
     def _setup(self, config, temp):
         CommandNode._setup(self, config, temp)
 
-        input_files = [
-            self._input_file,
-            fileutils.swap_ext(self._input_file, ".bim"),
-            fileutils.swap_ext(self._input_file, ".fam"),
-        ]
+    def _run(self, config, temp):
+        likelihoods = []
+        for idx, command in enumerate(self._replicates):
+            replicate_temp = os.path.join(temp, "%02i" % (idx,))
+            os.mkdir(replicate_temp)
+            self._setup_temp_dir(replicate_temp)
+            self._run_command(command, replicate_temp)
+
+            likelihood = read_admixture_log(
+                os.path.join(replicate_temp, self._log_file)
+            )
+            likelihoods.append((likelihood, -idx, command, replicate_temp))
 
-        for filename in input_files:
-            basename = os.path.basename(filename)
-            os.symlink(os.path.abspath(filename), os.path.join(temp, basename))
+            best_likelihood, _, _, _ = max(likelihoods)
+            hits = sum(
+                value >= best_likelihood - self._tolerance
+                for value, _, _, _ in likelihoods
+            )
 
-        fam_filename = fileutils.swap_ext(self._input_file, ".fam")
-        pop_filename = fileutils.swap_ext(fam_filename, ".pop")
-        pop_filename = fileutils.reroot_path(temp, pop_filename)
+            if hits >= self._min_hits:
+                break
 
-        with open(fam_filename) as fam_handle:
-            with open(pop_filename, "w") as pop_handle:
-                for line in fam_handle:
-                    sample, _ = line.split(None, 1)
+        # Ties are resolved in favor of the earliest replicate
+        _, _, self._best_command, self._best_temp = max(likelihoods)
 
-                    pop_handle.write("%s\n" % (self._groups.get(sample, "-"),))
+    def _teardown(self, config, temp):
+        self._check_temp_files(
+            self._best_temp,
+            self._best_command.expected_temp_files,
+            self._best_command.optional_temp_files,
+        )
+
+        self._best_command.commit(self._best_temp)
+
+        for filename in os.listdir(temp):
+            fileutils.try_rmtree(os.path.join(temp, filename))
+
+        Node._teardown(self, config, temp)
 
 
 class SelectBestAdmixtureNode(Node):
@@ -245,7 +434,7 @@ class SelectBestAdmixtureNode(Node):
         for fileset in self._files:
             for filename in fileset:
                 if filename.endswith(".log"):
-                    likelihoods.append((self._read_admixture_log(filename), fileset))
+                    likelihoods.append((read_admixture_log(filename), fileset))
                     break
             else:
                 raise NodeError(
@@ -258,18 +447,6 @@ class SelectBestAdmixtureNode(Node):
             dst_filename = fileutils.reroot_path(self._output_root, src_filename)
             fileutils.copy_file(src_filename, dst_filename)
 
-    @classmethod
-    def _read_admixture_log(cls, filename):
-        with open(filename) as handle:
-            for line in handle:
-                if line.startswith("Loglikelihood:"):
-                    return float(line.split()[1])
-
-            raise NodeError(
-                "Could not find likelihood value in log-file %r; "
-                "looking for line starting with 'Loglikelihood:'" % (filename,)
-            )
-
 
 class AdmixturePlotNode(CommandNode):
     def __init__(self, input_file, output_prefix, order, samples, dependencies=()):
@@ -397,6 +574,15 @@ class BuildFreqFilesNode(CommandNode):
 
 
 class FreqToTreemixNode(Node):
+    """Converts a PLINK stratified frequency table (.frq.strat.gz) into the
+    (gzip compressed) allele-count table used by TreeMix. The table is read as
+    bytes one line at a time, and output lines are written in batches."""
+
+    # Number of SNPs written to the output file at a time
+    _BATCH_SIZE = 10000
+    # Columns required in the input table
+    _COLUMNS = (b"CHR", b"SNP", b"CLST", b"MAC", b"NCHROBS")
+
     def __init__(self, input_file, output_file, dependencies=()):
         Node.__init__(
             self,
@@ -411,23 +597,11 @@ class FreqToTreemixNode(Node):
         (output_file,) = self.output_files
         temp_filename = os.path.basename(output_file)
 
-        with open(os.path.join(temp, temp_filename), "w") as handle:
-            header = None
-            table = self._parse_freq_table(input_file)
-
-            for _, rows in itertools.groupby(table, lambda row: row[:2]):
-                if header is None:
-                    rows = tuple(rows)  # Must not consume iterator
-                    header = list(sorted(row[2] for row in rows))
-                    handle.write("%s\n" % (" ".join(header)))
-
-                result = []
-                rows = dict((row[2], row) for row in rows)
-                for sample in header:
-                    _, _, _, mac, nchroms = rows[sample]
-                    result.append("%s,%i" % (mac, int(nchroms) - int(mac)))
-
-                handle.write("%s\n" % (" ".join(result),))
+        with fileutils.open_ro(input_file, "rb") as in_handle:
+            with gzip.open(
+                os.path.join(temp, temp_filename), "wb", compresslevel=6
+            ) as out_handle:
+                self._convert_freq_table(in_handle, out_handle)
 
     def _teardown(self, config, temp):
         (output_file,) = self.output_files
@@ -437,14 +611,71 @@ class FreqToTreemixNode(Node):
         Node._teardown(self, config, temp)
 
     @classmethod
-    def _parse_freq_table(cls, filename):
-        with fileutils.open_ro(filename) as handle:
-            handle.readline()  # Skip header
+    def _convert_freq_table(cls, in_handle, out_handle):
+        # Clusters in the order listed in the input, and the sorted order of
+        # these clusters, as used in the output
+        clusters = order = None
 
-            for line in handle:
-                chrom, snp, clst, _, _, _, mac, nchroms = line.split()
+        batch = []
+        for names, counts in cls._read_snps(in_handle):
+            if clusters is None:
+                clusters = names
+                order = sorted(range(len(names)), key=names.__getitem__)
+                out_handle.write(b" ".join(sorted(names)) + b"\n")
+
+            batch.append(cls._format_row(clusters, order, names, counts))
+            if len(batch) >= cls._BATCH_SIZE:
+                out_handle.write(b"".join(batch))
+                batch = []
+
+        out_handle.write(b"".join(batch))
+
+    @classmethod
+    def _read_snps(cls, in_handle):
+        """Yields a list of cluster names and a list of 'ref,alt' allele counts
+        for each SNP in a stratified frequency table."""
+        header = in_handle.readline().split()
+        try:
+            columns = [header.index(column) for column in cls._COLUMNS]
+        except ValueError:
+            raise NodeError("Malformed frequency table header: %r" % (header,))
+
+        chrom_idx, snp_idx, clst_idx, mac_idx, nchroms_idx = columns
+
+        last_key = None
+        names = []
+        counts = []
+        for line in in_handle:
+            fields = line.split()
+            key = (fields[chrom_idx], fields[snp_idx])
+            if key != last_key:
+                if names:
+                    yield names, counts
+
+                last_key = key
+                names = []
+                counts = []
+
+            mac = int(fields[mac_idx])
+            nchroms = int(fields[nchroms_idx])
+
+            names.append(fields[clst_idx])
+            counts.append(b"%i,%i" % (mac, nchroms - mac))
+
+        if names:
+            yield names, counts
 
-                yield (chrom, snp, clst, int(mac), int(nchroms))
+    @classmethod
+    def _format_row(cls, clusters, order, names, counts):
+        if names != clusters:
+            # Clusters listed in a different order than for the first SNP
+            try:
+                counts = dict(zip(names, counts))
+                counts = [counts[clusters[idx]] for idx in range(len(clusters))]
+            except KeyError as error:
+                raise NodeError("Cluster missing from frequency table: %s" % (error,))
+
+        return b" ".join([counts[idx] for idx in order]) + b"\n"
 
 
 class TreemixNode(CommandNode):
@@ -720,14 +951,8 @@ class PlotCoverageNode(CommandNode):
         with open(os.path.join(temp, "contigs.table"), "w") as handle:
             handle.write("ID\tSize\tNs\tHits\n")
 
-            # Workaround for pysam < 0.9 returning list, >= 0.9 returning str
-            for line in "".join(pysam.idxstats(self._input_file)).split("\n"):
-                line = line.strip()
-                if not line:
-                    continue
-
-                name, size, hits, _ = line.split("\t")
-                name = self._mapping.get(name, name)
+            for record in bamfiles.index_statistics(self._input_file):
+                name = self._mapping.get(record.contig, record.contig)
                 if name not in self._contigs:
                     # Excluding contigs is allowed
                     continue
@@ -736,7 +961,7 @@ class PlotCoverageNode(CommandNode):
                     "ID": name,
                     "Size": self._contigs[name]["Size"],
                     "Ns": self._contigs[name]["Ns"],
-                    "Hits": hits,
+                    "Hits": record.mapped,
                 }
 
                 handle.write("{ID}\t{Size}\t{Ns}\t{Hits}\n".format(**row))
@@ -746,3 +971,15 @@ class PlotCoverageNode(CommandNode):
 
 def hash_params(*args, **kwargs):
     return hashlib.md5(repr([args, kwargs]).encode("utf-8")).hexdigest()
+
+
+def read_admixture_log(filename):
+    with open(filename) as handle:
+        for line in handle:
+            if line.startswith("Loglikelihood:"):
+                return float(line.split()[1])
+
+        raise NodeError(
+            "Could not find likelihood value in log-file %r; "
+            "looking for line starting with 'Loglikelihood:'" % (filename,)
+        )
@@ -70,16 +70,21 @@ def run_pipeline(config, nodes, msg):
     return pipeline.run(max_threads=config.max_threads, dry_run=config.dry_run)
 
 
-def build_plink_nodes(config, data, root, bamfile, dependencies=()):
+def build_plink_nodes(config, data, root, bamfile, dependencies=(), ped_node=None):
     plink = {"root": os.path.join(root, "results", "plink")}
 
-    ped_node = nuclear.BuildTPEDFilesNode(
-        output_root=plink["root"],
-        table=config.database.filename,
-        downsample=config.downsample_to,
-        bamfile=bamfile,
-        dependencies=dependencies,
-    )
+    if ped_node is None:
+        ped_node = nuclear.BuildTPEDFilesNode(
+            output_root=plink["root"],
+            table=config.database.filename,
+            downsample=config.downsample_to,
+            bamfile=bamfile,
+            dependencies=dependencies,
+        )
+        bed_dependencies = (ped_node,)
+    else:
+        # Nodes shared between samples (cohorts) lack per-sample dependencies
+        bed_dependencies = (ped_node,) + tuple(dependencies)
 
     for postfix in ("incl_ts", "excl_ts"):
         plink[postfix] = nuclear.BuildBEDFilesNode(
@@ -87,13 +92,15 @@ def build_plink_nodes(config, data, root, bamfile, dependencies=()):
             tfam=os.path.join(plink["root"], "common.tfam"),
             tped=os.path.join(plink["root"], postfix + ".tped"),
             plink_parameters=config.database.settings["Plink"],
-            dependencies=(ped_node,),
+            dependencies=bed_dependencies,
         )
 
     return plink
 
 
 def build_admixture_nodes(config, data, root, plink):
+    threads = _admixture_threads(config, data)
+
     nodes = []
     for postfix in ("incl_ts", "excl_ts"):
         bed_node = plink[postfix]
@@ -101,25 +108,38 @@ def build_admixture_nodes(config, data, root, plink):
         admix_root = os.path.join(root, "results", "admixture")
         report_root = os.path.join(root, "figures", "admixture")
         for k_groups in sorted(data.groups):
-            replicates = []
-
             input_file = os.path.join(plink["root"], postfix + ".bed")
-            for replicate in range(config.admixture_replicates):
-                output_root = os.path.join(admix_root, "%02i" % (replicate,))
-
-                node = nuclear.AdmixtureNode(
+            if config.admixture_convergence:
+                node = nuclear.AdmixtureConvergenceNode(
                     input_file=input_file,
-                    output_root=output_root,
+                    output_root=admix_root,
                     k_groups=k_groups,
                     groups=data.groups[k_groups],
+                    max_replicates=config.admixture_replicates,
+                    min_hits=config.admixture_convergence,
+                    tolerance=config.admixture_tolerance,
+                    threads=threads,
                     dependencies=(bed_node,),
                 )
+            else:
+                replicates = []
+                for replicate in range(config.admixture_replicates):
+                    output_root = os.path.join(admix_root, "%02i" % (replicate,))
+
+                    node = nuclear.AdmixtureNode(
+                        input_file=input_file,
+                        output_root=output_root,
+                        k_groups=k_groups,
+                        groups=data.groups[k_groups],
+                        threads=threads,
+                        dependencies=(bed_node,),
+                    )
 
-                replicates.append(node)
+                    replicates.append(node)
 
-            node = nuclear.SelectBestAdmixtureNode(
-                replicates=replicates, output_root=admix_root
-            )
+                node = nuclear.SelectBestAdmixtureNode(
+                    replicates=replicates, output_root=admix_root
+                )
 
             if config.admixture_only:
                 nodes.append(node)
@@ -142,6 +162,18 @@ def build_admixture_nodes(config, data, root, plink):
     return nodes
 
 
+def _admixture_threads(config, data):
+    if config.admixture_threads:
+        return config.admixture_threads
+
+    # Number of admixture runs that may be carried out at the same time
+    n_runs = 2 * len(data.groups)
+    if not config.admixture_convergence:
+        n_runs *= config.admixture_replicates
+
+    return max(1, config.max_threads // n_runs)
+
+
 def build_treemix_nodes(config, data, root, plink):
     tmix_root = os.path.join(root, "results", "treemix")
 
@@ -282,7 +314,42 @@ def build_mito_nodes(config, root, bamfile, dependencies=()):
     return (trees,)
 
 
-def build_pipeline(config, root, nuc_bam, mito_bam, cache):
+def build_cohort_nodes(config, cache):
+    """Builds a single node generating the TPED files for every sample with a
+    nuclear BAM, sharing passes over the reference panel between samples.
+    Returns a dictionary of sample roots to the resulting node."""
+    roots = []
+    bamfiles = []
+    dependencies = []
+    for _, sample in sorted(config.samples.items()):
+        nuc_bam = sample["Files"].get("Nuc")
+        if nuc_bam is not None:
+            nuc_bam = nuc_bam["Path"]
+
+            index = cache.get(nuc_bam)
+            if index is None:
+                index = cache[nuc_bam] = BAMIndexNode(infile=nuc_bam)
+
+            roots.append(sample["Root"])
+            bamfiles.append(nuc_bam)
+            dependencies.append(index)
+
+    if len(bamfiles) < 2:
+        return {}
+
+    node = nuclear.BuildCohortTPEDFilesNode(
+        output_roots=[os.path.join(root, "results", "plink") for root in roots],
+        table=config.database.filename,
+        bamfiles=bamfiles,
+        downsample=config.downsample_to,
+        threads=max(1, min(config.max_threads, len(bamfiles))),
+        dependencies=dependencies,
+    )
+
+    return dict.fromkeys(roots, node)
+
+
+def build_pipeline(config, root, nuc_bam, mito_bam, cache, cohort=None):
     nodes = []
     sample_tbl = os.path.join(root, "figures", "samples.txt")
     samples = common_nodes.WriteSampleList(config=config, output_file=sample_tbl)
@@ -298,7 +365,12 @@ def build_pipeline(config, root, nuc_bam, mito_bam, cache):
             index = cache[nuc_bam] = BAMIndexNode(infile=nuc_bam)
 
         plink = build_plink_nodes(
-            config, config.database, root, nuc_bam, dependencies=(samples, index)
+            config,
+            config.database,
+            root,
+            nuc_bam,
+            dependencies=(samples, index),
+            ped_node=(cohort or {}).get(root),
         )
 
         nodes.extend(build_admixture_nodes(config, config.database, root, plink))
@@ -342,6 +414,10 @@ def run_admix_pipeline(config):
 
     cache = {}
     nodes = []
+    cohort = None
+    if config.cohort:
+        cohort = build_cohort_nodes(config, cache)
+
     items = iter(config.samples.items())
     for idx, (name, sample) in enumerate(sorted(items), start=1):
         root = sample["Root"]
@@ -356,7 +432,7 @@ def run_admix_pipeline(config):
 
         log.info("  %i. %s: %s DNA", idx, name, " and ".join(genomes))
 
-        nodes.extend(build_pipeline(config, root, nuc_bam, mito_bam, cache))
+        nodes.extend(build_pipeline(config, root, nuc_bam, mito_bam, cache, cohort))
 
     if config.multisample and not config.admixture_only:
         nodes = [summary.SummaryNode(config, nodes)]
@@ -597,6 +673,19 @@ def finalize_run_config(parser, args):
         )
         return
 
+    if args.admixture_replicates < 1:
+        log.error("--admixture-replicates must be at least 1")
+        return
+    elif args.admixture_threads < 0:
+        log.error("--admixture-threads must be 0 (auto) or greater")
+        return
+    elif args.admixture_convergence < 0:
+        log.error("--admixture-convergence must be 0 (disabled) or greater")
+        return
+    elif args.admixture_convergence > args.admixture_replicates:
+        log.error("--admixture-convergence cannot exceed --admixture-replicates")
+        return
+
     if len(args.files) == 1:
         args.files.append(fileutils.swap_ext(args.files[0], ".zonkey"))
 
@@ -653,7 +742,7 @@ def main(argv):
     log = logging.getLogger(__name__)
 
     try:
-        args.database = database.ZonkeyDB(args.database)
+        args.database = database.ZonkeyDB(args.database).validate()
     except database.ZonkeyDBError as error:
         log.error("Error reading database %r: %s", args.database, error)
         return
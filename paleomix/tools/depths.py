@@ -20,12 +20,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
-import sys
-import itertools
+import bisect
 import collections
+import itertools
+import random
+import sys
 
 from paleomix.common.timer import BAMTimer
 from paleomix.common.bamfiles import BAMRegionsIter
+from paleomix.common.bedtools import merge_bed_records
 
 from paleomix.tools.bam_stats.common import (
     collect_references,
@@ -43,6 +46,8 @@ _MAX_DEPTH = 200
 # Maximum number of count patterns (numbers of bases per library for a given
 # site) to cache for bulk processing; see MappingsToTotals for implementation
 _MAX_CACHE_SIZE = 10000
+# Size of windows fetched when sampling read depths; see 'sample_depth_counts'
+_SAMPLING_WINDOW_SIZE = 1000
 
 
 # Header prepended to output tables
@@ -194,12 +199,67 @@ def print_table(handle, args, totals):
         output_handle = open(args.outfile, "w")
 
     with output_handle:
-        rows = build_table(args.target_name, totals, lengths)
-        output_handle.write(_HEADER)
-        output_handle.write("\n")
-        for line in rows:
-            output_handle.write("\t".join(map(str, line)))
-            output_handle.write("\n")
+        write_table(output_handle, args.target_name, totals, lengths)
+
+
+def write_table(handle, name, totals, lengths, comments=()):
+    handle.write(_HEADER)
+    handle.write("\n")
+    for comment in comments:
+        handle.write("# %s\n" % (comment,))
+
+    for line in build_table(name, totals, lengths):
+        handle.write("\t".join(map(str, line)))
+        handle.write("\n")
+
+
+def sample_depth_counts(handle, regions, fraction, min_sites=1000000, rng=None):
+    """Returns a {depth: count} dictionary for a random subset of sites in a list of
+    BED regions, or in the entire genome if 'regions' is None. Sites are sampled in
+    windows of up to 1000 bp, which are fetched using the BAM index, such that
+    approximately 'fraction' of the sites (or 'min_sites' sites, if more) are
+    sampled. The number of sites sampled is returned along with the counts.
+    """
+    if regions is None:
+        regions = list(zip(handle.references, itertools.repeat(0), handle.lengths))
+    else:
+        regions = [(it.contig, it.start, it.end) for it in merge_bed_records(regions)]
+
+    # Windows are numbered consecutively across regions, and are looked up by
+    # bisecting the cumulative number of windows at the end of each region
+    window_offsets = list(
+        itertools.accumulate(
+            -(-(end - start) // _SAMPLING_WINDOW_SIZE) for (_, start, end) in regions
+        )
+    )
+
+    total_sites = sum(end - start for (_, start, end) in regions)
+    total_windows = window_offsets[-1] if window_offsets else 0
+    num_sites = min(total_sites, max(min_sites, fraction * total_sites))
+    # Regions may end with partial windows, so the number of windows is scaled
+    # rather than calculated from the number of sites, to ensure that all sites
+    # are sampled when 'fraction' is 1
+    num_windows = 0
+    if total_sites:
+        num_windows = -(-int(num_sites * total_windows) // total_sites)
+
+    sampled_sites = 0
+    counts = collections.Counter()
+    rng = rng or random.Random()
+    for window in sorted(rng.sample(range(total_windows), num_windows)):
+        region_idx = bisect.bisect_right(window_offsets, window)
+        contig, start, end = regions[region_idx]
+        if region_idx:
+            window -= window_offsets[region_idx - 1]
+
+        start += window * _SAMPLING_WINDOW_SIZE
+        end = min(end, start + _SAMPLING_WINDOW_SIZE)
+
+        coverage = handle.count_coverage(contig, start, end, quality_threshold=0)
+        counts.update(map(sum, zip(*coverage)))
+        sampled_sites += end - start
+
+    return counts, sampled_sites
 
 
 def calculate_depth_pc(counts, length):
@@ -22,6 +22,10 @@
 #
 import argparse
 import errno
+import functools
+import multiprocessing
+import os
+import re
 import sys
 
 import pysam
@@ -30,6 +34,22 @@ import paleomix
 import paleomix.common.vcffilter as vcffilter
 
 from paleomix.common.fileutils import open_ro
+from paleomix.common.text import parse_padded_table, TableError
+
+
+# Matches the name and (optional) length of contigs listed in VCF headers
+_RE_CONTIG = re.compile(br"^##contig=<ID=([^,>]+)(?:,.*?length=(\d+))?")
+
+
+def _print_header_line(args, line, has_filters):
+    if not (line.startswith(b"##") or has_filters):
+        has_filters = True
+        for item in sorted(vcffilter.describe_filters(args).items()):
+            print('##FILTER=<ID=%s,Description="%s">' % item)
+
+    print(line.decode("utf-8"), end="")
+
+    return has_filters
 
 
 def _read_files(args):
@@ -48,12 +68,130 @@ def _read_files(args):
 
                     yield vcf
                 elif in_header:
-                    if not (line.startswith(b"##") or has_filters):
-                        has_filters = True
-                        for item in sorted(vcffilter.describe_filters(args).items()):
-                            print('##FILTER=<ID=%s,Description="%s">' % item)
+                    has_filters = _print_header_line(args, line, has_filters)
+
+
+def _read_header(args, filename):
+    """Prints the header of a VCF file and returns a dictionary of contig
+    lengths, for those contigs that have a length listed in the header."""
+    lengths = {}
+    has_filters = False
+    with open_ro(filename, "rb") as handle:
+        for line in handle:
+            if not line.startswith(b"#"):
+                break
+
+            match = _RE_CONTIG.match(line)
+            if match is not None and match.group(2) is not None:
+                lengths[match.group(1).decode("utf-8")] = int(match.group(2))
+
+            has_filters = _print_header_line(args, line, has_filters)
+
+    return lengths
+
+
+def _can_shard(args):
+    """Returns true if the (single) input file may be processed in parallel,
+    which requires that it is BGZip compressed and tabix indexed."""
+    if args.threads > 1 and len(args.filenames) == 1:
+        (filename,) = args.filenames
+
+        return filename != "-" and os.path.exists(filename + ".tbi")
+
+    return False
+
+
+def _build_shards(args, lengths):
+    """Splits contigs into shards of at most --shard-size bp; contigs for which
+    no length is listed in the header are processed as a single shard. The
+    last shard of each contig is open-ended, to catch records past the end."""
+    with pysam.TabixFile(args.filenames[0]) as handle:
+        contigs = handle.contigs
+
+    for contig in contigs:
+        length = lengths.get(contig, 0)
+        start = 0
+        while start + args.shard_size < length:
+            yield (contig, start, start + args.shard_size)
+            start += args.shard_size
+
+        yield (contig, start, None)
+
+
+def _filter_shard(args, shard):
+    """Filters records in a single shard, returning the formatted output.
+
+    Records are read with a margin on either side one greater than the largest
+    of the indel window sizes, since the window of an indel includes the base
+    following its last base, ensuring that the results are identical to
+    filtering the file in one go. Only records starting in the shard itself
+    are kept.
+    """
+    contig, start, end = shard
+    margin = max(args.min_distance_between_indels, args.min_distance_to_indels) + 1
+    fetch_start = max(0, start - margin)
+    fetch_end = None if end is None else end + margin
 
-                    print(line.decode("utf-8"), end="")
+    def _fetch_records():
+        with pysam.TabixFile(args.filenames[0]) as handle:
+            for vcf in handle.fetch(
+                contig, fetch_start, fetch_end, parser=pysam.asVCF()
+            ):
+                if args.reset_filter:
+                    vcf.filter = "."
+
+                yield vcf
+
+    lines = []
+    for vcf in vcffilter.filter_vcfs(args, _fetch_records()):
+        if vcf.pos >= start and (end is None or vcf.pos < end):
+            lines.append(str(vcf))
+
+    if lines:
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def _filter_sharded(args):
+    lengths = _read_header(args, args.filenames[0])
+    shards = _build_shards(args, lengths)
+    worker = functools.partial(_filter_shard, args)
+
+    sys.stdout.flush()
+    pool = multiprocessing.Pool(args.threads)
+    try:
+        for chunk in pool.imap(worker, shards):
+            sys.stdout.write(chunk)
+
+        # terminate() would otherwise signal workers that have yet to exit
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+
+def _read_max_read_depth(filename):
+    """Returns the 'MaxDepth' value of the row covering all sites for a sample in a
+    depth histogram generated by 'paleomix depths'."""
+    with open(filename) as handle:
+        max_depths = [
+            row["MaxDepth"]
+            for row in parse_padded_table(handle)
+            if row["Name"] != "*"
+            and row["Sample"] == "*"
+            and row["Library"] == "*"
+            and row["Contig"] == "*"
+        ]
+
+    if len(max_depths) != 1:
+        raise ValueError("expected 1 summary row, found %i" % (len(max_depths),))
+    elif max_depths[0] == "NA":
+        raise ValueError("MaxDepth could not be calculated for this sample")
+    elif not max_depths[0].isdigit():
+        raise ValueError("MaxDepth is not an integer: %r" % (max_depths[0],))
+
+    return int(max_depths[0])
 
 
 def main(argv):
@@ -81,15 +219,54 @@ def main(argv):
         "added to these.",
     )
 
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of worker processes to use; this requires that a single, "
+        "BGZip compressed and tabix indexed VCF file is specified. Otherwise "
+        "the file(s) are processed using a single thread [%(default)s]",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=1000000,
+        help="Maximum size of regions processed by each worker process, when "
+        "using more than one thread [%(default)s]",
+    )
+
+    parser.add_argument(
+        "--max-read-depth-file",
+        help="Depth histogram generated by 'paleomix depths', from which the "
+        "'MaxDepth' value is used in place of --max-read-depth. The histogram "
+        "must contain exactly one row covering all sites for a sample",
+    )
+
     vcffilter.add_varfilter_options(parser)
     args = parser.parse_args(argv)
 
     if (not args.filenames or "-" in args.filenames) and sys.stdin.isatty():
         parser.error("STDIN is a terminal, terminating!")
+    elif args.threads < 1:
+        parser.error("--threads must be at least 1")
+    elif args.shard_size < 1:
+        parser.error("--shard-size must be at least 1")
+
+    if args.max_read_depth_file is not None:
+        try:
+            args.max_read_depth = _read_max_read_depth(args.max_read_depth_file)
+        except (OSError, KeyError, TableError, ValueError) as error:
+            parser.error(
+                "could not read --max-read-depth-file %r: %s"
+                % (args.max_read_depth_file, error)
+            )
 
     try:
-        for vcf in vcffilter.filter_vcfs(args, _read_files(args)):
-            print(vcf)
+        if _can_shard(args):
+            _filter_sharded(args)
+        else:
+            for vcf in vcffilter.filter_vcfs(args, _read_files(args)):
+                print(vcf)
     except IOError as error:
         # Check for broken pipe (head, less, etc).
         if error.errno != errno.EPIPE:
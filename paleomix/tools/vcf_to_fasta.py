@@ -37,8 +37,12 @@ to contain a certain amount of padding around the regions of interest.
 
 
 import argparse
+import collections
 import copy
+import functools
+import io
 import itertools
+import multiprocessing
 import os
 import sys
 import re
@@ -48,7 +52,6 @@ import pysam
 import paleomix.common.vcfwrap as vcfwrap
 import paleomix.common.text as text
 import paleomix.common.sequences as sequences
-import paleomix.common.utilities as utilities
 
 from paleomix.common.bedtools import BEDRecord
 
@@ -66,17 +69,23 @@ _VCF_DICT = re.compile("##(.*)=<(.*)>")
 # Utility functions
 
 
-def flush_fasta(sequence):
+def flush_fasta(sequence, handle=None):
     """Takes a FASTA sequence as a string, fragments it into lines of exactly
     _FASTA_COLUMNS chars (e.g. 60), and prints all complete lines. The final
     incomplete line (if any) is returned.
 
     """
-    for seq_frag in utilities.fragment(_FASTA_COLUMNS, sequence):
-        if len(seq_frag) < _FASTA_COLUMNS:
-            return seq_frag
-        print(seq_frag)
-    return ""
+    end = len(sequence) - len(sequence) % _FASTA_COLUMNS
+    if end:
+        lines = [
+            sequence[offset : offset + _FASTA_COLUMNS]
+            for offset in range(0, end, _FASTA_COLUMNS)
+        ]
+        lines.append("")
+
+        (handle or sys.stdout).write("\n".join(lines))
+
+    return sequence[end:]
 
 
 def split_beds(beds, size=_SEQUENCE_CHUNK):
@@ -95,18 +104,87 @@ def split_beds(beds, size=_SEQUENCE_CHUNK):
     return results
 
 
+class Consensus:
+    """Consensus sequence for a region, stored as a bytearray of (IUPAC encoded)
+    bases. Positions that do not correspond to exactly one base (deletions,
+    insertions, or multi-base records) are marked using a sentinel value, and
+    the actual sequence for such positions is stored in a sparse dictionary.
+    As with lists, negative positions are relative to the end of the sequence.
+    """
+
+    _SENTINEL = b"\0"
+
+    def __init__(self, length):
+        self._sequence = bytearray(b"N") * length
+        self._overrides = {}
+
+    def get(self, position):
+        """Returns the sequence at a given position; empty if deleted."""
+        if position < 0:
+            position += len(self._sequence)
+
+        value = self._overrides.get(position)
+        if value is None:
+            value = self._sequence[position]
+            value = "" if value == ord(self._SENTINEL) else chr(value)
+
+        return value
+
+    def set(self, position, value):
+        """Sets the sequence at a position, replacing any existing value; the
+        position is deleted if the value is empty."""
+        if position < 0:
+            position += len(self._sequence)
+
+        if len(value) == 1:
+            self._sequence[position] = ord(value)
+            if self._overrides:
+                self._overrides.pop(position, None)
+        else:
+            self._sequence[position] = ord(self._SENTINEL)
+            if value:
+                self._overrides[position] = value
+            elif self._overrides:
+                self._overrides.pop(position, None)
+
+    def delete(self, start, end):
+        """Removes positions in the range start to end (exclusive)."""
+        self._sequence[start:end] = self._SENTINEL * (end - start)
+        for position in [key for key in self._overrides if start <= key < end]:
+            del self._overrides[position]
+
+    def insert(self, position, value):
+        """Appends a sequence to the sequence at the specified position."""
+        self.set(position, self.get(position) + value)
+
+    def to_string(self, start, end):
+        """Returns the sequence in the range start to end (exclusive)."""
+        overrides = sorted(key for key in self._overrides if start <= key < end)
+        if not overrides:
+            segment = self._sequence[start:end]
+        else:
+            last = start
+            segment = bytearray()
+            for position in overrides:
+                segment += self._sequence[last:position]
+                segment += self._overrides[position].encode("ascii")
+                last = position + 1
+            segment += self._sequence[last:end]
+
+        return segment.translate(None, self._SENTINEL).decode("ascii")
+
+
 ###############################################################################
 ###############################################################################
 # Genotyping functions
 
-
 def add_snp(options, snp, position, sequence):
     if snp.alt != ".":
         genotype = "".join(vcfwrap.get_ml_genotype(snp, options.nth_sample))
         encoded = sequences.encode_genotype(genotype)
     else:
         encoded = snp.ref
-    sequence[position] = encoded
+    sequence.set(position, encoded)
 
 
 def add_indel(options, bed, indel, sequence):
@@ -125,8 +203,13 @@ def add_indel(options, bed, indel, sequence):
     start = max(0, bed.start - options.padding)
 
     # FIXME: parse_indel only supports a single 'alt' values
-    indel.alt = genotype[0]
-    indel = vcfwrap.parse_indel(indel)
+    # The original value is restored, as records may be shared between regions
+    vcf, alt = indel, indel.alt
+    vcf.alt = genotype[0]
+    try:
+        indel = vcfwrap.parse_indel(vcf)
+    finally:
+        vcf.alt = alt
     if indel.in_reference:
         del_start = max(indel.pos + 1, bed.start)
         del_end = min(indel.pos + 1 + len(indel.what), bed.end)
@@ -139,8 +222,7 @@ def add_indel(options, bed, indel, sequence):
                 # Non-codon sized overlap with area of interest
                 return
 
-        for position in range(del_start, del_end):
-            sequence[position - start] = ""
+        sequence.delete(del_start - start, del_end - start)
     elif (len(indel.what) % 3 == 0) or not options.whole_codon_indels_only:
         # parse_indel assumes that the insertion is always the first possible
         # base when multiple positions are possible. As a consequence, the
@@ -151,7 +233,7 @@ def add_indel(options, bed, indel, sequence):
         # It is assumed that the insertion (_) happened thus:
         #  interpretation = A_TTT
         if indel.pos >= start:
-            sequence[indel.pos - start] += indel.what
+            sequence.insert(indel.pos - start, indel.what)
 
 
 def filter_vcfs(genotype, contig, start, end):
@@ -164,12 +246,92 @@ def filter_vcfs(genotype, contig, start, end):
                 yield vcf
 
 
+class SweepReader:
+    """Implements the subset of the pysam.TabixFile interface used by
+    'build_region', for a set of (possibly overlapping) regions on a single
+    contig. Records are read from the VCF in a single pass over the union of
+    the regions, and are shared between regions, rather than being fetched
+    for each region separately. Consequently, regions must be requested in
+    order of increasing start positions.
+    """
+
+    def __init__(self, genotype, contig, regions):
+        self.contigs = genotype.contigs
+
+        self._genotype = genotype
+        self._contig = contig
+        self._ranges = collections.deque(_merge_ranges(regions))
+        self._range_end = -1
+        self._records = iter(())
+        self._next = None
+        self._buffer = collections.deque()
+
+    def fetch(self, contig, start, end, parser=None):
+        assert contig == self._contig, (contig, self._contig)
+        if start >= self._range_end:
+            self._next_range(start)
+
+        buffer = self._buffer
+        while True:
+            if self._next is None:
+                self._next = next(self._records, None)
+                if self._next is None:
+                    break
+
+            if self._next.pos >= end:
+                break
+
+            buffer.append(self._next)
+            self._next = None
+
+        # Records are sorted by start, but not by end coordinates
+        while buffer and _record_end(buffer[0]) <= start:
+            buffer.popleft()
+
+        return [vcf for vcf in buffer if vcf.pos < end and _record_end(vcf) > start]
+
+    def _next_range(self, start):
+        while self._ranges:
+            range_start, self._range_end = self._ranges.popleft()
+            if self._range_end > start:
+                self._buffer.clear()
+                self._next = None
+                self._records = iter(
+                    self._genotype.fetch(
+                        self._contig, range_start, self._range_end, parser=pysam.asVCF()
+                    )
+                )
+                return
+
+        raise ValueError("region starting at %i not requested" % (start,))
+
+
+def _record_end(vcf):
+    """Returns the past-the-end position of a VCF record on the reference."""
+    return vcf.pos + len(vcf.ref)
+
+
+def _merge_ranges(regions):
+    """Merges overlapping or adjacent (start, end) ranges."""
+    current_start = current_end = None
+    for start, end in sorted(regions):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                yield (current_start, current_end)
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+
+    if current_end is not None:
+        yield (current_start, current_end)
+
+
 def build_region(options, genotype, bed):
     # Note that bed.end is a past-the-end coordinate
     start = max(0, bed.start - options.padding)
 
     indels = []
-    sequence = ["N"] * (bed.end - start)
+    sequence = Consensus(bed.end - start)
     for vcf in filter_vcfs(genotype, bed.contig, start, bed.end):
         if vcfwrap.is_indel(vcf):
             indels.append(vcf)
@@ -180,25 +342,26 @@ def build_region(options, genotype, bed):
         for vcf in indels:
             add_indel(options, bed, vcf, sequence)
 
-    offset = bed.start - start
-    length = bed.end - bed.start
-    truncated = sequence[offset : offset + length]
-
     # Discard insertions after the last position
-    truncated[-1] = truncated[-1][:1]
+    last = bed.end - start - 1
+    sequence.set(last, sequence.get(last)[:1])
 
-    return "".join(truncated)
+    return sequence.to_string(bed.start - start, bed.end - start)
 
 
-def build_regions(options, genotype, beds, reverse_compl):
+def build_regions(options, genotype, beds, reverse_compl, cache=None):
     for bed in beds:
-        sequence = build_region(options, genotype, bed)
+        if cache is not None:
+            sequence = cache[(bed.start, bed.end)]
+        else:
+            sequence = build_region(options, genotype, bed)
+
         if reverse_compl:
             sequence = sequences.reverse_complement(sequence)
         yield sequence
 
 
-def build_genes(options, genotype, regions):
+def build_genes(options, genotype, regions, cache=None):
     def keyfunc(bed):
         return (bed.contig, bed.name, bed.start)
 
@@ -213,21 +376,100 @@ def build_genes(options, genotype, regions):
             beds.reverse()
             reverse_compl = True
 
-        fragments = build_regions(options, genotype, beds, reverse_compl)
+        fragments = build_regions(options, genotype, beds, reverse_compl, cache)
         yield (gene, fragments)
 
 
+def write_genes(options, genotype, beds, handle, cache=None):
+    for (name, fragments) in build_genes(options, genotype, beds, cache):
+        handle.write(">%s\n" % (name,))
+
+        sequence = ""
+        for fragment in fragments:
+            sequence = flush_fasta(sequence + fragment, handle)
+
+        if sequence:
+            handle.write(sequence + "\n")
+
+
 def genotype_genes(options, intervals, genotype):
     for (_, beds) in sorted(intervals.items()):
-        for (name, fragments) in build_genes(options, genotype, beds):
-            print(">%s" % (name,))
+        write_genes(options, genotype, beds, sys.stdout)
 
-            sequence = ""
-            for fragment in fragments:
-                sequence = flush_fasta(sequence + fragment)
+    return 0
+
+
+def genotype_contig_batch(options, task):
+    """Genotypes the regions from multiple sets of intervals on a single contig,
+    using a single pass over the VCF, and returns the resulting FASTA records
+    for each set of intervals (as strings)."""
+    contig, intervals = task
+
+    regions = []
+    for beds in intervals:
+        regions.extend(split_beds(beds))
+
+    def _fetch_start(bed):
+        return max(0, bed.start - options.padding)
+
+    regions.sort(key=lambda bed: (_fetch_start(bed), bed.end))
+
+    cache = {}
+    with pysam.TabixFile(options.genotype) as genotype:
+        reader = SweepReader(
+            genotype, contig, [(_fetch_start(bed), bed.end) for bed in regions]
+        )
+
+        for bed in regions:
+            key = (bed.start, bed.end)
+            if key not in cache:
+                cache[key] = build_region(options, reader, bed)
+
+    results = []
+    for beds in intervals:
+        handle = io.StringIO()
+        write_genes(options, None, beds, handle, cache)
+        results.append(handle.getvalue())
+
+    return results
+
+
+def genotype_genes_batch(options, intervals):
+    """Writes FASTA sequences for multiple sets of intervals to the
+    corresponding output files, processing one contig per worker process."""
+    contigs = set()
+    for contig_intervals in intervals:
+        contigs.update(contig_intervals)
+
+    tasks = []
+    for contig in sorted(contigs):
+        beds = [contig_intervals.get(contig, []) for contig_intervals in intervals]
+        tasks.append((contig, beds))
+
+    handles = [open(filename, "w") for filename in options.output]
+    worker = functools.partial(genotype_contig_batch, options)
+
+    pool = None
+    try:
+        if options.threads > 1:
+            pool = multiprocessing.Pool(options.threads)
+            results = pool.imap(worker, tasks)
+        else:
+            results = map(worker, tasks)
 
-            if sequence:
-                print(sequence)
+        for chunks in results:
+            for handle, chunk in zip(handles, chunks):
+                handle.write(chunk)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+        for handle in handles:
+            handle.close()
 
     return 0
 
@@ -328,10 +570,27 @@ def main(argv):
     parser.add_argument(
         "--intervals",
         metavar="BED",
+        action="append",
         help="Six column BED file; sequences on the same "
         "contig with the same name are assumed to "
         "represent the same gene, and are merged into a "
-        "single contiguous FASTA sequence.",
+        "single contiguous FASTA sequence. May be specified multiple times, "
+        "if a corresponding --output is specified for each BED file.",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="FASTA",
+        action="append",
+        help="Write the sequences for the Nth --intervals file to the Nth "
+        "--output file, instead of writing to STDOUT. All sets of intervals "
+        "are processed using a single pass over the VCF file.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of contigs to process in parallel when --output is used "
+        "[%(default)s]",
     )
     parser.add_argument(
         "--padding",
@@ -372,23 +631,38 @@ def main(argv):
         sys.stderr.write("ERROR: --nth-sample uses 1-based offsets, zero and\n")
         sys.stderr.write("       negative values are not allowed!\n")
         return 1
+    elif opts.output and len(opts.output) != len(opts.intervals or ()):
+        sys.stderr.write("ERROR: Expected one --output per --intervals file\n")
+        return 1
+    elif not opts.output and len(opts.intervals or ()) > 1:
+        sys.stderr.write("ERROR: Multiple --intervals require --output\n")
+        return 1
+    elif opts.threads < 1:
+        sys.stderr.write("ERROR: --threads must be at least 1\n")
+        return 1
 
     # Relevant VCF functions uses zero-based offsets
     opts.nth_sample -= 1
 
     genotype = pysam.TabixFile(opts.genotype)
 
-    if opts.intervals is None:
+    if not check_nth_sample(opts, genotype):
+        return 1
+
+    if opts.output:
+        intervals = [read_intervals(filename) for filename in opts.intervals]
+        if any(value is None for value in intervals):
+            return 1
+
+        return genotype_genes_batch(opts, intervals)
+    elif opts.intervals is None:
         intervals = parse_intervals(genotype)
     else:
-        intervals = read_intervals(opts.intervals)
+        intervals = read_intervals(opts.intervals[0])
 
     if intervals is None:
         return 1
 
-    if not check_nth_sample(opts, genotype):
-        return 1
-
     return genotype_genes(opts, intervals, genotype)
 
 
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2012 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import pytest
+
+import paleomix.common.bamfiles as bamfiles
+
+from testutils import write_bam
+
+###############################################################################
+###############################################################################
+# index_statistics
+
+
+def _write_bam(filename, reads_per_contig, index=True):
+    contigs = [("chr%i" % (tid,), 1000) for tid in range(len(reads_per_contig))]
+    reads = []
+    for tid, count in enumerate(reads_per_contig):
+        reads.extend((tid, pos, 4) for pos in range(count))
+
+    return write_bam(filename, contigs, reads, index=index)
+
+
+def test_index_statistics(tmp_path):
+    filename = tmp_path / "test.bam"
+    _write_bam(filename, (3, 0, 5))
+
+    statistics = bamfiles.index_statistics(str(filename))
+
+    assert [(row.contig, row.mapped) for row in statistics] == [
+        ("chr0", 3),
+        ("chr1", 0),
+        ("chr2", 5),
+    ]
+
+
+def test_index_statistics__updated_file(tmp_path):
+    filename = tmp_path / "test.bam"
+    _write_bam(filename, (3, 0, 5))
+    assert bamfiles.index_statistics(str(filename))[0].mapped == 3
+
+    _write_bam(filename, (1, 2, 3))
+    statistics = bamfiles.index_statistics(str(filename))
+
+    assert [row.mapped for row in statistics] == [1, 2, 3]
+
+
+def test_index_statistics__no_index(tmp_path):
+    filename = tmp_path / "test.bam"
+    _write_bam(filename, (1, 1, 1), index=False)
+
+    with pytest.raises(ValueError):
+        bamfiles.index_statistics(str(filename))
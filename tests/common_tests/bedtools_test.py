@@ -29,6 +29,7 @@ from paleomix.common.bedtools import (
     BEDRecord,
     merge_bed_records,
     pad_bed_records,
+    split_bed_records,
 )
 
 ###############################################################################
@@ -400,6 +401,81 @@ def test_merge_records__complex_example__unsorted():
     ]
 
 
+def test_merge_records__contained_record():
+    assert merge_bed_records(
+        [_new_bed_record("chr1", 1234, 9012), _new_bed_record("chr1", 2000, 3000)]
+    ) == [_new_bed_record("chr1", 1234, 9012)]
+
+
+###############################################################################
+# split_bed_records
+
+
+def test_split_records__empty_sequences():
+    assert split_bed_records((), 1) == [[]]
+    assert split_bed_records([], 2) == [[], []]
+
+
+@pytest.mark.parametrize("num_shards", (0, -1))
+def test_split_records__invalid_number_of_shards(num_shards):
+    with pytest.raises(ValueError):
+        split_bed_records([_new_bed_record("chr1", 0, 100)], num_shards)
+
+
+def test_split_records__single_shard():
+    assert split_bed_records(
+        [_new_bed_record("chr1", 0, 100, "foo"), _new_bed_record("chr2", 10, 20)], 1
+    ) == [[_new_bed_record("chr1", 0, 100), _new_bed_record("chr2", 10, 20)]]
+
+
+def test_split_records__whole_records():
+    assert split_bed_records(
+        [
+            _new_bed_record("chr1", 0, 100),
+            _new_bed_record("chr2", 10, 60),
+            _new_bed_record("chr2", 80, 130),
+        ],
+        2,
+    ) == [
+        [_new_bed_record("chr1", 0, 100)],
+        [_new_bed_record("chr2", 10, 60), _new_bed_record("chr2", 80, 130)],
+    ]
+
+
+def test_split_records__split_records():
+    assert split_bed_records(
+        [_new_bed_record("chr1", 0, 100), _new_bed_record("chr2", 10, 60)], 3
+    ) == [
+        [_new_bed_record("chr1", 0, 50)],
+        [_new_bed_record("chr1", 50, 100)],
+        [_new_bed_record("chr2", 10, 60)],
+    ]
+
+
+def test_split_records__uneven_lengths():
+    shards = split_bed_records([_new_bed_record("chr1", 0, 10)], 3)
+
+    assert shards == [
+        [_new_bed_record("chr1", 0, 3)],
+        [_new_bed_record("chr1", 3, 6)],
+        [_new_bed_record("chr1", 6, 10)],
+    ]
+
+
+def test_split_records__more_shards_than_sites():
+    assert split_bed_records([_new_bed_record("chr1", 0, 2)], 3) == [
+        [],
+        [_new_bed_record("chr1", 0, 1)],
+        [_new_bed_record("chr1", 1, 2)],
+    ]
+
+
+def test_split_records__empty_records_are_skipped():
+    assert split_bed_records(
+        [_new_bed_record("chr1", 10, 10), _new_bed_record("chr1", 20, 30)], 1
+    ) == [[_new_bed_record("chr1", 20, 30)]]
+
+
 def _new_bed_record(*args):
     record = BEDRecord()
     record._fields = list(args)
@@ -46,6 +46,8 @@ from paleomix.common.fileutils import (
     move_file,
     copy_file,
     open_ro,
+    read_json_cache,
+    write_json_cache,
     try_remove,
     try_rmtree,
     describe_files,
@@ -634,6 +636,53 @@ def test_open_ro__close_handle_on_error() -> None:
     )
 
 
+###############################################################################
+###############################################################################
+# Tests for 'read_json_cache' / 'write_json_cache'
+
+
+def test_json_cache__round_trip(tmp_path) -> None:
+    filename = tmp_path / "subdir" / "cache.json"
+    assert write_json_cache(filename, (1, "key"), {"value": [1, 2.5, None]})
+    assert read_json_cache(filename, (1, "key")) == {"value": [1, 2.5, None]}
+    assert os.listdir(tmp_path / "subdir") == ["cache.json"]
+
+
+def test_json_cache__key_mismatch(tmp_path) -> None:
+    filename = tmp_path / "cache.json"
+    assert write_json_cache(filename, (1, "key"), "value")
+    assert read_json_cache(filename, (2, "key")) is None
+
+
+def test_json_cache__missing_file(tmp_path) -> None:
+    assert read_json_cache(tmp_path / "cache.json", "key") is None
+
+
+@pytest.mark.parametrize("text", ("", "{", "[1, 2]", '{"key": 1}\n!'))
+def test_json_cache__malformed_file(tmp_path, text) -> None:
+    filename = tmp_path / "cache.json"
+    filename.write_text(text)
+
+    assert read_json_cache(filename, 1) is None
+
+
+def test_json_cache__unwritable_location(tmp_path) -> None:
+    # A file in place of the cache folder cannot be written to, even as root
+    (tmp_path / "subdir").write_text("")
+    filename = tmp_path / "subdir" / "cache.json"
+
+    assert not write_json_cache(filename, "key", "value")
+    assert read_json_cache(filename, "key") is None
+    assert os.listdir(tmp_path) == ["subdir"]
+
+
+def test_json_cache__unserializable_value(tmp_path) -> None:
+    with pytest.raises(TypeError):
+        write_json_cache(tmp_path / "cache.json", "key", object())
+
+    assert not os.listdir(tmp_path)
+
+
 ###############################################################################
 ###############################################################################
 # Tests for 'try_remove'
@@ -26,6 +26,8 @@ import io
 
 import pytest
 
+import paleomix.common.formats.fasta
+
 from paleomix.common.formats.fasta import FASTA, FASTAError
 
 
@@ -138,6 +140,22 @@ def test_fasta__write__multiple_lines():
     assert stringf.getvalue() == expected
 
 
+@pytest.mark.parametrize("nlines", (1024, 1025, 2048, 3000))
+def test_fasta__write__long_sequence(nlines):
+    lines = [_SEQ_FRAG * 10] * nlines + [_SEQ_FRAG]
+    expected = ">foobar\n%s\n" % ("\n".join(lines),)
+    stringf = io.StringIO()
+    FASTA("foobar", None, "".join(lines)).write(stringf)
+    assert stringf.getvalue() == expected
+
+
+def test_fasta__write__long_sequence__non_ascii():
+    expected = ">foobar\n%s\n" % ("\n".join(["Æ" * 60] * 1100),)
+    stringf = io.StringIO()
+    FASTA("foobar", None, "Æ" * 60 * 1100).write(stringf)
+    assert stringf.getvalue() == expected
+
+
 ###############################################################################
 ###############################################################################
 # Tests for FASTA.from_lines
@@ -233,6 +251,85 @@ def test_fasta__from_file(func, tmp_path):
     assert list(FASTA.from_file(tmp_path / "file")) == expected
 
 
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(paleomix.common.formats.fasta, "_FASTA_BLOCK_SIZE", 7)
+
+
+_FROM_FILE_RECORDS = [
+    FASTA("first", None, "TGTTCTCCACCGTGCACAACCCTTCATCCA"),
+    FASTA("Second", "XT:1:0", "GAGAGCTCAGCTAAC"),
+    FASTA("Third", None, ""),
+    FASTA("Fourth", None, "CGCTGACCAAAAACGGACAGGGCATTCGGC"),
+]
+
+_FROM_FILE_TEXT = (
+    ">first\nTGTTCTCCACCGTGCACAAC\nCCTTCATCCA\n"
+    ">Second XT:1:0\nGAGAGCTCAGCTAAC\n"
+    ">Third\n\n"
+    ">Fourth\nCGCTGACCAAAAACGGACAG\nGGCATTCGGC"
+)
+
+
+@pytest.mark.parametrize("newline", ("\n", "\r\n", "\r"))
+def test_fasta__from_file__newlines(small_blocks, tmp_path, newline):
+    filename = tmp_path / "file.fasta"
+    filename.write_bytes(_FROM_FILE_TEXT.replace("\n", newline).encode("ascii"))
+
+    assert list(FASTA.from_file(filename)) == _FROM_FILE_RECORDS
+
+
+def test_fasta__from_file__trailing_whitespace(small_blocks, tmp_path):
+    filename = tmp_path / "file.fasta"
+    filename.write_text(">foo bar \nAC GT\t\nACGT  \n>bar\n \nA\n")
+
+    assert list(FASTA.from_file(filename)) == [
+        FASTA("foo", "bar", "AC GTACGT"),
+        FASTA("bar", None, "A"),
+    ]
+
+
+def test_fasta__from_file__non_ascii(small_blocks, tmp_path):
+    filename = tmp_path / "file.fasta"
+    filename.write_text(">foo Æble\nACGTÆ\nØ\n", encoding="utf-8")
+
+    assert list(FASTA.from_file(filename)) == [FASTA("foo", "Æble", "ACGTÆØ")]
+
+
+@pytest.mark.parametrize(
+    "text",
+    (
+        "ACGT\n>foo\nACGT\n",
+        "\n>foo\nACGT\n",
+        ">\nACGT\n",
+        ">foo\nACGT\n> \nACGT\n",
+        ">foo\n",
+        ">foo",
+        ">foo\n>bar\nACGT\n",
+        ">foo\nACGT\n>bar\n",
+    ),
+)
+def test_fasta__from_file__malformed(small_blocks, tmp_path, text):
+    filename = tmp_path / "file.fasta"
+    filename.write_text(text)
+
+    with pytest.raises(FASTAError):
+        list(FASTA.from_file(filename))
+
+
+def test_fasta__from_file__long_sequences(tmp_path):
+    expected = [
+        FASTA("foo", None, "ACGTTGCA" * 100000),
+        FASTA("bar", "meta", "TTGCAC" * 200000),
+    ]
+
+    with (tmp_path / "file.fasta").open("wt") as handle:
+        for record in expected:
+            record.write(handle)
+
+    assert list(FASTA.from_file(tmp_path / "file.fasta")) == expected
+
+
 ###############################################################################
 ###############################################################################
 
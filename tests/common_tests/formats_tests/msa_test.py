@@ -216,6 +216,13 @@ def test_msa_filter_singletons__filter_by_both():
     assert result == _FILTER_MSA_1
 
 
+def test_msa_filter_singletons__lower_case_bases():
+    msa = MSA((FASTA("Seq1", None, "acgrN"), FASTA("Seq2", None, "AcTan")))
+    expected = MSA((FASTA("Seq1", None, "acnaN"), FASTA("Seq2", None, "AcTan")))
+    result = msa.filter_singletons("Seq1", ["Seq2"])
+    assert result == expected
+
+
 def test_msa_filter_singletons__filter_by_itself():
     with pytest.raises(MSAError):
         _FILTER_MSA_1.filter_singletons("Seq1", ["Seq1", "Seq2"])
@@ -20,13 +20,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import itertools
+import random
+
 import pytest
 
 from paleomix.common.formats.newick import (
     GraphError,
     Newick,
     NewickError,
+    NewickSplits,
     NewickParseError,
+    _NewickGraph,
 )
 
 ###############################################################################
@@ -230,6 +235,231 @@ def test_newick__reroot_on_midpoint__invalid_branch_lengths(newick):
         source.reroot_on_midpoint()
 
 
+def test_newick__reroot_on_midpoint__zero_length_branches_at_midpoint():
+    # The midpoint (2.0 from A) lies on both ends of the zero-length branch
+    source = Newick.from_string("((A:2,B:1):0,C:2,D:1);")
+    rerooted = source.reroot_on_midpoint()
+
+    assert rerooted in (
+        Newick.from_string("((A:2,B:1):0,C:2,D:1);"),
+        Newick.from_string("((C:2,D:1):0,A:2,B:1);"),
+    )
+    assert _max_leaf_depth(rerooted) == 2.0
+
+
+###############################################################################
+###############################################################################
+# Rerooting compared to the previous (quadratic / exponential) implementation
+
+
+class _ReferenceGraph(_NewickGraph):
+    """Graph using the original, brute-force rerooting implementations."""
+
+    def _find_longest_path(self):
+        path_blengths = {}
+        path_guides = {}
+
+        def _collect_paths(guide, length, p_node, c_node):
+            length += self.get_path_length(p_node, c_node)
+
+            guide.append(c_node)
+            key = frozenset(guide)
+            path_blengths[key] = length
+            path_guides[key] = guide
+
+            for other in self.connections[c_node]:
+                if other not in key:
+                    _collect_paths(list(guide), length, c_node, other)
+
+        for p_node, connections in self.connections.items():
+            for c_node in connections:
+                _collect_paths([p_node], 0, p_node, c_node)
+
+        key, length = max(path_blengths.items(), key=lambda item: item[1])
+        return path_guides[key], length
+
+    def _create_root_with_clade(self, taxa):
+        clades = self._collect_clades()
+        candidates = self._collect_candidate_clades(clades, taxa)
+        size, p_node, n_node = min(candidates, key=lambda item: item[0])
+
+        root_length = self.get_path_length(p_node, n_node)
+        if root_length is not None:
+            root_length = float(root_length) / 2.0
+
+        self.remove_connection(p_node, n_node)
+        self.add_connection(None, p_node, root_length)
+        self.add_connection(None, n_node, root_length)
+
+        return None
+
+    def _collect_candidate_clades(self, clades, taxa):
+        return [
+            (len(clade), p_node, n_node)
+            for (p_node, connections) in clades.items()
+            for (n_node, clade) in connections.items()
+            if taxa.issubset(clade)
+        ]
+
+    def _collect_clades(self):
+        clades = {}
+        for node_a, connections in self.connections.items():
+            for node_b in connections:
+                self._collect_clade_from(clades, node_a, node_b)
+        return clades
+
+    def _collect_clade_from(self, cache, p_node, c_node):
+        clade = cache.setdefault(p_node, {}).get(c_node)
+        if clade is None:
+            clade = set()
+            if self.is_leaf(c_node):
+                clade.add(c_node)
+
+            for n_node in self.connections[c_node]:
+                if n_node != p_node:
+                    clade.update(self._collect_clade_from(cache, c_node, n_node))
+
+            clade = cache[p_node][c_node] = frozenset(clade)
+        return clade
+
+
+def _random_tree(rng, num_taxa):
+    """Random tree with integer branch lengths, so that the midpoint can be
+    calculated exactly, and with unique names for leaf nodes."""
+    nodes = [
+        Newick(name="T%i" % (idx,), length=rng.randint(1, 10**6))
+        for idx in range(num_taxa)
+    ]
+
+    while len(nodes) > 3:
+        rng.shuffle(nodes)
+        num_children = rng.choice((2, 2, 3))
+        children, nodes = nodes[:num_children], nodes[num_children:]
+        nodes.append(Newick(length=rng.randint(1, 10**6), children=children))
+
+    # Round-trip via a string, so that lengths are represented as when parsed
+    return Newick.from_string(str(Newick(children=nodes)))
+
+
+def _leaf_distances(tree):
+    """Returns the distances between every pair of leaves in a tree."""
+    depths = {}
+
+    def _collect(node, depth, path):
+        depth += float(node.length or 0)
+        if node.is_leaf:
+            depths[node.name] = (depth, path)
+        for idx, child in enumerate(node.children):
+            _collect(child, depth, path + (id(node), idx))
+
+    _collect(tree, 0.0, ())
+
+    distances = {}
+    for (name_a, (depth_a, path_a)), (
+        name_b,
+        (depth_b, path_b),
+    ) in itertools.combinations(depths.items(), 2):
+        # Depth of the last common ancestor, found via the shared path prefix
+        shared = 0
+        while path_a[shared : shared + 2] == path_b[shared : shared + 2]:
+            shared += 2
+        lca = _depth_of(tree, path_a[:shared])
+        distances[(name_a, name_b)] = depth_a + depth_b - 2 * lca
+
+    return distances
+
+
+def _depth_of(tree, path):
+    depth = 0.0
+    node = tree
+    for idx in path[1::2]:
+        node = node.children[idx]
+        depth += float(node.length or 0)
+    return depth
+
+
+def _max_leaf_depth(tree):
+    def _depths(node, depth):
+        depth += float(node.length or 0)
+        if node.is_leaf:
+            yield depth
+        for child in node.children:
+            yield from _depths(child, depth)
+
+    return max(depth for child in tree.children for depth in _depths(child, 0.0))
+
+
+def test_newick__reroot_on_midpoint__matches_previous_implementation():
+    rng = random.Random(1234)
+    num_compared = 0
+    for _ in range(200):
+        tree = _random_tree(rng, rng.randint(2, 12))
+        distances = sorted(_leaf_distances(tree).values())
+        if len(distances) > 1 and distances[-1] == distances[-2]:
+            continue  # Multiple longest paths
+
+        expected = _ReferenceGraph(tree).reroot_on_midpoint()
+        rerooted = tree.reroot_on_midpoint()
+
+        assert rerooted == expected
+        assert _max_leaf_depth(rerooted) == distances[-1] / 2
+        num_compared += 1
+
+    assert num_compared > 150
+
+
+def test_newick__reroot_on_taxa__matches_previous_implementation():
+    rng = random.Random(4321)
+    num_compared = 0
+    for _ in range(200):
+        num_taxa = rng.randint(3, 12)
+        tree = _random_tree(rng, num_taxa)
+        names = ["T%i" % (idx,) for idx in range(num_taxa)]
+        taxa = rng.sample(names, rng.randint(1, min(3, num_taxa - 1)))
+
+        reference = _ReferenceGraph(tree)
+        candidates = reference._collect_candidate_clades(
+            reference._collect_clades(),
+            reference._collect_nodes_from_names(frozenset(taxa)),
+        )
+        sizes = sorted(size for size, _, _ in candidates)
+        if len(sizes) > 1 and sizes[0] == sizes[1]:
+            continue  # Multiple equally small clades
+
+        assert tree.reroot_on_taxa(taxa) == reference.reroot_on_taxa(taxa)
+        num_compared += 1
+
+    assert num_compared > 150
+
+
+def test_newick__reroot_on_taxa__equally_small_clades():
+    # Both (A, B, C) and (A, B, D) are the smallest clades containing A and B
+    source = Newick.from_string("(A,B,C,D);")
+    rerooted = source.reroot_on_taxa(("A", "B"))
+
+    assert rerooted in (
+        Newick.from_string("((A,B,D),C);"),
+        Newick.from_string("((A,B,C),D);"),
+    )
+    # Ties are resolved consistently
+    assert rerooted == source.reroot_on_taxa(("A", "B"))
+
+
+def test_newick__reroot_on_taxa__internal_node_with_taxa_name():
+    # Only leaf nodes are considered taxa
+    source = Newick.from_string("((A,B)C,(C,D));")
+    expected = Newick.from_string("(((A,B)C,D),C);")
+
+    assert source.reroot_on_taxa("C") == expected
+
+
+def test_newick__reroot_on_taxa__internal_node_name_only():
+    source = Newick.from_string("((A,B)X,(C,D)Y);")
+
+    with pytest.raises(ValueError, match="unknown taxa: X"):
+        source.reroot_on_taxa("X")
+
+
 ###############################################################################
 ###############################################################################
 # add_support
@@ -291,6 +521,15 @@ def test_newick__add_support__multiple_trees__two_cladees():
     assert expected == result
 
 
+def test_newick__add_support__iterator():
+    main_tree = Newick.from_string("(((A,B),C),D);")
+    bootstraps = ("(((C,D),A),B);", "(((A,D),B),C);")
+    bootstraps = (Newick.from_string(tree) for tree in bootstraps)
+    expected = Newick.from_string("(((A,B)1,C)2,D);")
+    result = main_tree.add_support(bootstraps)
+    assert expected == result
+
+
 def test_newick__add_support__differing_leaf_names():
     main_tree = Newick.from_string("(((A,B),C),D);")
     bootstraps = [Newick.from_string("(((C,E),B),A);")]
@@ -298,6 +537,13 @@ def test_newick__add_support__differing_leaf_names():
         main_tree.add_support(bootstraps)
 
 
+def test_newick__add_support__missing_leaf_names():
+    main_tree = Newick.from_string("(((A,B),C),D);")
+    bootstraps = [Newick.from_string("((C,B),A);")]
+    with pytest.raises(NewickError):
+        main_tree.add_support(bootstraps)
+
+
 _ADD_SUPPORT_FORMATTING = (
     ("{Support}", "(((A,B)1,C)3,D);"),
     ("{Percentage:.0f}", "(((A,B)33,C)100,D);"),
@@ -325,6 +571,52 @@ def test_newick__add_support__unique_names_required():
         main_tree.add_support(bootstraps)
 
 
+def test_newick__add_support__splits_reused():
+    bootstraps = [
+        Newick.from_string("(((C,D),A),B);"),
+        Newick.from_string("(((C,B),A),D);"),
+        Newick.from_string("(((A,D),B),C);"),
+    ]
+    splits = NewickSplits("ABCD", bootstraps)
+
+    for main_tree, expected in (
+        ("(((A,B),C),D);", "(((A,B)1,C)3,D);"),
+        ("(((D,C),B),A);", "(((D,C)1,B)3,A);"),
+        ("((A,D),(B,C));", "((A,D)2,(B,C)2);"),
+    ):
+        main_tree = Newick.from_string(main_tree)
+        expected = Newick.from_string(expected)
+
+        assert main_tree.add_support(splits) == expected
+        assert main_tree.add_support(bootstraps) == expected
+
+
+def test_newick__add_support__splits__differing_leaf_names():
+    main_tree = Newick.from_string("(((A,B),C),E);")
+    splits = NewickSplits("ABCD", [Newick.from_string("(((A,B),C),D);")])
+    with pytest.raises(NewickError):
+        main_tree.add_support(splits)
+
+
+def test_newick__add_support__splits__missing_leaf_names():
+    main_tree = Newick.from_string("((A,B),C);")
+    splits = NewickSplits("ABCD", [Newick.from_string("(((A,B),C),D);")])
+    with pytest.raises(NewickError):
+        main_tree.add_support(splits)
+
+
+def test_newick__add_support__splits__unique_names_required():
+    main_tree = Newick.from_string("(((A,B),C),A);")
+    splits = NewickSplits("ABC", [Newick.from_string("((A,B),C);")])
+    with pytest.raises(NewickError):
+        main_tree.add_support(splits)
+
+
+def test_newick_splits__unique_names_required():
+    with pytest.raises(NewickError):
+        NewickSplits("ABCA", [])
+
+
 ###############################################################################
 ###############################################################################
 # from_string
@@ -382,6 +674,13 @@ def test_newick__parse__subnode__two_taxa():
     assert Newick.from_string("(A,(B,C));") == top_node
 
 
+def test_newick__parse__deeply_nested():
+    nodes = 5000
+    string = "(" * nodes + "T0,T1)" + "".join(",T%i)" % i for i in range(2, nodes + 1))
+    tree = Newick.from_string(string + ";")
+    assert list(tree.get_leaf_names()) == ["T%i" % i for i in range(nodes + 1)]
+
+
 ###########################################################################
 ###########################################################################
 # cmp - white-box, just make sure all properties are compared
@@ -490,6 +789,16 @@ def test_newick__malformed__multiple_lengths():
         Newick.from_string("(A:1:2);")
 
 
+def test_newick__malformed__missing_comma():
+    with pytest.raises(NewickParseError):
+        Newick.from_string("((A)(B));")
+
+
+def test_newick__malformed__data_after_semicolon():
+    with pytest.raises(NewickParseError):
+        Newick.from_string("(A,B);C;")
+
+
 ###############################################################################
 ###############################################################################
 # Implicit leafs are not supported (due to problems with ambiguiety)
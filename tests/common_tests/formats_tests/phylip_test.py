@@ -20,11 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import io
+
 from unittest.mock import patch
 
 from paleomix.common.formats.fasta import FASTA
 from paleomix.common.formats.msa import MSA
-from paleomix.common.formats.phylip import interleaved_phy
+from paleomix.common.formats.phylip import interleaved_phy, write_interleaved_phy
 
 _MSA_SHORT_SEQUENCES = MSA(
     [FASTA("seq1", None, "ACGTTGATAACCAGG"), FASTA("seq2", None, "TGCAGAGTACGACGT")]
@@ -167,3 +169,28 @@ def test_interleaved_phy__different_lengths():
         interleaved_phy(_MSA_MEDIUM_NAMES)
 
     mock.assert_called_once()
+
+
+###############################################################################
+###############################################################################
+# Tests of 'write_interleaved_phy'
+
+
+def test_write_interleaved_phy__same_as_interleaved_phy():
+    records = sorted(_MSA_LONG_SEQUENCES)
+    handle = io.StringIO()
+    write_interleaved_phy(
+        handle,
+        names=[record.name for record in records],
+        sequences=[record.sequence for record in records],
+        seqlen=_MSA_LONG_SEQUENCES.seqlen(),
+    )
+
+    assert handle.getvalue() == interleaved_phy(_MSA_LONG_SEQUENCES)
+
+
+def test_write_interleaved_phy__empty_sequences():
+    handle = io.StringIO()
+    write_interleaved_phy(handle, names=["seq1", "seq2"], sequences=["", ""], seqlen=0)
+
+    assert handle.getvalue() == "2 0\n\nseq1      \nseq2      "
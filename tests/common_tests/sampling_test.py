@@ -20,6 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import array
+
 from unittest.mock import Mock
 
 import pytest
@@ -121,6 +123,14 @@ def test_reservoir_sampling__upsample_equals_input():
     assert result == list(range(5))
 
 
+def test_reservoir_sampling__user_supplied_reservoir():
+    rng = Mock(randint=lambda _min, _max: 0)
+    reservoir = array.array("l")
+    result = sampling.reservoir_sampling([1, 2, 3], 2, rng, reservoir)
+    assert result is reservoir
+    assert result == array.array("l", [3, 2])
+
+
 def test_reservoir_sampling__downsample_to_zero():
     result = sampling.reservoir_sampling(list(range(5)), 0)
     assert result == []
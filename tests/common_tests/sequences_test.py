@@ -58,6 +58,14 @@ def test_complement__multiple_nts_mixed_case():
     assert complement("aGtCn") == "tCaGn"
 
 
+def test_complement__bytes():
+    assert complement(_REF_SRC.encode("ascii")) == _REF_DST.encode("ascii")
+
+
+def test_complement__bytearray():
+    assert complement(bytearray(b"aGtCn")) == bytearray(b"tCaGn")
+
+
 ###############################################################################
 ###############################################################################
 # Tests for 'complement'
@@ -67,6 +75,11 @@ def test_reverse_complement():
     assert reverse_complement(_REF_SRC) == _REF_DST[::-1]
 
 
+def test_reverse_complement__bytes():
+    expected = _REF_DST[::-1].encode("ascii")
+    assert reverse_complement(_REF_SRC.encode("ascii")) == expected
+
+
 ###############################################################################
 ###############################################################################
 # Tests for 'encode_genotype'
@@ -144,3 +157,17 @@ def test_split__empty_group():
 def test_split__partial_group():
     expected = {"1": "AA", "2": "CA", "3": "G"}
     assert split("ACGAA") == expected
+
+
+def test_split__interleaved_groups():
+    assert split("ACGTAGCTAG", "1213") == {"1": "AGACA", "2": "CGG", "3": "TT"}
+    assert split("ACGTACGTACGT", "1123") == {"1": "ACACAC", "2": "GGG", "3": "TTT"}
+    assert split("ACGTAGCT", "121") == {"1": "AGTGC", "2": "CAT"}
+
+
+def test_split__interleaved_groups__non_ascii():
+    assert split("ÆCGØAG", "112") == {"1": "ÆCØA", "2": "GG"}
+
+
+def test_split__bytes():
+    assert split(b"ACGAACT", "112") == {"1": b"ACAAT", "2": b"GC"}
@@ -408,6 +408,11 @@ def test_commandnode_constructor__output_files():
     assert _SIMPLE_CMD_NODE.output_files == _OUT_FILES
 
 
+def test_commandnode_constructor__output_files__override():
+    node = CommandNode(command=_SIMPLE_CMD_MOCK, output_files=["/foo/bar.txt"])
+    assert node.output_files == frozenset(["/foo/bar.txt"])
+
+
 def test_commandnode_constructor__auxiliary_files():
     assert _SIMPLE_CMD_NODE.auxiliary_files == _AUX_FILES
 
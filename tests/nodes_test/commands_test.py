@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import types
+
+import pytest
+
+from paleomix.node import NodeError
+from paleomix.nodes.commands import EstimateMaxDepthNode
+from paleomix.tools.vcf_filter import _read_max_read_depth
+
+from testutils import write_bam
+
+
+def run_node(tmp_path, reads):
+    reads = [(0, pos, length) for (pos, length) in reads]
+    input_file = write_bam(tmp_path / "input.bam", {"chr1": 2000}, reads)
+    output_file = str(tmp_path / "output.depths")
+
+    node = EstimateMaxDepthNode(
+        target_name="sample",
+        input_file=input_file,
+        output_file=output_file,
+        fraction=1.0,
+    )
+    node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+    return output_file
+
+
+def test_estimate_max_depth_node(tmp_path):
+    # All sites have depth 1, except for 5 sites (0.25%) with depth 2
+    reads = [(pos, 100) for pos in range(0, 2000, 100)] + [(0, 5)]
+    output_file = run_node(tmp_path, reads)
+
+    assert _read_max_read_depth(output_file) == 1
+
+
+@pytest.mark.parametrize(
+    "reads",
+    (
+        # No reads
+        [],
+        # All sites have the same depth
+        [(pos, 100) for pos in range(0, 2000, 100)],
+    ),
+)
+def test_estimate_max_depth_node__not_calculated(tmp_path, reads):
+    with pytest.raises(NodeError, match="Could not estimate MaxDepth"):
+        run_node(tmp_path, reads)
+
+    assert not (tmp_path / "output.depths").exists()
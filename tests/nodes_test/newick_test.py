@@ -0,0 +1,61 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import types
+
+from paleomix.common.formats.newick import Newick
+from paleomix.nodes.newick import NewickSupportNode
+
+_SUPPORT_TREES = (
+    "(((C,D),A),B);\n(((C,B),A),D);\n",
+    "(((A,D),B),C);\n",
+)
+
+
+def test_newick_support_node(tmp_path):
+    main_tree_file = tmp_path / "main.newick"
+    main_tree_file.write_text("(((A,B),C),D);\n(((D,C),B),A);\n((A,D),(B,C));\n")
+
+    support_tree_files = []
+    for idx, trees in enumerate(_SUPPORT_TREES):
+        support_tree_file = tmp_path / ("support_%i.newick" % (idx,))
+        support_tree_file.write_text(trees)
+        support_tree_files.append(str(support_tree_file))
+
+    output_file = tmp_path / "output.newick"
+    node = NewickSupportNode(
+        main_tree_files=str(main_tree_file),
+        support_tree_files=support_tree_files,
+        output_file=str(output_file),
+    )
+
+    (tmp_path / "temp").mkdir()
+    node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+    expected = [
+        Newick.from_string("(((A,B)1,C)3,D);"),
+        Newick.from_string("(((D,C)1,B)3,A);"),
+        Newick.from_string("((A,D)2,(B,C)2);"),
+    ]
+
+    with output_file.open() as handle:
+        assert list(map(Newick.from_string, handle)) == expected
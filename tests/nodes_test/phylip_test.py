@@ -0,0 +1,176 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import random
+import types
+
+import pytest
+
+from paleomix.nodes.phylip import PHYLIPBootstrapNode, _read_sequences
+from paleomix.pipelines.phylo.parts.phylo import _build_examl_bootstraps
+
+_PARTITIONS = ((0, 7), (7, 10), (10, 25))
+
+
+def write_alignment(tmp_path, rng, num_sequences=5):
+    names = ["seq_%i" % (idx,) for idx in range(num_sequences)]
+    length = _PARTITIONS[-1][-1]
+    sequences = ["".join(rng.choice("ACGT-") for _ in range(length)) for _ in names]
+
+    alignment = tmp_path / "input.phy"
+    with alignment.open("w") as handle:
+        handle.write("%i %i\n" % (len(names), length))
+        for name, sequence in zip(names, sequences):
+            handle.write("%s %s\n" % (name, sequence))
+
+    partitions = tmp_path / "input.partitions"
+    with partitions.open("w") as handle:
+        for idx, (start, end) in enumerate(_PARTITIONS):
+            handle.write("DNA, part_%i = %i-%i\n" % (idx, start + 1, end))
+
+    return str(alignment), str(partitions), names, sequences
+
+
+def expected_bootstrap(names, sequences, seed):
+    """Simple implementation selecting columns one sequence at a time."""
+    rng = random.Random(seed)
+    columns = []
+    for start, end in _PARTITIONS:
+        columns.extend(rng.choices(range(start, end), k=end - start))
+
+    return [
+        (name, "".join(sequence[column] for column in columns))
+        for name, sequence in zip(names, sequences)
+    ]
+
+
+def run_bootstrap_node(tmp_path, alignment, partitions, num_files, seed):
+    destination = tmp_path / "output"
+    destination.mkdir(exist_ok=True)
+    output_files = [str(destination / ("%i.phy" % (idx,))) for idx in range(num_files)]
+
+    node = PHYLIPBootstrapNode(
+        input_alignment=alignment,
+        input_partition=partitions,
+        output_alignment=output_files,
+        seed=seed,
+    )
+    (tmp_path / "temp").mkdir(exist_ok=True)
+    node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+    results = []
+    for filename in output_files:
+        header, names, sequences = _read_sequences(filename)
+        results.append((header, list(zip(names, sequences))))
+
+    return node, results
+
+
+@pytest.mark.parametrize("num_sequences", (1, 2, 5))
+def test_phylip_bootstrap_node__all_outputs_written(tmp_path, num_sequences):
+    rng = random.Random(num_sequences)
+    alignment, partitions, names, sequences = write_alignment(
+        tmp_path, rng, num_sequences
+    )
+    seeds = [rng.getrandbits(32) for _ in range(4)]
+
+    _, results = run_bootstrap_node(tmp_path, alignment, partitions, 4, seeds)
+
+    assert len(results) == len(seeds)
+    for (header, records), seed in zip(results, seeds):
+        assert header == "%i %i\n" % (len(names), len(sequences[0]))
+        assert records == expected_bootstrap(names, sequences, seed)
+
+
+def test_phylip_bootstrap_node__fixed_seed_is_reproducible(tmp_path):
+    alignment, partitions, _, _ = write_alignment(tmp_path, random.Random(1))
+
+    _, results_1 = run_bootstrap_node(tmp_path, alignment, partitions, 3, 12345)
+    _, results_2 = run_bootstrap_node(tmp_path, alignment, partitions, 3, 12345)
+    _, results_3 = run_bootstrap_node(tmp_path, alignment, partitions, 3, 54321)
+
+    assert results_1 == results_2
+    assert results_1 != results_3
+    # Each output file is generated using a different seed
+    assert len(set(str(records) for _, records in results_1)) == 3
+
+
+def test_phylip_bootstrap_node__wrong_number_of_seeds():
+    with pytest.raises(ValueError, match="Number of seeds"):
+        PHYLIPBootstrapNode(
+            input_alignment="input.phy",
+            input_partition="input.partitions",
+            output_alignment=["1.phy", "2.phy"],
+            seed=[1, 2, 3],
+        )
+
+
+def test_build_columns():
+    columns = PHYLIPBootstrapNode._build_columns(["ACGT", "TGCA", "AATT"])
+
+    assert columns == b"ATACGAGCTTAT"
+
+
+def test_build_columns__no_sequences():
+    assert not PHYLIPBootstrapNode._build_columns([])
+
+
+def _collect_bootstrap_seeds(max_threads, bootstrap_seed, num_bootstraps=10):
+    options = types.SimpleNamespace(
+        bootstrap_seed=bootstrap_seed, max_threads=max_threads, examl_max_threads=1
+    )
+    settings = {
+        "ExaML": {"Bootstraps": num_bootstraps, "Model": "GAMMA"},
+        "RootTreesOn": (),
+    }
+
+    node = _build_examl_bootstraps(
+        options, settings, "dest", "input.phy", "input.partitions", ()
+    )
+
+    seeds = {}
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, PHYLIPBootstrapNode):
+            seeds.update(zip(node._output_phy, node._seeds))
+        nodes.extend(node.dependencies)
+
+    return seeds
+
+
+@pytest.mark.parametrize("max_threads", (1, 3, 16))
+def test_build_examl_bootstraps__seeds_independent_of_batching(max_threads):
+    expected = _collect_bootstrap_seeds(max_threads=1, bootstrap_seed=1234)
+    result = _collect_bootstrap_seeds(max_threads=max_threads, bootstrap_seed=1234)
+
+    assert len(result) == 10
+    assert result == expected
+
+
+def test_build_examl_bootstraps__fixed_seed():
+    seeds_1 = _collect_bootstrap_seeds(max_threads=4, bootstrap_seed=1234)
+    seeds_2 = _collect_bootstrap_seeds(max_threads=4, bootstrap_seed=1234)
+    seeds_3 = _collect_bootstrap_seeds(max_threads=4, bootstrap_seed=4321)
+
+    assert seeds_1 == seeds_2
+    assert seeds_1 != seeds_3
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import io
+import os
+import random
+import types
+
+import pysam
+import pytest
+
+from paleomix.common.formats.fasta import FASTA
+from paleomix.nodes.sequences import (
+    CollectSequencesNode,
+    _parse_index_entry,
+    _read_fasta_index,
+    _read_fasta_sequence,
+)
+from paleomix.pipelines.phylo.parts.msa import build_msa_nodes
+
+
+def write_fasta(filename, records, line_width=60, trailing_newline=True):
+    """Writes a FASTA file with a given line width and indexes it using pysam."""
+    lines = []
+    for name, sequence in records:
+        lines.append(">%s" % (name,))
+        for idx in range(0, len(sequence), line_width):
+            lines.append(sequence[idx : idx + line_width])
+
+    with open(filename, "w") as handle:
+        handle.write("\n".join(lines))
+        if trailing_newline:
+            handle.write("\n")
+
+    pysam.faidx(str(filename))
+
+    return str(filename)
+
+
+def random_records(rng, names):
+    records = []
+    for name in names:
+        length = rng.choice((1, 59, 60, 61, 120, rng.randint(1, 500)))
+        records.append((name, "".join(rng.choice("ACGTN-") for _ in range(length))))
+
+    return records
+
+
+def read_sequence(filename, name):
+    with open(filename, "rb") as handle:
+        index = _read_fasta_index(filename)
+
+        return _read_fasta_sequence(handle, _parse_index_entry(index[name]))
+
+
+def expected_sequence(sequence):
+    handle = io.StringIO()
+    FASTA("name", None, sequence).write(handle)
+
+    return handle.getvalue().split("\n", 1)[1].encode()
+
+
+###############################################################################
+###############################################################################
+# _read_fasta_index / _parse_index_entry
+
+
+def test_read_fasta_index(tmp_path):
+    filename = write_fasta(tmp_path / "x.fasta", [("a", "A" * 70), ("b", "ACGT")])
+
+    index = _read_fasta_index(filename)
+    assert sorted(index) == ["a", "b"]
+    assert _parse_index_entry(index["a"]) == (70, 3, 60, 61)
+    assert _parse_index_entry(index["b"]) == (4, 78, 4, 5)
+
+
+def test_parse_index_entry__extra_columns():
+    assert _parse_index_entry("10\t5\t60\t61\t1\t2\n") == (10, 5, 60, 61)
+
+
+###############################################################################
+###############################################################################
+# _read_fasta_sequence
+
+
+@pytest.mark.parametrize("length", (1, 59, 60, 61, 119, 120, 121, 180))
+@pytest.mark.parametrize("line_width", (10, 59, 60, 61, 100))
+@pytest.mark.parametrize("trailing_newline", (True, False))
+def test_read_fasta_sequence(tmp_path, length, line_width, trailing_newline):
+    sequence = "ACGT" * (length // 4) + "ACGT"[: length % 4]
+    records = [("first", "ACGTN" * 13), ("last", sequence)]
+    filename = write_fasta(
+        tmp_path / "x.fasta", records, line_width, trailing_newline=trailing_newline
+    )
+
+    assert read_sequence(filename, "first") == expected_sequence("ACGTN" * 13)
+    assert read_sequence(filename, "last") == expected_sequence(sequence)
+
+
+def test_read_fasta_sequence__crlf(tmp_path):
+    sequence = "ACGT" * 30
+    filename = tmp_path / "x.fasta"
+    with open(filename, "wb") as handle:
+        handle.write(b">a\r\n")
+        for idx in range(0, len(sequence), 60):
+            handle.write(sequence[idx : idx + 60].encode() + b"\r\n")
+    pysam.faidx(str(filename))
+
+    assert read_sequence(str(filename), "a") == expected_sequence(sequence)
+
+
+###############################################################################
+###############################################################################
+# CollectSequencesNode
+
+
+def _reference_collect_sequences(fasta_files, sequences, destination):
+    """Previous implementation of CollectSequencesNode, using pysam.FastaFile."""
+    handles = [
+        (name, pysam.FastaFile(filename))
+        for name, filename in sorted(fasta_files.items())
+    ]
+
+    try:
+        for sequence_name in sorted(sequences):
+            filename = os.path.join(destination, sequence_name + ".fasta")
+            with open(filename, "w") as out_handle:
+                for sample, fasta_file in handles:
+                    sequence = fasta_file.fetch(sequence_name)
+                    FASTA(sample, sequence_name, sequence).write(out_handle)
+    finally:
+        for _, handle in handles:
+            handle.close()
+
+
+def _random_samples(tmp_path, seed, nsamples=5, nsequences=25):
+    rng = random.Random(seed)
+    names = ["gene_%02i" % (idx,) for idx in range(nsequences)]
+
+    fasta_files = {}
+    for idx in range(nsamples):
+        # Different line widths, sequence orders, and trailing newlines
+        sample_names = list(names)
+        if idx % 2:
+            rng.shuffle(sample_names)
+
+        fasta_files["sample_%i" % (idx,)] = write_fasta(
+            tmp_path / ("sample_%i.fasta" % (idx,)),
+            random_records(rng, sample_names),
+            line_width=rng.choice((60, 60, 50, 80)),
+            trailing_newline=bool(idx % 3),
+        )
+
+    return fasta_files, names
+
+
+def _read_files(root):
+    results = {}
+    for filename in os.listdir(root):
+        with open(os.path.join(root, filename), "rb") as handle:
+            results[filename] = handle.read()
+
+    return results
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_collect_sequences_node(tmp_path, seed):
+    fasta_files, names = _random_samples(tmp_path, seed)
+    (tmp_path / "expected").mkdir()
+    (tmp_path / "temp").mkdir()
+
+    subset = names[::2]
+    _reference_collect_sequences(fasta_files, subset, tmp_path / "expected")
+
+    node = CollectSequencesNode(fasta_files, subset, str(tmp_path / "result"))
+    node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+    assert _read_files(tmp_path / "result") == _read_files(tmp_path / "expected")
+    assert not os.listdir(tmp_path / "temp")
+
+
+def test_collect_sequences_node__missing_sequences(tmp_path):
+    fasta_files, _ = _random_samples(tmp_path, 0)
+    (tmp_path / "temp").mkdir()
+
+    node = CollectSequencesNode(fasta_files, ["foo"], str(tmp_path / "result"))
+    with pytest.raises(Exception, match="does not contain expected sequences"):
+        node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+
+@pytest.mark.parametrize("shards", (1, 2, 3, 7, 25, 100))
+def test_build_msa_nodes__shards(tmp_path, shards):
+    fasta_files, names = _random_samples(tmp_path, 1)
+    (tmp_path / "expected").mkdir()
+    (tmp_path / "temp").mkdir()
+    _reference_collect_sequences(fasta_files, names, tmp_path / "expected")
+
+    options = types.SimpleNamespace(
+        destination=str(tmp_path / "result"),
+        collect_sequences_shards=shards,
+    )
+    regions = {
+        "Name": "regions",
+        "Sequences": {None: frozenset(names)},
+        "Genotypes": fasta_files,
+    }
+    settings = {"Enabled": False, "Program": "MAFFT"}
+
+    nodes = build_msa_nodes(options, settings, regions, {}, ())
+    assert len(set(nodes)) == min(shards, len(names))
+
+    for node in set(nodes):
+        node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+    result = _read_files(tmp_path / "result" / "alignments" / "regions")
+    assert result == _read_files(tmp_path / "expected")
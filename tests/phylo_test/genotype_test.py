@@ -0,0 +1,175 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import os
+import types
+
+import pytest
+
+import paleomix.pipelines.phylo.parts.genotype as genotype
+from paleomix.node import NodeError
+from paleomix.nodes.commands import (
+    ConcatVCFNode,
+    GenotypeRegionsNode,
+    SplitRegionsNode,
+)
+
+
+@pytest.fixture
+def regions(tmp_path):
+    fasta_file = tmp_path / "prefix.fasta"
+    fasta_file.write_text(">chr1\n%s\n>chr2\n%s\n" % ("A" * 60, "C" * 40))
+
+    bed_file = tmp_path / "regions.bed"
+    bed_file.write_text("chr1\t10\t15\tA\t0\t+\nchr1\t12\t14\tB\t0\t+\n")
+
+    return {"FASTA": str(fasta_file), "BED": str(bed_file)}
+
+
+def _build_nodes(tmp_path, regions, shards, bedfile):
+    options = types.SimpleNamespace(genotyping_shards=shards)
+    genotyping = {"MPileup": {"-E": True}, "BCFTools": {"-m": True}}
+
+    return genotype.build_genotype_regions_nodes(
+        options=options,
+        genotyping=genotyping,
+        regions=regions,
+        bamfile=str(tmp_path / "sample.bam"),
+        bedfile=bedfile,
+        outfile=str(tmp_path / "sample.vcf.bgz"),
+        prefix=str(tmp_path / "sample.prefix"),
+        dependencies=(),
+    )
+
+
+def _shard_nodes(node):
+    assert isinstance(node, ConcatVCFNode)
+    shard_nodes = list(node.dependencies)
+    assert all(isinstance(shard, GenotypeRegionsNode) for shard in shard_nodes)
+
+    (splitter,) = set(
+        dependency for shard in shard_nodes for dependency in shard.dependencies
+    )
+    assert isinstance(splitter, SplitRegionsNode)
+
+    return shard_nodes, splitter
+
+
+###############################################################################
+###############################################################################
+# build_genotype_regions_nodes
+
+
+def test_build_genotype_regions_nodes__single_shard(tmp_path, regions):
+    node = _build_nodes(tmp_path, regions, 1, regions["BED"])
+
+    assert isinstance(node, GenotypeRegionsNode)
+    assert "--no-version" not in str(node._command)
+
+
+def test_build_genotype_regions_nodes__shards(tmp_path, regions):
+    node = _build_nodes(tmp_path, regions, 3, regions["BED"])
+    shard_nodes, splitter = _shard_nodes(node)
+
+    assert len(shard_nodes) == 3
+    assert len(splitter.output_files) == 3
+    assert "--naive" in str(node._command)
+    for shard in shard_nodes:
+        # Headers must be identical for 'concat --naive'
+        assert str(shard._command).count("--no-version") == 2
+
+
+def test_build_genotype_regions_nodes__shards_limited_by_regions(tmp_path, regions):
+    # The merged regions span 5 bp, so at most 5 non-empty shards are possible
+    node = _build_nodes(tmp_path, regions, 10, regions["BED"])
+    shard_nodes, _ = _shard_nodes(node)
+
+    assert len(shard_nodes) == 5
+
+
+def test_build_genotype_regions_nodes__shards_limited_to_single_node(tmp_path, regions):
+    regions["BED"] = str(tmp_path / "short.bed")
+    with open(regions["BED"], "w") as handle:
+        handle.write("chr2\t5\t6\tA\t0\t+\n")
+
+    node = _build_nodes(tmp_path, regions, 10, regions["BED"])
+    assert isinstance(node, GenotypeRegionsNode)
+
+
+def test_build_genotype_regions_nodes__shards_entire_prefix(tmp_path, regions):
+    node = _build_nodes(tmp_path, regions, 4, None)
+    shard_nodes, splitter = _shard_nodes(node)
+
+    assert len(shard_nodes) == 4
+    assert splitter.input_files == frozenset((regions["FASTA"] + ".fai",))
+
+
+def test_build_genotype_regions_nodes__shards_count_cached(tmp_path, regions):
+    node_1 = _build_nodes(tmp_path, regions, 10, regions["BED"])
+    # The regions are only read once, not once per sample
+    os.unlink(regions["BED"])
+    node_2 = _build_nodes(tmp_path / "sample_2", regions, 10, regions["BED"])
+
+    assert len(_shard_nodes(node_1)[0]) == len(_shard_nodes(node_2)[0]) == 5
+
+
+###############################################################################
+###############################################################################
+# SplitRegionsNode
+
+
+def _run_node(node, tmp_path):
+    (tmp_path / "temp").mkdir(exist_ok=True)
+    node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+
+def test_split_regions_node__bed_file(tmp_path, regions):
+    outfiles = [str(tmp_path / "shards" / ("%i.bed" % idx)) for idx in range(2)]
+    _run_node(SplitRegionsNode(outfiles, bedfile=regions["BED"]), tmp_path)
+
+    with open(outfiles[0]) as handle:
+        assert handle.read() == "chr1\t10\t12\n"
+    with open(outfiles[1]) as handle:
+        assert handle.read() == "chr1\t12\t15\n"
+
+
+def test_split_regions_node__fai_file(tmp_path):
+    fai_file = tmp_path / "prefix.fasta.fai"
+    fai_file.write_text("chr1\t60\t6\t60\t61\nchr2\t40\t73\t40\t41\n")
+
+    outfiles = [str(tmp_path / "shards" / ("%i.bed" % idx)) for idx in range(2)]
+    _run_node(SplitRegionsNode(outfiles, fai_file=str(fai_file)), tmp_path)
+
+    with open(outfiles[0]) as handle:
+        assert handle.read() == "chr1\t0\t50\n"
+    with open(outfiles[1]) as handle:
+        assert handle.read() == "chr1\t50\t60\nchr2\t0\t40\n"
+
+
+def test_split_regions_node__empty_shards(tmp_path, regions):
+    outfiles = [str(tmp_path / "shards" / ("%i.bed" % idx)) for idx in range(6)]
+    node = SplitRegionsNode(outfiles, bedfile=regions["BED"])
+
+    with pytest.raises(NodeError, match="5 bp .* into 6 non-empty shards"):
+        _run_node(node, tmp_path)
+
+    assert not os.path.exists(tmp_path / "shards")
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import json
+import os
+import types
+
+import pytest
+
+import paleomix.pipelines.phylo.makefile as makefile
+from paleomix.common.makefile import MakefileError
+
+from testutils import write_bam
+
+_CONTIGS = {"chr1": 1000, "chr2": 2000}
+
+
+def write_fasta(filename, contigs):
+    with open(filename, "w") as handle:
+        for name, length in contigs.items():
+            handle.write(">%s\n%s\n" % (name, "A" * length))
+
+    return str(filename)
+
+
+def touch(filename):
+    # Ensure that the modification time changes, even on coarse filesystems
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def project(tmp_path):
+    samples_root = tmp_path / "samples"
+    samples_root.mkdir()
+
+    samples = {}
+    for idx in range(10):
+        name = "sample_%i" % (idx,)
+        samples[name] = {"Name": name}
+        write_bam(samples_root / ("%s.prefix.bam" % (name,)), _CONTIGS)
+
+    options = types.SimpleNamespace(
+        samples_root=str(samples_root),
+        destination=str(tmp_path / "destination"),
+        max_threads=4,
+    )
+
+    mkfile = {
+        "Project": {
+            "Regions": {
+                "regions": {
+                    "FASTA": write_fasta(tmp_path / "prefix.fasta", _CONTIGS),
+                    "Prefix": "prefix",
+                }
+            },
+            "Samples": samples,
+        }
+    }
+
+    return options, mkfile
+
+
+@pytest.fixture
+def read_bam_contigs(monkeypatch):
+    """Records the BAM files for which headers are read."""
+    calls = []
+    read_bam_contigs = makefile._read_bam_contigs
+
+    def _wrapper(filename):
+        calls.append(os.path.basename(filename))
+        return read_bam_contigs(filename)
+
+    monkeypatch.setattr(makefile, "_read_bam_contigs", _wrapper)
+
+    return calls
+
+
+def check_bam_sequences(options, mkfile):
+    """Validates BAM files and writes the cache, as is done when running the pipeline"""
+    makefile._check_bam_sequences(options, mkfile, ("genotype",))
+    makefile.write_bam_cache(options, [mkfile])
+
+
+###############################################################################
+###############################################################################
+# _check_bam_sequences
+
+
+def test_check_bam_sequences__skipped_if_not_genotyping(project, read_bam_contigs):
+    options, mkfile = project
+    makefile._check_bam_sequences(options, mkfile, ("msa", "phylogeny"))
+
+    assert read_bam_contigs == []
+    assert not os.path.exists(options.destination)
+
+
+def test_check_bam_sequences__valid_files(project, read_bam_contigs):
+    options, mkfile = project
+    makefile._check_bam_sequences(options, mkfile, ("genotype",))
+
+    assert sorted(read_bam_contigs) == sorted(
+        "sample_%i.prefix.bam" % (idx,) for idx in range(10)
+    )
+
+
+def test_check_bam_sequences__cache_is_json(project):
+    options, mkfile = project
+    check_bam_sequences(options, mkfile)
+
+    cache_file = os.path.join(options.destination, "bam_headers.json")
+    with open(cache_file) as handle:
+        cache = json.load(handle)
+
+    assert len(cache["value"]) == 10
+
+
+def test_check_bam_sequences__cached_files_not_read(project, read_bam_contigs):
+    options, mkfile = project
+    check_bam_sequences(options, mkfile)
+    read_bam_contigs.clear()
+    makefile._check_bam_sequences(options, mkfile, ("genotype",))
+
+    assert read_bam_contigs == []
+
+
+def test_check_bam_sequences__modified_files_reread(project, read_bam_contigs):
+    options, mkfile = project
+    check_bam_sequences(options, mkfile)
+    read_bam_contigs.clear()
+
+    touch(os.path.join(options.samples_root, "sample_3.prefix.bam"))
+    makefile._check_bam_sequences(options, mkfile, ("genotype",))
+
+    assert read_bam_contigs == ["sample_3.prefix.bam"]
+
+
+def test_check_bam_sequences__invalid_modified_file(project):
+    options, mkfile = project
+    check_bam_sequences(options, mkfile)
+
+    filename = os.path.join(options.samples_root, "sample_3.prefix.bam")
+    write_bam(filename, {"chr1": 1000, "chr2": 2001})
+    touch(filename)
+
+    with pytest.raises(MakefileError, match="Length in BAM = 2001"):
+        makefile._check_bam_sequences(options, mkfile, ("genotype",))
+
+
+def test_check_bam_sequences__changed_reference(project, tmp_path, read_bam_contigs):
+    options, mkfile = project
+    check_bam_sequences(options, mkfile)
+    read_bam_contigs.clear()
+
+    # Cached results only apply to the reference the BAMs were validated against
+    regions = mkfile["Project"]["Regions"]["regions"]
+    regions["FASTA"] = write_fasta(tmp_path / "other.fasta", {"chr1": 1000})
+    makefile._check_bam_sequences(options, mkfile, ("genotype",))
+
+    assert len(read_bam_contigs) == 10
+
+
+def test_check_bam_sequences__errors_reported_in_sample_order(project):
+    options, mkfile = project
+    for idx, contigs in ((7, {"chr1": 1000}), (3, {"chr2": 2000})):
+        filename = os.path.join(options.samples_root, "sample_%i.prefix.bam" % idx)
+        write_bam(filename, contigs)
+
+    for _ in range(5):
+        with pytest.raises(MakefileError, match="sample_3.prefix.bam"):
+            makefile._check_bam_sequences(options, mkfile, ("genotype",))
+
+
+def test_check_bam_sequences__invalid_files_not_cached(project):
+    options, mkfile = project
+    filename = os.path.join(options.samples_root, "sample_9.prefix.bam")
+    write_bam(filename, {"chr1": 1000})
+
+    with pytest.raises(MakefileError):
+        check_bam_sequences(options, mkfile)
+
+    # The pipeline is not run if validation fails, so nothing is cached
+    assert not os.path.exists(options.destination)
+
+
+def test_check_bam_sequences__unwritable_cache(project, tmp_path, read_bam_contigs):
+    options, mkfile = project
+    # A file in place of the destination cannot be written to, even as root
+    (tmp_path / "destination").write_text("")
+
+    for _ in range(2):
+        check_bam_sequences(options, mkfile)
+
+    assert len(read_bam_contigs) == 20
+
+
+def test_check_bam_sequences__cache_not_written_during_validation(project):
+    options, mkfile = project
+    makefile._check_bam_sequences(options, mkfile, ("genotype",))
+
+    # The cache is only written if the pipeline is run, i.e. not for dry runs
+    assert not os.path.exists(options.destination)
+
+
+def test_write_bam_cache__multiple_makefiles(project, read_bam_contigs):
+    options, mkfile_1 = project
+    samples = mkfile_1["Project"]["Samples"]
+    mkfile_2 = {"Project": dict(mkfile_1["Project"])}
+    mkfile_2["Project"]["Samples"] = dict(list(samples.items())[5:])
+    mkfile_1["Project"]["Samples"] = dict(list(samples.items())[:5])
+
+    makefile._check_bam_sequences(options, mkfile_1, ("genotype",))
+    makefile._check_bam_sequences(options, mkfile_2, ("genotype",))
+    makefile.write_bam_cache(options, [mkfile_1, mkfile_2])
+
+    read_bam_contigs.clear()
+    mkfile_1["Project"]["Samples"] = samples
+    makefile._check_bam_sequences(options, mkfile_1, ("genotype",))
+
+    assert read_bam_contigs == []
+
+
+def test_write_bam_cache__nothing_validated(project):
+    options, mkfile = project
+    makefile._check_bam_sequences(options, mkfile, ("msa",))
+    makefile.write_bam_cache(options, [mkfile])
+
+    assert not os.path.exists(options.destination)
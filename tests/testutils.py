@@ -0,0 +1,52 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2012 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import pysam
+
+
+def write_bam(filename, contigs, reads=(), index=True):
+    """Writes a sorted BAM file for a set of contigs, given as (name, length) pairs
+    or as a dict, containing ungapped reads specified as (contig index, position,
+    length) tuples. The BAM file is indexed unless 'index' is False.
+    """
+    header = {
+        "HD": {"VN": "1.0", "SO": "coordinate"},
+        "SQ": [{"SN": name, "LN": length} for (name, length) in dict(contigs).items()],
+    }
+
+    filename = str(filename)
+    with pysam.AlignmentFile(filename, "wb", header=header) as handle:
+        for idx, (tid, pos, length) in enumerate(sorted(reads)):
+            record = pysam.AlignedSegment()
+            record.query_name = "read_%i" % (idx,)
+            record.query_sequence = "A" * length
+            record.query_qualities = pysam.qualitystring_to_array("I" * length)
+            record.reference_id = tid
+            record.reference_start = pos
+            record.cigartuples = [(0, length)]
+            record.mapping_quality = 30
+            handle.write(record)
+
+    if index:
+        pysam.index(filename)
+
+    return filename
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import collections
+import random
+
+import pysam
+import pytest
+
+from paleomix.common.bedtools import BEDRecord
+from paleomix.tools.depths import calc_max_depth, sample_depth_counts
+
+from testutils import write_bam
+
+_CONTIGS = (("chr1", 5000), ("chr2", 2500))
+
+
+def reference_depths(reads):
+    """Per-site read depths for every site in every contig."""
+    depths = {name: [0] * length for (name, length) in _CONTIGS}
+    for tid, pos, length in reads:
+        contig = depths[_CONTIGS[tid][0]]
+        for idx in range(pos, pos + length):
+            contig[idx] += 1
+
+    return depths
+
+
+def random_reads(rng, num_reads=200):
+    reads = []
+    for _ in range(num_reads):
+        tid = rng.randint(0, len(_CONTIGS) - 1)
+        length = rng.randint(20, 100)
+        reads.append((tid, rng.randint(0, _CONTIGS[tid][1] - length), length))
+
+    return reads
+
+
+def bed_record(contig, start, end):
+    return BEDRecord("%s\t%i\t%i" % (contig, start, end))
+
+
+@pytest.fixture
+def bam_file(tmp_path):
+    reads = random_reads(random.Random(1234))
+
+    return write_bam(tmp_path / "test.bam", _CONTIGS, reads), reads
+
+
+def test_sample_depth_counts__all_sites(bam_file):
+    filename, reads = bam_file
+    expected = collections.Counter()
+    for depths in reference_depths(reads).values():
+        expected.update(depths)
+
+    with pysam.AlignmentFile(filename) as handle:
+        counts, num_sites = sample_depth_counts(handle, None, fraction=1.0)
+
+    assert num_sites == sum(length for (_, length) in _CONTIGS)
+    assert counts == expected
+
+
+def test_sample_depth_counts__all_sites_in_regions(bam_file):
+    filename, reads = bam_file
+    regions = [
+        bed_record("chr1", 100, 1500),
+        # Overlapping records are merged
+        bed_record("chr1", 1000, 2200),
+        bed_record("chr2", 0, 2500),
+    ]
+
+    depths = reference_depths(reads)
+    expected = collections.Counter(depths["chr1"][100:2200] + depths["chr2"])
+
+    with pysam.AlignmentFile(filename) as handle:
+        counts, num_sites = sample_depth_counts(handle, regions, fraction=1.0)
+
+    assert num_sites == 2100 + 2500
+    assert counts == expected
+
+
+# Regions consisting of whole 1000 bp sampling windows
+_WHOLE_WINDOWS = (bed_record("chr1", 0, 4000), bed_record("chr2", 0, 2000))
+
+
+def test_sample_depth_counts__min_sites(bam_file):
+    filename, _ = bam_file
+
+    with pysam.AlignmentFile(filename) as handle:
+        counts, num_sites = sample_depth_counts(
+            handle,
+            _WHOLE_WINDOWS,
+            fraction=0.0001,
+            min_sites=2000,
+            rng=random.Random(0),
+        )
+
+    assert num_sites == 2000
+    assert sum(counts.values()) == num_sites
+
+
+def test_sample_depth_counts__fraction(bam_file):
+    filename, _ = bam_file
+
+    with pysam.AlignmentFile(filename) as handle:
+        counts, num_sites = sample_depth_counts(
+            handle, _WHOLE_WINDOWS, fraction=0.5, min_sites=0, rng=random.Random(0)
+        )
+
+    assert num_sites == 3000
+    assert sum(counts.values()) == num_sites
+
+
+def test_sample_depth_counts__sampled_windows_match_reference(bam_file):
+    filename, reads = bam_file
+    depths = reference_depths(reads)
+    possible_counts = collections.Counter()
+    for values in depths.values():
+        possible_counts.update(values)
+
+    with pysam.AlignmentFile(filename) as handle:
+        counts, _ = sample_depth_counts(
+            handle, None, fraction=0.25, min_sites=0, rng=random.Random(5)
+        )
+
+    # Sampled counts are a subset of the counts for all sites
+    assert not counts - possible_counts
+
+
+def test_sample_depth_counts__deterministic_with_fixed_rng(bam_file):
+    filename, _ = bam_file
+
+    results = []
+    for _ in range(2):
+        with pysam.AlignmentFile(filename) as handle:
+            results.append(
+                sample_depth_counts(
+                    handle, None, fraction=0.3, min_sites=0, rng=random.Random(42)
+                )
+            )
+
+    assert results[0] == results[1]
+
+
+def test_sample_depth_counts__no_regions(bam_file):
+    filename, _ = bam_file
+
+    with pysam.AlignmentFile(filename) as handle:
+        counts, num_sites = sample_depth_counts(handle, [], fraction=1.0)
+
+    assert num_sites == 0
+    assert not counts
+
+
+def test_sample_depth_counts__no_reads(tmp_path):
+    filename = write_bam(tmp_path / "empty.bam", _CONTIGS)
+
+    with pysam.AlignmentFile(filename) as handle:
+        counts, num_sites = sample_depth_counts(handle, None, fraction=1.0)
+
+    assert num_sites == 7500
+    assert counts == {0: 7500}
+    assert calc_max_depth(counts) == "NA"
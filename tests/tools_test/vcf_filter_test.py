@@ -0,0 +1,236 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import collections
+import random
+
+import pysam
+import pytest
+
+from paleomix.tools import depths
+from paleomix.tools.vcf_filter import _read_max_read_depth, main
+
+
+def write_depths(filename, counts, name="sample", contigs=None):
+    """Writes a depth histogram via 'paleomix depths', for a single sample."""
+    totals = {("*", "*", "*"): collections.Counter(counts)}
+    lengths = {"*": sum(counts.values())}
+    for contig in contigs or ():
+        totals[("*", "*", contig)] = collections.Counter(counts)
+        lengths[contig] = sum(counts.values())
+
+    with open(filename, "w") as handle:
+        depths.write_table(handle, name, totals, lengths, comments=("comment",))
+
+    return filename
+
+
+def test_read_max_read_depth(tmp_path):
+    counts = {depth: 1 for depth in range(1, 1001)}
+    filename = write_depths(tmp_path / "depths.txt", counts)
+
+    assert _read_max_read_depth(filename) == depths.calc_max_depth(counts) == 996
+
+
+def test_read_max_read_depth__ignores_per_contig_rows(tmp_path):
+    counts = {depth: 1 for depth in range(1, 1001)}
+    filename = write_depths(tmp_path / "depths.txt", counts, contigs=("chr1",))
+
+    assert _read_max_read_depth(filename) == 996
+
+
+def test_read_max_read_depth__not_calculated(tmp_path):
+    filename = write_depths(tmp_path / "depths.txt", {0: 1000})
+
+    with pytest.raises(ValueError, match="MaxDepth could not be calculated"):
+        _read_max_read_depth(filename)
+
+
+def test_read_max_read_depth__multiple_summary_rows(tmp_path):
+    counts = {depth: 1 for depth in range(1, 1001)}
+    filename = write_depths(tmp_path / "depths.txt", counts)
+    with open(filename) as handle:
+        lines = handle.read().splitlines()
+
+    # Duplicate the last row using a different sample name
+    row = lines[-1].split("\t")
+    row[0] = "other"
+    lines.append("\t".join(row))
+
+    with open(filename, "w") as handle:
+        handle.write("\n".join(lines) + "\n")
+
+    with pytest.raises(ValueError, match="expected 1 summary row, found 2"):
+        _read_max_read_depth(filename)
+
+
+def test_read_max_read_depth__no_summary_rows(tmp_path):
+    filename = tmp_path / "depths.txt"
+    filename.write_text("Name\tSample\tLibrary\tContig\tMaxDepth\n")
+
+    with pytest.raises(ValueError, match="expected 1 summary row, found 0"):
+        _read_max_read_depth(filename)
+
+
+def test_read_max_read_depth__invalid_value(tmp_path):
+    filename = tmp_path / "depths.txt"
+    filename.write_text(
+        "Name\tSample\tLibrary\tContig\tMaxDepth\nsample\t*\t*\t*\tfoo\n"
+    )
+
+    with pytest.raises(ValueError, match="MaxDepth is not an integer"):
+        _read_max_read_depth(filename)
+
+
+def test_read_max_read_depth__missing_column(tmp_path):
+    filename = tmp_path / "depths.txt"
+    filename.write_text("Name\tSample\tLibrary\tContig\nsample\t*\t*\t*\n")
+
+    with pytest.raises(KeyError):
+        _read_max_read_depth(filename)
+
+
+###############################################################################
+###############################################################################
+# Sharded filtering
+
+# Contigs with and without a length in the header; the latter is a single shard
+_CONTIGS = (("chr1", 1000), ("chr2", None), ("chr3", 500))
+
+
+def random_vcf_record(rng, contig, pos, indel):
+    ref = rng.choice("ACGT")
+    if not indel:
+        alt = rng.choice(("A", "C", "G", "T", "."))
+        info = "DP=%i" % (rng.randint(4, 20),)
+    elif rng.random() < 0.5:
+        # Deletions may extend into neighbouring shards
+        alt = ref
+        ref += "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 15)))
+        info = "INDEL;DP=%i" % (rng.randint(4, 20),)
+    else:
+        alt = ref + "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 5)))
+        info = "INDEL;DP=%i" % (rng.randint(4, 20),)
+
+    info += ";DP4=%s;MQ=%i" % (
+        ",".join(str(rng.randint(0, 5)) for _ in range(4)),
+        rng.randint(5, 40),
+    )
+
+    # Qualities are drawn from a small set, to test the handling of ties
+    return "\t".join(
+        (
+            contig,
+            str(pos),
+            ".",
+            ref,
+            alt,
+            str(rng.choice((20, 30, 40))),
+            ".",
+            info,
+            "GT:PL",
+            "0/1:%s" % (",".join(str(rng.choice((0, 10, 50))) for _ in range(3)),),
+        )
+    )
+
+
+def test_vcf_filter__indels_on_other_contigs_ignored(tmp_path, capsys):
+    records = (
+        ("chr1", 100, "A", "ACG", "INDEL;DP=10;DP4=2,2,2,2;MQ=30"),
+        ("chr2", 101, "C", "T", "DP=10;DP4=2,2,2,2;MQ=30"),
+        ("chr2", 102, "CA", "C", "INDEL;DP=10;DP4=2,2,2,2;MQ=30"),
+        ("chr3", 105, "G", "T", "DP=10;DP4=2,2,2,2;MQ=30"),
+    )
+
+    filename = tmp_path / "input.vcf"
+    with filename.open("w") as handle:
+        handle.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ts\n")
+        for contig, pos, ref, alt, info in records:
+            row = (contig, pos, ".", ref, alt, 50, ".", info, "GT:PL", "0/1:50,0,50")
+            handle.write("\t".join(map(str, row)) + "\n")
+
+    assert main([str(filename)]) is None
+    filters = [
+        line.split("\t")[6]
+        for line in capsys.readouterr().out.splitlines()
+        if not line.startswith("#")
+    ]
+
+    # Only the SNP on chr2 is adjacent to an indel on the same contig
+    assert filters == ["PASS", "w:3", "PASS", "PASS"]
+
+
+def write_random_vcf(filename, rng, shard_size):
+    lines = ["##fileformat=VCFv4.1"]
+    for contig, length in _CONTIGS:
+        if length is None:
+            lines.append("##contig=<ID=%s>" % (contig,))
+        else:
+            lines.append("##contig=<ID=%s,length=%i>" % (contig, length))
+    lines.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample")
+
+    for contig, length in _CONTIGS:
+        length = length or 700
+        positions = set(rng.sample(range(1, length + 1), length // 3))
+        # Variants on and immediately around shard boundaries
+        for boundary in range(shard_size, length, shard_size):
+            for offset in range(-12, 13):
+                if 1 <= boundary + offset <= length and rng.random() < 0.5:
+                    positions.add(boundary + offset)
+
+        for pos in sorted(positions):
+            for indel in (False, True):
+                if not indel or rng.random() < 0.3:
+                    lines.append(random_vcf_record(rng, contig, pos, indel))
+
+    with open(filename, "w") as handle:
+        handle.write("\n".join(lines) + "\n")
+
+    return pysam.tabix_index(str(filename), preset="vcf", force=True)
+
+
+_SHARDING_OPTIONS = (
+    (),
+    ("--reset-filter",),
+    ("--min-distance-to-indels", "0", "--min-distance-between-indels", "0"),
+    ("--min-distance-to-indels", "7", "--min-distance-between-indels", "3"),
+    ("--min-distance-to-indels", "20", "--min-distance-between-indels", "25"),
+)
+
+
+@pytest.mark.parametrize("seed", range(2))
+@pytest.mark.parametrize("shard_size", (1, 17, 100000))
+@pytest.mark.parametrize("options", _SHARDING_OPTIONS)
+def test_vcf_filter__sharded_output_matches_sequential(
+    tmp_path, capsysbinary, seed, shard_size, options
+):
+    rng = random.Random(seed)
+    filename = write_random_vcf(tmp_path / "input.vcf", rng, max(shard_size, 50))
+
+    assert main([filename, *options]) is None
+    expected = capsysbinary.readouterr().out
+
+    argv = [filename, "--threads", "3", "--shard-size", str(shard_size), *options]
+    assert main(argv) is None
+    result = capsysbinary.readouterr().out
+
+    assert result == expected
@@ -0,0 +1,366 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import random
+import types
+
+import pysam
+import pytest
+
+import paleomix.common.sequences as sequences
+import paleomix.common.vcfwrap as vcfwrap
+import paleomix.tools.vcf_to_fasta as vcf_to_fasta
+from paleomix.common.bedtools import BEDRecord
+
+# PL values for ref/ref, ref/alt, alt/alt, and no single most likely genotype
+_PL_VALUES = ("0,10,20", "10,0,20", "20,10,0", "20,10,0", "0,0,10")
+
+
+def random_vcf(rng, filename, contigs, density=0.3):
+    """Writes a random, tabix indexed VCF containing SNPs and indels."""
+    lines = ["##fileformat=VCFv4.2"]
+    for name, length in contigs.items():
+        lines.append("##contig=<ID=%s,length=%i>" % (name, length))
+    lines.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSample")
+
+    reference = {}
+    for name, length in contigs.items():
+        sequence = reference[name] = "".join(rng.choice("ACGT") for _ in range(length))
+
+        for pos in range(length):
+            if rng.random() >= density:
+                continue
+
+            ref = sequence[pos]
+            info = "DP=10"
+            kind = rng.random()
+            if kind < 0.5:
+                alt = rng.choice(("A", "C", "G", "T", "."))
+                alt = "." if alt == ref else alt
+            elif kind < 0.75:
+                ref = sequence[pos : pos + rng.randint(2, 7)]
+                alt, info = ref[0], "INDEL;DP=10"
+            else:
+                insertion = "".join(
+                    rng.choice("ACGT") for _ in range(rng.randint(1, 6))
+                )
+                alt, info = ref + insertion, "INDEL;DP=10"
+
+            pl_values = "0" if alt == "." else rng.choice(_PL_VALUES)
+            filter_ = "PASS" if rng.random() < 0.9 else "LowQual"
+            lines.append(
+                "\t".join(
+                    (name, str(pos + 1), ".", ref, alt, "30")
+                    + (filter_, info, "GT:PL", "0/1:" + pl_values)
+                )
+            )
+
+    return write_vcf(filename, lines), reference
+
+
+def write_vcf(filename, lines):
+    """Writes a tabix indexed VCF file, and returns the resulting filename."""
+    with open(filename, "w") as handle:
+        handle.write("\n".join(lines) + "\n")
+
+    return pysam.tabix_index(str(filename), preset="vcf", force=True)
+
+
+def random_bed_records(rng, contigs, count, name="region"):
+    records = []
+    for _ in range(count):
+        contig = rng.choice(sorted(contigs))
+        start = rng.randint(0, contigs[contig] - 1)
+        end = rng.randint(start + 1, min(contigs[contig], start + 40))
+
+        records.append(bed_record(contig, start, end, name, rng.choice("+-")))
+
+    return records
+
+
+def bed_record(contig, start, end, name, strand):
+    return BEDRecord("%s\t%i\t%i\t%s\t0\t%s" % (contig, start, end, name, strand))
+
+
+def build_options(**kwargs):
+    options = {
+        "nth_sample": 0,
+        "padding": 10,
+        "whole_codon_indels_only": False,
+        "ignore_indels": False,
+    }
+    options.update(kwargs)
+
+    return types.SimpleNamespace(**options)
+
+
+###############################################################################
+###############################################################################
+# Reference implementation of 'build_region', using a list of strings
+
+
+def _reference_add_snp(options, snp, position, sequence):
+    if snp.alt != ".":
+        genotype = "".join(vcfwrap.get_ml_genotype(snp, options.nth_sample))
+        encoded = sequences.encode_genotype(genotype)
+    else:
+        encoded = snp.ref
+    sequence[position] = encoded
+
+
+def _reference_add_indel(options, bed, indel, sequence):
+    if indel.alt == ".":
+        return
+
+    genotype = vcfwrap.get_ml_genotype(indel, options.nth_sample)
+    if genotype[0] != genotype[1]:
+        return
+    elif genotype[0] == "N":
+        return
+
+    start = max(0, bed.start - options.padding)
+
+    vcf, alt = indel, indel.alt
+    vcf.alt = genotype[0]
+    try:
+        indel = vcfwrap.parse_indel(vcf)
+    finally:
+        vcf.alt = alt
+
+    if indel.in_reference:
+        del_start = max(indel.pos + 1, bed.start)
+        del_end = min(indel.pos + 1 + len(indel.what), bed.end)
+
+        if del_start >= del_end:
+            return
+        elif options.whole_codon_indels_only:
+            if (del_end - del_start) % 3:
+                return
+
+        for position in range(del_start, del_end):
+            sequence[position - start] = ""
+    elif (len(indel.what) % 3 == 0) or not options.whole_codon_indels_only:
+        if indel.pos >= start:
+            sequence[indel.pos - start] += indel.what
+
+
+def _reference_build_region(options, genotype, bed):
+    start = max(0, bed.start - options.padding)
+
+    indels = []
+    sequence = ["N"] * (bed.end - start)
+    for vcf in vcf_to_fasta.filter_vcfs(genotype, bed.contig, start, bed.end):
+        if vcfwrap.is_indel(vcf):
+            indels.append(vcf)
+        else:
+            _reference_add_snp(options, vcf, vcf.pos - start, sequence)
+
+    if not options.ignore_indels:
+        for vcf in indels:
+            _reference_add_indel(options, bed, vcf, sequence)
+
+    offset = bed.start - start
+    length = bed.end - bed.start
+    truncated = sequence[offset : offset + length]
+    truncated[-1] = truncated[-1][:1]
+
+    return "".join(truncated)
+
+
+###############################################################################
+###############################################################################
+# Consensus
+
+
+def test_consensus__default_sequence():
+    consensus = vcf_to_fasta.Consensus(5)
+
+    assert consensus.to_string(0, 5) == "NNNNN"
+    assert consensus.to_string(1, 3) == "NN"
+
+
+def test_consensus__set_and_get():
+    consensus = vcf_to_fasta.Consensus(5)
+    consensus.set(1, "A")
+    consensus.set(2, "ACG")
+    consensus.set(3, "")
+
+    assert [consensus.get(idx) for idx in range(5)] == ["N", "A", "ACG", "", "N"]
+    assert consensus.to_string(0, 5) == "NAACGN"
+
+
+def test_consensus__negative_positions():
+    consensus = vcf_to_fasta.Consensus(5)
+    consensus.set(-1, "AC")
+    consensus.set(-2, "T")
+
+    assert consensus.get(4) == "AC"
+    assert consensus.get(-2) == "T"
+    assert consensus.to_string(0, 5) == "NNNTAC"
+
+
+def test_consensus__delete():
+    consensus = vcf_to_fasta.Consensus(5)
+    consensus.set(2, "ACG")
+    consensus.delete(1, 4)
+
+    assert [consensus.get(idx) for idx in range(5)] == ["N", "", "", "", "N"]
+    assert consensus.to_string(0, 5) == "NN"
+
+
+def test_consensus__insert():
+    consensus = vcf_to_fasta.Consensus(5)
+    consensus.insert(1, "CC")
+    consensus.insert(1, "T")
+
+    assert consensus.get(1) == "NCCT"
+    assert consensus.to_string(0, 5) == "NNCCTNNN"
+
+
+def test_consensus__insert_after_deletion():
+    consensus = vcf_to_fasta.Consensus(5)
+    consensus.delete(3, 5)
+    consensus.insert(4, "GT")
+
+    assert consensus.get(4) == "GT"
+    assert consensus.to_string(0, 5) == "NNNGT"
+
+    # Truncating a deleted position with an insertion keeps the first base
+    consensus.set(4, consensus.get(4)[:1])
+    assert consensus.to_string(0, 5) == "NNNG"
+
+
+###############################################################################
+###############################################################################
+# build_region
+
+
+def test_build_region__insertion_after_deletion_at_end(tmp_path):
+    filename = write_vcf(
+        tmp_path / "genotypes.vcf",
+        [
+            "##fileformat=VCFv4.2",
+            "##contig=<ID=chr1,length=10>",
+            "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSample",
+            "chr1\t7\t.\tGTAC\tG\t30\tPASS\tINDEL\tGT:PL\t1/1:20,10,0",
+            "chr1\t10\t.\tC\tCGG\t30\tPASS\tINDEL\tGT:PL\t1/1:20,10,0",
+        ],
+    )
+
+    # The first inserted base is kept for the (deleted) last position
+    bed = bed_record("chr1", 0, 10, "chr1", "+")
+    with pysam.TabixFile(filename) as genotype:
+        assert vcf_to_fasta.build_region(build_options(), genotype, bed) == "NNNNNNNG"
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_build_region__matches_reference_implementation(tmp_path, seed):
+    rng = random.Random(seed)
+    contigs = {"chr1": 150, "chr2": 60}
+    filename, _ = random_vcf(rng, tmp_path / "genotypes.vcf", contigs)
+    records = random_bed_records(rng, contigs, 200)
+    records.extend(
+        bed_record(name, 0, length, name, "+") for name, length in contigs.items()
+    )
+
+    with pysam.TabixFile(filename) as genotype:
+        for options in (
+            build_options(),
+            build_options(padding=0),
+            build_options(padding=3, whole_codon_indels_only=True),
+            build_options(ignore_indels=True),
+        ):
+            for bed in records:
+                expected = _reference_build_region(options, genotype, bed)
+                result = vcf_to_fasta.build_region(options, genotype, bed)
+
+                assert result == expected, (options, bed)
+
+
+###############################################################################
+###############################################################################
+# Batch mode
+
+
+def write_bed(filename, records):
+    with open(filename, "w") as handle:
+        for record in records:
+            handle.write("%s\n" % (record,))
+
+    return str(filename)
+
+
+_BATCH_OPTIONS = (
+    (),
+    ("--padding", "0"),
+    ("--whole-codon-indels-only",),
+    ("--ignore-indels",),
+    ("--nth-sample", "1", "--padding", "3"),
+)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("threads", (1, 2))
+@pytest.mark.parametrize("options", _BATCH_OPTIONS)
+def test_main__batch_output_matches_single_intervals(
+    tmp_path, capsys, seed, threads, options
+):
+    rng = random.Random(seed)
+    contigs = {"chr1": 300, "chr2": 200, "chr3": 100}
+    filename, _ = random_vcf(rng, tmp_path / "genotypes.vcf", contigs)
+
+    # Multiple intervals per gene, which are merged into a single sequence, and
+    # sets of intervals with overlapping regions and differing sets of contigs
+    intervals = []
+    for idx, bed_contigs in enumerate((("chr1", "chr2"), ("chr1", "chr2", "chr3"))):
+        bed_contigs = {name: contigs[name] for name in bed_contigs}
+        records = []
+        for gene in range(5):
+            name = "gene_%i_%i" % (idx, gene)
+            strand = rng.choice("+-")
+            for record in random_bed_records(rng, bed_contigs, 3, name=name):
+                record.strand = strand
+                records.append(record)
+        records.extend(
+            bed_record(name, 0, length, name, "+")
+            for name, length in bed_contigs.items()
+        )
+
+        intervals.append(write_bed(tmp_path / ("%i.bed" % (idx,)), records))
+
+    expected = []
+    for bed_file in intervals:
+        argv = ["--genotype", filename, "--intervals", bed_file, *options]
+        assert vcf_to_fasta.main(argv) == 0
+        expected.append(capsys.readouterr().out)
+
+    argv = ["--genotype", filename, "--threads", str(threads), *options]
+    for idx, bed_file in enumerate(intervals):
+        argv.extend(("--intervals", bed_file))
+        argv.extend(("--output", str(tmp_path / ("%i.fasta" % (idx,)))))
+    assert vcf_to_fasta.main(argv) == 0
+    assert capsys.readouterr().out == ""
+
+    for idx, sequences in enumerate(expected):
+        assert sequences.startswith(">")
+        with open(tmp_path / ("%i.fasta" % (idx,))) as handle:
+            assert handle.read() == sequences
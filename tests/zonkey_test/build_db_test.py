@@ -0,0 +1,190 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import random
+import types
+
+import pysam
+import pytest
+
+import paleomix.pipelines.zonkey.build_db as build_db
+from paleomix.common.sequences import NT_CODES
+from paleomix.pipelines.zonkey.build_db import (
+    ZonkeyError,
+    _ALLELE_MASKS,
+    _POPCOUNTS,
+    _find_biallelic_sites,
+    _init_worker,
+    _write_genotypes,
+)
+
+###############################################################################
+###############################################################################
+# Allele bitmasks
+
+
+@pytest.mark.parametrize("code, nucleotides", sorted(NT_CODES.items()))
+def test_allele_masks__iupac_codes(code, nucleotides):
+    mask = _ALLELE_MASKS[ord(code)]
+
+    assert [nuc for idx, nuc in enumerate("ACGT") if mask & (1 << idx)] == sorted(
+        nucleotides
+    )
+    assert _POPCOUNTS[mask] == len(nucleotides)
+
+
+def test_allele_masks__unexpected_characters():
+    expected = set(map(ord, NT_CODES))
+
+    for value in range(256):
+        if value not in expected:
+            assert _ALLELE_MASKS[value] == 0, chr(value)
+
+
+def test_allele_masks__combined_masks():
+    for code_1, nucleotides_1 in NT_CODES.items():
+        for code_2, nucleotides_2 in NT_CODES.items():
+            mask = _ALLELE_MASKS[ord(code_1)] | _ALLELE_MASKS[ord(code_2)]
+
+            assert _POPCOUNTS[mask] == len(set(nucleotides_1) | set(nucleotides_2))
+
+
+def test_popcounts():
+    assert len(_POPCOUNTS) == 256
+    for value in range(256):
+        assert _POPCOUNTS[value] == sum((value >> idx) & 1 for idx in range(8))
+
+
+###############################################################################
+###############################################################################
+# Finding biallelic sites
+
+_CONTIGS = {1: 750, 2: 300}
+
+
+def write_fasta(filename, sequences):
+    with open(filename, "w") as handle:
+        for name, sequence in sequences.items():
+            handle.write(">%s\n%s\n" % (name, sequence))
+
+    pysam.faidx(str(filename))
+
+    return str(filename)
+
+
+def random_sequences(rng, reference, codes):
+    """Returns sample sequences that mostly match the reference."""
+    sequences = {}
+    for name, sequence in reference.items():
+        sequences[name] = "".join(
+            rng.choice(codes) if rng.random() < 0.2 else nuc for nuc in sequence
+        )
+
+    return sequences
+
+
+def write_samples(tmp_path, rng, num_samples, codes="".join(NT_CODES)):
+    reference = {
+        "chr%i" % (contig,): "".join(rng.choice("ACGT") for _ in range(size))
+        for contig, size in _CONTIGS.items()
+    }
+
+    samples = {}
+    for idx in range(num_samples):
+        sequences = random_sequences(rng, reference, codes)
+        filename = write_fasta(tmp_path / ("sample_%i.fasta" % (idx,)), sequences)
+
+        samples["sample_%i" % (idx,)] = {
+            "filename": filename,
+            "contigs": {contig: "chr%i" % (contig,) for contig in _CONTIGS},
+            "sequences": sequences,
+        }
+
+    return write_fasta(tmp_path / "reference.fasta", reference), reference, samples
+
+
+def _reference_find_biallelic_sites(reference, samples):
+    """Reference implementation using one set of nucleotides per site."""
+    lines = []
+    keys = sorted(samples)
+    for contig in sorted(_CONTIGS):
+        name = "chr%i" % (contig,)
+        rows = zip(*(samples[key]["sequences"][name] for key in keys))
+        for idx, row in enumerate(rows):
+            if "N" in row:
+                continue
+
+            nucleotides = set()
+            for nuc in row:
+                nucleotides.update(NT_CODES[nuc])
+
+            if len(nucleotides) == 2:
+                ref = reference[name][idx]
+                lines.append("%s\t%i\t%s\t%s\n" % (contig, idx + 1, ref, "".join(row)))
+
+    return lines
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chunk_size", (64, 1000000))
+@pytest.mark.parametrize("threads", (1, 2))
+def test_write_genotypes(tmp_path, monkeypatch, seed, chunk_size, threads):
+    monkeypatch.setattr(build_db, "_CHUNK_SIZE", chunk_size)
+
+    rng = random.Random(seed)
+    # Mostly biallelic codes, to produce a reasonable number of sites
+    reference, sequences, samples = write_samples(tmp_path, rng, 3, "ACGTRN")
+    data = {"samples": samples, "contigs": dict(_CONTIGS)}
+    args = types.SimpleNamespace(reference=reference, threads=threads, overwrite=True)
+
+    filename = tmp_path / "genotypes.txt"
+    _write_genotypes(args, data, str(filename))
+
+    expected = _reference_find_biallelic_sites(sequences, samples)
+    assert len(expected) > 10
+
+    with filename.open() as handle:
+        assert handle.readline() == "Chrom\tPos\tRef\tsample_0;sample_1;sample_2\n"
+        assert handle.readlines() == expected
+
+
+def test_find_biallelic_sites__all_codes(tmp_path):
+    rng = random.Random(12345)
+    reference, sequences, samples = write_samples(tmp_path, rng, 2)
+    keys = sorted(samples)
+    _init_worker(reference, [samples[key]["filename"] for key in keys])
+
+    lines = []
+    for contig in sorted(_CONTIGS):
+        task = (contig, _CONTIGS[contig], 0, ["chr%i" % (contig,)] * len(keys))
+        lines.extend(_find_biallelic_sites(task).splitlines(True))
+
+    assert lines == _reference_find_biallelic_sites(sequences, samples)
+
+
+def test_find_biallelic_sites__unexpected_nucleotides(tmp_path):
+    reference = write_fasta(tmp_path / "reference.fasta", {"chr1": "ACGT"})
+    sample = write_fasta(tmp_path / "sample.fasta", {"chr1": "ACgT"})
+    _init_worker(reference, [sample])
+
+    with pytest.raises(ZonkeyError, match="'g'"):
+        _find_biallelic_sites((1, 4, 0, ["chr1"]))
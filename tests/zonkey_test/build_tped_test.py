@@ -0,0 +1,423 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import array
+import collections
+import io
+import os
+import random
+import tarfile
+
+import pysam
+import pytest
+
+from paleomix.pipelines.zonkey.build_tped import (
+    GenotypeReader,
+    GenotypeSites,
+    decode_genotypes,
+    main,
+)
+from paleomix.pipelines.zonkey.database import (
+    GENOTYPE_PANEL_FILENAME,
+    write_genotype_panel,
+)
+
+
+def random_genotypes_table(rng, samples=("A", "B", "C"), contigs=("1", "2", "10")):
+    """Returns the lines of a random genotypes table, and a dict of the expected
+    (0-based) positions and genotypes for each contig, sorted by position."""
+    lines = ["Chrom\tPos\tRef\t%s\n" % (";".join(samples),)]
+    expected = {}
+    for contig in contigs:
+        # The table is not required to be sorted within each contig
+        positions = rng.sample(range(1, 10000), rng.randint(1, 50))
+        sites = expected[contig] = []
+        for pos in positions:
+            ref = rng.choice("ACGT")
+            genotypes = "".join(rng.choice("ACGTRYKMSWN") for _ in samples)
+            lines.append("%s\t%i\t%s\t%s\n" % (contig, pos, ref, genotypes))
+            sites.append((pos - 1, genotypes))
+        sites.sort()
+
+    return lines, expected
+
+
+def write_tarfile(filename, files, mode="w"):
+    with tarfile.open(filename, mode) as tar_handle:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar_handle.addfile(info, io.BytesIO(data))
+
+    return str(filename)
+
+
+def read_genotypes(filename):
+    result = []
+    with GenotypeReader(filename) as reader:
+        for contig, sites in reader:
+            positions = list(sites._positions)
+            genotypes = [sites._genotypes[idx] for idx in range(len(positions))]
+
+            result.append((contig, list(zip(positions, genotypes))))
+
+        return reader.samples, result
+
+
+###############################################################################
+###############################################################################
+# GenotypeReader
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_genotype_reader__binary_panel_matches_table(tmp_path, seed):
+    lines, _ = random_genotypes_table(random.Random(seed))
+    table = "".join(lines)
+    panel = io.BytesIO()
+    write_genotype_panel(lines, panel)
+
+    txt_only = write_tarfile(
+        tmp_path / "txt.tar", {"genotypes.txt": table.encode("ascii")}
+    )
+    with_bin = write_tarfile(
+        tmp_path / "bin.tar",
+        {
+            "genotypes.txt": table.encode("ascii"),
+            GENOTYPE_PANEL_FILENAME: panel.getvalue(),
+        },
+    )
+
+    assert read_genotypes(with_bin) == read_genotypes(txt_only)
+
+
+def test_genotype_reader__compressed_database(tmp_path):
+    lines, _ = random_genotypes_table(random.Random(1234))
+    table = "".join(lines)
+    panel = io.BytesIO()
+    write_genotype_panel(lines, panel)
+
+    files = {
+        "genotypes.txt": table.encode("ascii"),
+        GENOTYPE_PANEL_FILENAME: panel.getvalue(),
+    }
+    uncompressed = write_tarfile(tmp_path / "db.tar", files)
+    compressed = write_tarfile(tmp_path / "db.tar.gz", files, mode="w:gz")
+
+    # Compressed databases fall back to reading the genotypes table
+    assert read_genotypes(compressed) == read_genotypes(uncompressed)
+
+
+###############################################################################
+###############################################################################
+# decode_genotypes
+
+
+def test_decode_genotypes__homozygous():
+    decoded = decode_genotypes("AAG")
+
+    assert decoded.nucleotides == frozenset("AG")
+    assert decoded.text == "A A A A G G"
+    assert decoded.is_transition
+
+
+def test_decode_genotypes__heterozygous():
+    decoded = decode_genotypes("AMC")
+
+    assert decoded.nucleotides == frozenset("AC")
+    assert decoded.text == "A A A C C C"
+    assert not decoded.is_transition
+
+
+@pytest.mark.parametrize(
+    "genotypes, is_transition",
+    (("CTY", True), ("AGR", True), ("ACM", False), ("GTK", False), ("A", False)),
+)
+def test_decode_genotypes__transitions(genotypes, is_transition):
+    assert decode_genotypes(genotypes).is_transition == is_transition
+
+
+@pytest.mark.parametrize("genotypes", ("AN", "A-", "AB", "Ax"))
+def test_decode_genotypes__invalid_nucleotides(genotypes):
+    with pytest.raises(ValueError, match="not bi-allelic"):
+        decode_genotypes(genotypes)
+
+
+def test_decode_genotypes__bounded_cache():
+    decode_genotypes.cache_clear()
+    maxsize = decode_genotypes.cache_info().maxsize
+    assert maxsize is not None
+
+    for value in range(maxsize + 10):
+        decode_genotypes(format(value, "b").replace("0", "A").replace("1", "C"))
+
+    assert decode_genotypes.cache_info().currsize == maxsize
+    assert decode_genotypes("AAG") is decode_genotypes("AAG")
+
+
+###############################################################################
+###############################################################################
+# GenotypeSites
+
+
+_HEADER = pysam.AlignmentHeader.from_dict({"SQ": [{"SN": "1", "LN": 10000}]})
+
+# Operations consuming the query (M, I, S, =, X) and the reference (M, D, N, =, X)
+_CONSUMES_QUERY = frozenset((0, 1, 4, 7, 8))
+_CONSUMES_REFERENCE = frozenset((0, 2, 3, 7, 8))
+
+
+def build_record(pos, cigar, sequence=None, rng=random, header=_HEADER, tid=0):
+    query_length = sum(length for op, length in cigar if op in _CONSUMES_QUERY)
+
+    record = pysam.AlignedSegment(header)
+    record.query_name = "read"
+    record.query_sequence = sequence or "".join(
+        rng.choice("ACGTN") for _ in range(query_length)
+    )
+    record.reference_id = tid
+    record.reference_start = pos
+    record.cigartuples = cigar
+
+    return record
+
+
+def random_cigar(rng):
+    cigar = []
+    if rng.random() < 0.3:
+        cigar.append((4, rng.randint(1, 5)))
+
+    cigar.append((rng.choice((0, 7, 8)), rng.randint(1, 20)))
+    for _ in range(rng.randint(0, 4)):
+        cigar.append((rng.choice((1, 2, 3)), rng.randint(1, 5)))
+        cigar.append((rng.choice((0, 7, 8)), rng.randint(1, 20)))
+
+    if rng.random() < 0.3:
+        cigar.append((4, rng.randint(1, 5)))
+
+    return cigar
+
+
+def expected_observations(positions, genotypes, records):
+    """Simple implementation using per-read aligned pairs."""
+    sites = dict(zip(positions, genotypes))
+    observations = collections.defaultdict(list)
+    used_reads = 0
+    for record_id, record in enumerate(records):
+        read_used = False
+        for query_pos, ref_pos in record.get_aligned_pairs(matches_only=True):
+            if ref_pos in sites and record.query_sequence[query_pos] != "N":
+                observations[ref_pos].append(
+                    (record_id, record.query_sequence[query_pos])
+                )
+                read_used = True
+
+        used_reads += read_used
+
+    observations = [
+        (pos, sites[pos], nucleotides)
+        for pos, nucleotides in sorted(observations.items())
+    ]
+
+    return observations, used_reads
+
+
+def process_sites(positions, genotypes, records):
+    statistics = collections.Counter()
+    sites = GenotypeSites(array.array("l", positions), genotypes)
+    observations = list(sites.process(records, statistics))
+
+    return observations, statistics["n_reads_used"]
+
+
+def test_genotype_sites__deletion_and_insertion():
+    positions = [10, 12, 14, 16, 18]
+    genotypes = ["AAG", "CCT", "GGA", "TTC", "AAC"]
+    # 10-11: M, 12-13: D, 14: M, (3 bp I), 15-17: M, 18: N, 19: M
+    record = build_record(
+        10, [(0, 2), (2, 2), (0, 1), (1, 3), (0, 3), (3, 1), (0, 1)], "ACGTTTACGT"
+    )
+
+    observations, used_reads = process_sites(positions, genotypes, [record])
+
+    # Sites 12 and 18 are deleted and skipped, respectively
+    assert observations == [
+        (10, "AAG", [(0, "A")]),
+        (14, "GGA", [(0, "G")]),
+        (16, "TTC", [(0, "C")]),
+    ]
+    assert used_reads == 1
+
+
+def test_genotype_sites__soft_clipping():
+    positions = [9, 10, 14, 15]
+    genotypes = ["AAG", "CCT", "GGA", "TTC"]
+    record = build_record(10, [(4, 2), (0, 5), (4, 2)], "NNACGTANN")
+
+    observations, _ = process_sites(positions, genotypes, [record])
+
+    assert observations == [(10, "CCT", [(0, "A")]), (14, "GGA", [(0, "A")])]
+
+
+def test_genotype_sites__unobserved_sites_and_n_bases():
+    positions = [10, 11, 12]
+    genotypes = ["AAG", "CCT", "GGA"]
+    record = build_record(10, [(0, 3)], "NNN")
+
+    observations, used_reads = process_sites(positions, genotypes, [record])
+
+    assert observations == []
+    assert used_reads == 0
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_genotype_sites__matches_aligned_pairs(seed):
+    rng = random.Random(seed)
+    positions = sorted(rng.sample(range(0, 1000), 200))
+    genotypes = ["".join(rng.choice("ACGT") for _ in range(3)) for _ in positions]
+
+    records = [
+        build_record(rng.randint(0, 950), random_cigar(rng), rng=rng)
+        for _ in range(rng.randint(1, 100))
+    ]
+    records.sort(key=lambda record: record.reference_start)
+
+    assert process_sites(positions, genotypes, records) == expected_observations(
+        positions, genotypes, records
+    )
+
+
+###############################################################################
+###############################################################################
+# Cohorts
+
+
+_DB_SETTINGS = b"""
+Format: 1
+Revision: 20160112
+Plink: "--horse"
+NChroms: 2
+MitoPadding: 0
+SNPDistance: 150000
+"""
+
+_DB_CONTIGS = b"ID\tSize\tChecksum\n1\t1000\tNA\n2\t2000\tNA\n"
+
+_DB_SAMPLES = b"""ID\tGroup(2)\tGroup(3)\tSpecies\tSex\tSampleID\tPublication
+A\tX\tX\tSp1\tMALE\tA\tNA
+B\tX\tY\tSp2\tFEMALE\tB\tNA
+C\tY\tZ\tSp3\tNA\tC\tNA
+"""
+
+
+def write_database(filename, rng, binary_panel):
+    lines = ["Chrom\tPos\tRef\tA;B;C\n"]
+    for contig, size in (("1", 1000), ("2", 2000)):
+        for pos in sorted(rng.sample(range(1, size + 1), size // 10)):
+            alleles = rng.sample("ACGT", 2)
+            code = {"AC": "M", "AG": "R", "AT": "W", "CG": "S", "CT": "Y", "GT": "K"}
+            het = code["".join(sorted(alleles))]
+            genotypes = "".join(rng.choice(alleles + [het]) for _ in range(3))
+            lines.append("%s\t%i\t%s\t%s\n" % (contig, pos, alleles[0], genotypes))
+
+    files = {
+        "settings.yaml": _DB_SETTINGS,
+        "contigs.txt": _DB_CONTIGS,
+        "samples.txt": _DB_SAMPLES,
+        "genotypes.txt": "".join(lines).encode("ascii"),
+    }
+
+    if binary_panel:
+        panel = io.BytesIO()
+        write_genotype_panel(lines, panel)
+        files[GENOTYPE_PANEL_FILENAME] = panel.getvalue()
+
+    return write_tarfile(filename, files)
+
+
+def write_bam(filename, rng, num_reads):
+    header = {
+        "HD": {"VN": "1.0", "SO": "coordinate"},
+        "SQ": [{"SN": "chr1", "LN": 1000}, {"SN": "chr2", "LN": 2000}],
+    }
+
+    reads = []
+    for _ in range(num_reads):
+        tid = rng.randint(0, 1)
+        cigar = random_cigar(rng)
+        ref_length = sum(length for op, length in cigar if op in _CONSUMES_REFERENCE)
+        pos = rng.randint(0, (1000, 2000)[tid] - ref_length)
+        reads.append((tid, pos, cigar))
+
+    with pysam.AlignmentFile(filename, "wb", header=header) as handle:
+        for idx, (tid, pos, cigar) in enumerate(sorted(reads)):
+            record = build_record(pos, cigar, rng=rng, header=handle.header, tid=tid)
+            record.query_name = "read_%i" % (idx,)
+            record.mapping_quality = 30
+            handle.write(record)
+
+    pysam.index(filename)
+
+    return filename
+
+
+def read_outputs(root):
+    result = {}
+    for filename in sorted(os.listdir(root)):
+        with open(os.path.join(root, filename)) as handle:
+            result[filename] = handle.read()
+
+    return result
+
+
+@pytest.mark.parametrize("binary_panel", (False, True))
+@pytest.mark.parametrize("downsample", (0, 50))
+@pytest.mark.parametrize("threads", (1, 2))
+def test_cohort_output_matches_per_sample_output(
+    tmp_path, binary_panel, downsample, threads
+):
+    rng = random.Random(1234)
+    database = write_database(str(tmp_path / "db.tar"), rng, binary_panel)
+    bamfiles = [
+        write_bam(str(tmp_path / ("%i.bam" % (idx,))), rng, rng.randint(50, 200))
+        for idx in range(3)
+    ]
+
+    options = ["--seed", "5678", "--downsample", str(downsample)]
+    for idx, bamfile in enumerate(bamfiles, start=1):
+        root = str(tmp_path / "single" / str(idx))
+        assert main([root, database, bamfile] + options) == 0
+
+    root = str(tmp_path / "cohort")
+    options += ["--threads", str(threads)]
+    assert main([root, database] + bamfiles + options) == 0
+
+    for idx in range(1, len(bamfiles) + 1):
+        expected = read_outputs(tmp_path / "single" / str(idx))
+        result = read_outputs(tmp_path / "cohort" / str(idx))
+
+        assert sorted(result) == [
+            "common.summary",
+            "common.tfam",
+            "excl_ts.tped",
+            "incl_ts.tped",
+        ]
+        assert result == expected
@@ -0,0 +1,621 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import gzip
+import io
+import json
+import os
+import pickle
+import random
+import tarfile
+
+import pytest
+
+from paleomix.pipelines.zonkey.database import (
+    GENOTYPE_PANEL_FILENAME,
+    GenotypePanel,
+    Simulations,
+    ZonkeyDB,
+    ZonkeyDBError,
+    write_genotype_panel,
+)
+
+from zonkey_test.build_tped_test import random_genotypes_table
+
+_SETTINGS = """
+Format: 1
+Revision: 20160112
+Plink: "--horse"
+NChroms: 2
+MitoPadding: 0
+SNPDistance: 150000
+"""
+
+_CONTIGS = "ID\tSize\tChecksum\n1\t1000\tNA\n2\t2000\tNA\n"
+
+_SAMPLES = """ID\tGroup(2)\tGroup(3)\tSpecies\tSex\tSampleID\tPublication
+A\tX\tX\tSp1\tMALE\tA\tNA
+B\tX\tY\tSp2\tFEMALE\tB\tNA
+C\tY\tZ\tSp3\tNA\tC\tNA
+"""
+
+_MITOCHONDRIA = ">A\nACGT\n>B\nACGA\n>C\nAC-T\n"
+
+_GENOTYPES = "Chrom\tPos\tRef\tA;B;C\n1\t10\tA\tAAG\n2\t5\tC\tCTY\n"
+
+_SIMULATIONS = """NReads\tK\tSample1\tSample2\tHasTS\tPercentile\tValue
+1000\t2\tX\tY\tTRUE\t0.0\t0.0
+1000\t2\tX\tY\tTRUE\t0.5\t0.1
+1000\t2\tY\tX\tTRUE\t1.0\t0.3
+"""
+
+
+def build_database(filename, **tables):
+    files = {
+        "settings.yaml": _SETTINGS,
+        "contigs.txt": _CONTIGS,
+        "samples.txt": _SAMPLES,
+        "mitochondria.fasta": _MITOCHONDRIA,
+        "simulations.txt": _SIMULATIONS,
+        "genotypes.txt": _GENOTYPES,
+    }
+    files.update(tables)
+
+    with tarfile.open(filename, "w") as tar_handle:
+        for name, text in files.items():
+            if text is not None:
+                data = text if isinstance(text, bytes) else text.encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar_handle.addfile(info, io.BytesIO(data))
+
+    return str(filename)
+
+
+def load_members(database):
+    return {
+        "settings": database.settings,
+        "contigs": database.contigs,
+        "samples": database.samples,
+        "groups": database.groups,
+        "mitochondria": database.mitochondria,
+        "simulations": database.simulations,
+        "sample_order": database.sample_order,
+    }
+
+
+def assert_same_members(members_1, members_2):
+    simulations_1 = members_1.pop("simulations")
+    simulations_2 = members_2.pop("simulations")
+
+    assert members_1 == members_2
+    assert simulations_1.nreads == simulations_2.nreads
+    assert simulations_1._tables == simulations_2._tables
+
+
+###############################################################################
+###############################################################################
+# ZonkeyDB
+
+
+def test_zonkey_db__members(tmp_path):
+    database = ZonkeyDB(build_database(tmp_path / "db.tar")).validate()
+
+    assert database.settings["NChroms"] == 2
+    assert database.contigs["2"]["Size"] == 2000
+    assert set(database.samples) == {"A", "B", "C"}
+    assert database.samples["A"]["Species"] == "Sp1"
+    assert database.groups == {
+        2: {"A": "X", "B": "X", "C": "Y"},
+        3: {"A": "X", "B": "Y", "C": "Z"},
+    }
+    assert sorted(database.mitochondria) == ["A", "B", "C"]
+    assert database.mitochondria["C"].sequence == "AC-T"
+    assert database.simulations.nreads == (1000,)
+    assert database.sample_order == ("A", "B", "C")
+
+
+def test_zonkey_db__optional_tables(tmp_path):
+    filename = build_database(
+        tmp_path / "db.tar", **{"mitochondria.fasta": None, "simulations.txt": None}
+    )
+
+    for _ in range(2):
+        database = ZonkeyDB(filename).validate()
+        assert database.mitochondria is None
+        assert database.simulations is None
+
+
+def test_zonkey_db__cache_written(tmp_path):
+    filename = build_database(tmp_path / "db.tar")
+    ZonkeyDB(filename).validate()
+
+    assert sorted(os.listdir(tmp_path / "db.tar.cache")) == [
+        "contigs.json",
+        "mitochondria.json",
+        "sample_order.json",
+        "samples.json",
+        "settings.json",
+        "simulations.json",
+    ]
+
+
+def test_zonkey_db__cache_hit(tmp_path, monkeypatch):
+    filename = build_database(tmp_path / "db.tar")
+    expected = load_members(ZonkeyDB(filename))
+
+    def _unexpected_open(*args, **kwargs):
+        raise AssertionError("database read despite cache")
+
+    monkeypatch.setattr(tarfile, "open", _unexpected_open)
+    assert_same_members(expected, load_members(ZonkeyDB(filename)))
+
+
+def test_zonkey_db__cache_stale(tmp_path):
+    filename = build_database(tmp_path / "db.tar")
+    assert ZonkeyDB(filename).sample_order == ("A", "B", "C")
+
+    genotypes = "Chrom\tPos\tRef\tC;B;A\n1\t10\tA\tGAA\n2\t5\tC\tYTC\n"
+    build_database(filename, **{"genotypes.txt": genotypes})
+    stat = os.stat(filename)
+    # Ensure that the modification time changes, even on coarse filesystems
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert ZonkeyDB(filename).sample_order == ("C", "B", "A")
+
+
+def test_zonkey_db__cache_ignores_malformed_files(tmp_path):
+    filename = build_database(tmp_path / "db.tar")
+    expected = load_members(ZonkeyDB(filename))
+
+    for name in os.listdir(tmp_path / "db.tar.cache"):
+        with open(tmp_path / "db.tar.cache" / name, "wb") as handle:
+            handle.write(b"{")
+
+    assert_same_members(expected, load_members(ZonkeyDB(filename)))
+
+
+def test_zonkey_db__cache_never_unpickled(tmp_path, monkeypatch):
+    filename = build_database(tmp_path / "db.tar")
+
+    def _unexpected_load(*args, **kwargs):
+        raise AssertionError("pickle used to read cache")
+
+    monkeypatch.setattr(pickle, "load", _unexpected_load)
+    monkeypatch.setattr(pickle, "loads", _unexpected_load)
+
+    for _ in range(2):
+        ZonkeyDB(filename).validate()
+
+
+def test_zonkey_db__cache_unwritable(tmp_path):
+    filename = build_database(tmp_path / "db.tar")
+    # A file in place of the cache folder cannot be written to, even as root
+    (tmp_path / "db.tar.cache").write_text("")
+
+    for _ in range(2):
+        database = ZonkeyDB(filename).validate()
+        assert database.sample_order == ("A", "B", "C")
+
+    assert sorted(os.listdir(tmp_path)) == ["db.tar", "db.tar.cache"]
+
+
+def test_zonkey_db__samples_table_read_once(tmp_path, monkeypatch):
+    filename = build_database(tmp_path / "db.tar")
+    calls = []
+    read_samples_table = ZonkeyDB._read_samples_table.__func__
+
+    def _read_samples_table(cls, *args):
+        calls.append(args)
+        return read_samples_table(cls, *args)
+
+    monkeypatch.setattr(
+        ZonkeyDB, "_read_samples_table", classmethod(_read_samples_table)
+    )
+
+    database = ZonkeyDB(filename)
+    assert database.groups[2] == {"A": "X", "B": "X", "C": "Y"}
+    assert set(database.samples) == {"A", "B", "C"}
+    assert len(calls) == 1
+
+
+def test_zonkey_db__pickle_only_keeps_filename(tmp_path):
+    filename = build_database(tmp_path / "db.tar")
+    database = ZonkeyDB(filename).validate()
+
+    clone = pickle.loads(pickle.dumps(database))
+    assert clone.__dict__ == {"filename": filename}
+    assert clone.sample_order == ("A", "B", "C")
+
+
+def test_zonkey_db__compressed_database(tmp_path):
+    filename = tmp_path / "db.tar"
+    filename.write_bytes(b"\x1f\x8b\x08")
+
+    with pytest.raises(ZonkeyDBError, match="gzip compressed"):
+        ZonkeyDB(filename)
+
+
+###############################################################################
+###############################################################################
+# ZonkeyDB -- simulations table
+
+_SIMULATIONS_HEADER = "NReads\tK\tSample1\tSample2\tHasTS\tPercentile\tValue\n"
+
+
+def test_zonkey_db__simulations__crlf_and_whitespace(tmp_path):
+    table = _SIMULATIONS_HEADER + "1000\t2\tX\tY\tTRUE\t0.5\t0.1 \r\n"
+    filename = build_database(tmp_path / "db.tar", **{"simulations.txt": table})
+    simulations = ZonkeyDB(filename).simulations
+
+    assert simulations.nreads == (1000,)
+    assert simulations.percentile_range("X", "Y", 1000, 2, True, 0.1) == (0.5, 0.5)
+
+
+def test_zonkey_db__simulations__empty_table(tmp_path):
+    filename = build_database(
+        tmp_path / "db.tar", **{"simulations.txt": _SIMULATIONS_HEADER}
+    )
+    simulations = ZonkeyDB(filename).simulations
+
+    assert simulations.nreads == ()
+    assert simulations.nreads_bounds(1000) == (None, None)
+
+
+@pytest.mark.parametrize(
+    "rows, linenum, found",
+    (
+        # Too many / too few columns
+        (["1000\t2\tX\tY\tTRUE\t0.5\t0.1\t1"], 2, 8),
+        (["1000\t2\tX\tY\tTRUE\t0.5"], 2, 6),
+        # Misaligned rows with the expected total number of fields
+        (["1000\t2\tX\tY\tTRUE\t0.5\t0.1\t1", "2\tX\tY\tTRUE\t0.5\t0.1"], 2, 8),
+        (["1000\t2\tX\tY\tTRUE\t0.5", "0.1\t1000\t2\tX\tY\tTRUE\t0.5\t0.1"], 2, 6),
+        # Empty lines
+        (["1000\t2\tX\tY\tTRUE\t0.5\t0.1", ""], 3, 1),
+    ),
+)
+def test_zonkey_db__simulations__wrong_number_of_columns(
+    tmp_path, rows, linenum, found
+):
+    table = _SIMULATIONS_HEADER + "".join(row + "\n" for row in rows)
+    filename = build_database(tmp_path / "db.tar", **{"simulations.txt": table})
+
+    message = "Line %i .* expected 7, but found %i" % (linenum, found)
+    with pytest.raises(ZonkeyDBError, match=message):
+        ZonkeyDB(filename).simulations
+
+
+@pytest.mark.parametrize(
+    "row, message",
+    (
+        ("1000.5\t2\tX\tY\tTRUE\t0.5\t0.1", "'NReads' at line 3 .* expected int"),
+        ("1000\tK\tX\tY\tTRUE\t0.5\t0.1", "'K' at line 3 .* expected int"),
+        ("1000\t2\tX\tY\tTRUE\tP\t0.1", "'Percentile' at line 3 .* expected float"),
+        ("1000\t2\tX\tY\tTRUE\t0.5\tV", "'Value' at line 3 .* expected float"),
+        ("1000\t2\tX\tZ\tTRUE\t0.5\t0.1", "Invalid group in column 'Sample2'"),
+    ),
+)
+def test_zonkey_db__simulations__malformed_values(tmp_path, row, message):
+    table = _SIMULATIONS_HEADER + "1000\t2\tX\tY\tTRUE\t0.5\t0.1\n" + row + "\n"
+    filename = build_database(tmp_path / "db.tar", **{"simulations.txt": table})
+
+    with pytest.raises(ZonkeyDBError, match=message):
+        ZonkeyDB(filename).simulations
+
+
+def test_zonkey_db__simulations__missing_columns(tmp_path):
+    table = "NReads\tK\tSample1\tSample2\tHasTS\tPercentile\n"
+    filename = build_database(tmp_path / "db.tar", **{"simulations.txt": table})
+
+    with pytest.raises(ZonkeyDBError, match="'Value'"):
+        ZonkeyDB(filename).simulations
+
+
+###############################################################################
+###############################################################################
+# Simulations
+
+
+def _reference_percentile_range(
+    rows, sample1, sample2, nreads, k_groups, has_ts, value
+):
+    """Linear-time implementation of 'percentile_range' using a list of rows."""
+    samples = frozenset((sample1, sample2))
+    selection = sorted(
+        (row["Percentile"], row["Value"])
+        for row in rows
+        if row["K"] == k_groups
+        and row["HasTS"] == has_ts
+        and row["NReads"] == nreads
+        and frozenset((row["Sample1"], row["Sample2"])) == samples
+    )
+
+    lower_bound = 0.0
+    upper_bound = 1.0
+
+    for cur_pct, cur_value in selection:
+        if cur_value > value:
+            break
+
+        lower_bound = cur_pct
+
+    for cur_pct, cur_value in reversed(selection):
+        if cur_value < value:
+            break
+
+        upper_bound = cur_pct
+
+    return lower_bound, upper_bound
+
+
+def _random_simulations(rng, nrows):
+    rows = []
+    for _ in range(nrows):
+        rows.append(
+            {
+                "K": rng.choice((2, 3)),
+                "HasTS": rng.choice((True, False)),
+                "Sample1": rng.choice("XYZ"),
+                "Sample2": rng.choice("XYZ"),
+                "NReads": rng.choice((1000, 5000, 10000)),
+                # Values are not necessarily monotonic in the percentiles
+                "Percentile": rng.randint(0, 20) / 20,
+                "Value": rng.randint(0, 10) / 10,
+            }
+        )
+
+    simulations = Simulations(
+        k_groups=[row["K"] for row in rows],
+        has_ts=[row["HasTS"] for row in rows],
+        sample1=[row["Sample1"] for row in rows],
+        sample2=[row["Sample2"] for row in rows],
+        nreads=[row["NReads"] for row in rows],
+        percentile=[row["Percentile"] for row in rows],
+        value=[row["Value"] for row in rows],
+    )
+
+    return rows, simulations
+
+
+def test_simulations__nreads_bounds():
+    _, simulations = _random_simulations(random.Random(1), 100)
+
+    assert simulations.nreads == (1000, 5000, 10000)
+    assert simulations.nreads_bounds(500) == (None, 1000)
+    assert simulations.nreads_bounds(1000) == (1000, 1000)
+    assert simulations.nreads_bounds(1001) == (1000, 5000)
+    assert simulations.nreads_bounds(10000) == (10000, 10000)
+    assert simulations.nreads_bounds(20000) == (10000, None)
+
+
+def test_simulations__percentile_range__no_simulations():
+    _, simulations = _random_simulations(random.Random(1), 0)
+
+    assert simulations.percentile_range("X", "Y", 1000, 2, True, 0.5) == (0.0, 1.0)
+
+
+def test_simulations__percentile_range__ties():
+    simulations = Simulations(
+        k_groups=[2] * 4,
+        has_ts=[True] * 4,
+        sample1=["X"] * 4,
+        sample2=["Y"] * 4,
+        nreads=[1000] * 4,
+        percentile=[0.0, 0.25, 0.25, 1.0],
+        value=[0.1, 0.3, 0.2, 0.3],
+    )
+
+    assert simulations.percentile_range("X", "Y", 1000, 2, True, 0.0) == (0.0, 0.0)
+    assert simulations.percentile_range("X", "Y", 1000, 2, True, 0.2) == (0.25, 0.25)
+    assert simulations.percentile_range("Y", "X", 1000, 2, True, 0.3) == (1.0, 0.25)
+    assert simulations.percentile_range("X", "Y", 1000, 2, True, 0.4) == (1.0, 1.0)
+
+
+def test_simulations__percentile_range__matches_linear_search():
+    rng = random.Random(12345)
+    for _ in range(20):
+        rows, simulations = _random_simulations(rng, rng.randint(1, 300))
+
+        for _ in range(200):
+            args = (
+                rng.choice("XYZ"),
+                rng.choice("XYZ"),
+                rng.choice((1000, 5000, 10000)),
+                rng.choice((2, 3)),
+                rng.choice((True, False)),
+                rng.randint(-1, 11) / 10,
+            )
+
+            expected = _reference_percentile_range(rows, *args)
+            assert simulations.percentile_range(*args) == expected
+
+
+def test_simulations__json_round_trip():
+    rng = random.Random(54321)
+    rows, simulations = _random_simulations(rng, 300)
+    clone = Simulations.from_json(json.loads(json.dumps(simulations.to_json())))
+
+    assert clone.nreads == simulations.nreads
+    for _ in range(500):
+        args = (
+            rng.choice("XYZ"),
+            rng.choice("XYZ"),
+            rng.choice((1000, 5000, 10000)),
+            rng.choice((2, 3)),
+            rng.choice((True, False)),
+            rng.randint(-1, 11) / 10,
+        )
+
+        assert clone.percentile_range(*args) == simulations.percentile_range(*args)
+
+
+###############################################################################
+###############################################################################
+# GenotypePanel
+
+
+def _read_genotype_panel(panel):
+    result = {}
+    for contig in panel.contigs:
+        positions = list(panel.positions(contig))
+        genotypes = bytes(panel.genotypes(contig)).decode("ascii")
+        width = len(panel.samples)
+
+        result[contig["name"]] = [
+            (pos, genotypes[idx * width : (idx + 1) * width])
+            for idx, pos in enumerate(positions)
+        ]
+
+    return result
+
+
+def _write_genotype_panel(lines):
+    handle = io.BytesIO()
+    write_genotype_panel(lines, handle)
+
+    return handle.getvalue()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_genotype_panel__round_trip(seed):
+    lines, expected = random_genotypes_table(random.Random(seed))
+
+    with GenotypePanel(_write_genotype_panel(lines)) as panel:
+        assert panel.samples == ("A", "B", "C")
+        assert [contig["name"] for contig in panel.contigs] == ["1", "2", "10"]
+        assert _read_genotype_panel(panel) == expected
+
+
+def test_genotype_panel__round_trip__from_file(tmp_path):
+    lines, expected = random_genotypes_table(random.Random(1234))
+    filename = tmp_path / "genotypes.bin"
+    filename.write_bytes(b"padding" + _write_genotype_panel(lines) + b"padding")
+
+    with GenotypePanel.from_file(
+        filename, offset=7, size=filename.stat().st_size - 14
+    ) as panel:
+        assert _read_genotype_panel(panel) == expected
+
+
+def test_genotype_panel__round_trip__from_tarfile(tmp_path):
+    lines, expected = random_genotypes_table(random.Random(4321))
+    filename = build_database(
+        tmp_path / "db.tar",
+        **{
+            "genotypes.txt": "".join(lines),
+            GENOTYPE_PANEL_FILENAME: _write_genotype_panel(lines),
+        }
+    )
+
+    with GenotypePanel.from_tarfile(filename) as panel:
+        assert _read_genotype_panel(panel) == expected
+
+
+def test_genotype_panel__from_tarfile__no_panel(tmp_path):
+    filename = build_database(tmp_path / "db.tar")
+
+    with pytest.raises(KeyError):
+        GenotypePanel.from_tarfile(filename)
+
+
+def test_genotype_panel__from_tarfile__compressed(tmp_path):
+    lines, _ = random_genotypes_table(random.Random(4321))
+    filename = build_database(
+        tmp_path / "db.tar", **{GENOTYPE_PANEL_FILENAME: _write_genotype_panel(lines)}
+    )
+
+    compressed = tmp_path / "db.tar.gz"
+    with open(filename, "rb") as handle:
+        compressed.write_bytes(gzip.compress(handle.read()))
+
+    with pytest.raises(tarfile.ReadError):
+        GenotypePanel.from_tarfile(str(compressed))
+
+
+def test_genotype_panel__close_releases_views(tmp_path):
+    lines, _ = random_genotypes_table(random.Random(1))
+    filename = tmp_path / "genotypes.bin"
+    filename.write_bytes(_write_genotype_panel(lines))
+
+    panel = GenotypePanel.from_file(filename)
+    positions = panel.positions(panel.contigs[0])
+    genotypes = panel.genotypes(panel.contigs[0])
+    mapping = panel._buffer
+    panel.close()
+
+    assert mapping.closed
+    with pytest.raises(ValueError):
+        positions[0]
+    with pytest.raises(ValueError):
+        genotypes[0]
+
+
+def test_genotype_panel__close_on_error(tmp_path, monkeypatch):
+    filename = tmp_path / "genotypes.bin"
+    filename.write_bytes(b"not a genotype panel")
+
+    mappings = []
+    original_init = GenotypePanel.__init__
+
+    def _init(self, buffer, offset=0, size=None):
+        mappings.append(buffer)
+        original_init(self, buffer, offset, size)
+
+    monkeypatch.setattr(GenotypePanel, "__init__", _init)
+    with pytest.raises(ZonkeyDBError, match="not a binary genotype panel"):
+        GenotypePanel.from_file(filename)
+
+    assert mappings and mappings[0].closed
+
+
+def test_genotype_panel__truncated():
+    with pytest.raises(ZonkeyDBError, match="truncated"):
+        GenotypePanel(b"PAL")
+
+
+def test_genotype_panel__malformed_index():
+    data = bytearray(_write_genotype_panel(random_genotypes_table(random.Random(1))[0]))
+    data[-1:] = b"X"
+
+    with pytest.raises(ZonkeyDBError, match="Malformed binary genotype panel"):
+        GenotypePanel(bytes(data))
+
+
+def test_write_genotype_panel__wrong_number_of_genotypes():
+    lines = ["Chrom\tPos\tRef\tA;B\n", "1\t10\tA\tACG\n"]
+
+    with pytest.raises(ZonkeyDBError, match="Expected 2 genotypes at 1:10, found 3"):
+        _write_genotype_panel(lines)
+
+
+def test_zonkey_db__sample_order_from_panel(tmp_path):
+    lines = ["Chrom\tPos\tRef\tC;B;A\n", "1\t10\tA\tAAG\n"]
+    filename = build_database(
+        tmp_path / "db.tar",
+        **{
+            "genotypes.txt": "".join(lines),
+            GENOTYPE_PANEL_FILENAME: _write_genotype_panel(lines),
+        }
+    )
+
+    assert ZonkeyDB(filename).sample_order == ("C", "B", "A")
@@ -0,0 +1,510 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2026 Mikkel Schubert <MikkelSch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import gzip
+import io
+import itertools
+import os
+import random
+import sys
+import types
+
+import pytest
+
+from paleomix.node import Node, NodeError
+from paleomix.pipelines.zonkey.parts.nuclear import (
+    AdmixtureConvergenceNode,
+    BuildCohortTPEDFilesNode,
+    FreqToTreemixNode,
+)
+from paleomix.pipelines.zonkey.pipeline import _admixture_threads, build_plink_nodes
+
+_TPED_FILENAMES = ("common.tfam", "common.summary", "incl_ts.tped", "excl_ts.tped")
+
+
+###############################################################################
+###############################################################################
+# BuildCohortTPEDFilesNode
+
+
+def _cohort_node(tmp_path, num_samples=3):
+    roots = [str(tmp_path / "out" / name) for name in "abc"[:num_samples]]
+    bamfiles = ["%s.bam" % (name,) for name in "abc"[:num_samples]]
+
+    return BuildCohortTPEDFilesNode(roots, "db.tar", bamfiles, downsample=0), roots
+
+
+def _write_temp_files(temp, num_samples):
+    for idx in range(1, num_samples + 1):
+        (temp / str(idx)).mkdir(parents=True)
+        for filename in _TPED_FILENAMES:
+            (temp / str(idx) / filename).write_text("%i/%s\n" % (idx, filename))
+
+
+def test_cohort_tped_node__output_files(tmp_path):
+    node, roots = _cohort_node(tmp_path)
+
+    assert node.output_files == frozenset(
+        "%s/%s" % (root, filename) for root in roots for filename in _TPED_FILENAMES
+    )
+
+
+def test_cohort_tped_node__too_few_bams(tmp_path):
+    with pytest.raises(ValueError, match="at least two BAMs"):
+        BuildCohortTPEDFilesNode(["a"], "db.tar", ["a.bam"], downsample=0)
+
+
+def test_cohort_tped_node__mismatched_roots(tmp_path):
+    with pytest.raises(ValueError, match="Number of output roots"):
+        BuildCohortTPEDFilesNode(["a"], "db.tar", ["a.bam", "b.bam"], downsample=0)
+
+
+def test_cohort_tped_node__teardown_moves_files(tmp_path, monkeypatch):
+    node, roots = _cohort_node(tmp_path)
+    temp = tmp_path / "temp"
+    _write_temp_files(temp, 3)
+    # The command itself is not run, so there is nothing for it to commit
+    monkeypatch.setattr(node._command, "commit", lambda temp: None)
+
+    node._teardown(types.SimpleNamespace(), str(temp))
+
+    for idx, root in enumerate(roots, start=1):
+        for filename in _TPED_FILENAMES:
+            with open("%s/%s" % (root, filename)) as handle:
+                assert handle.read() == "%i/%s\n" % (idx, filename)
+
+    assert not list(temp.iterdir())
+
+
+def _assert_nothing_committed(roots, temp, num_samples=3):
+    for root in roots:
+        for filename in _TPED_FILENAMES:
+            assert not os.path.exists(os.path.join(root, filename))
+
+    for idx in range(1, num_samples + 1):
+        assert (temp / str(idx)).is_dir()
+
+
+@pytest.mark.parametrize("sample", (1, 3))
+def test_cohort_tped_node__teardown_missing_file(tmp_path, sample):
+    node, roots = _cohort_node(tmp_path)
+    temp = tmp_path / "temp"
+    _write_temp_files(temp, 3)
+    (temp / str(sample) / "incl_ts.tped").unlink()
+
+    with pytest.raises(NodeError, match="required files not created"):
+        node._teardown(types.SimpleNamespace(), str(temp))
+
+    _assert_nothing_committed(roots, temp)
+
+
+def test_cohort_tped_node__teardown_missing_sample(tmp_path):
+    node, roots = _cohort_node(tmp_path)
+    temp = tmp_path / "temp"
+    _write_temp_files(temp, 2)
+
+    with pytest.raises(NodeError, match="required files not created"):
+        node._teardown(types.SimpleNamespace(), str(temp))
+
+    _assert_nothing_committed(roots, temp, num_samples=2)
+
+
+@pytest.mark.parametrize("path", ("3/unexpected.txt", "unexpected.txt", "4/"))
+def test_cohort_tped_node__teardown_unexpected_file(tmp_path, path):
+    node, roots = _cohort_node(tmp_path)
+    temp = tmp_path / "temp"
+    _write_temp_files(temp, 3)
+    if path.endswith("/"):
+        (temp / path).mkdir()
+    else:
+        (temp / path).write_text("")
+
+    with pytest.raises(NodeError, match="unexpected files created"):
+        node._teardown(types.SimpleNamespace(), str(temp))
+
+    _assert_nothing_committed(roots, temp)
+
+
+###############################################################################
+###############################################################################
+# build_plink_nodes
+
+
+def _plink_config():
+    database = types.SimpleNamespace(filename="db.tar", settings={"Plink": "--horse"})
+
+    return types.SimpleNamespace(database=database, downsample_to=0)
+
+
+def test_build_plink_nodes__per_sample(tmp_path):
+    config = _plink_config()
+    dependency = Node()
+
+    plink = build_plink_nodes(
+        config, config.database, "root", "a.bam", dependencies=(dependency,)
+    )
+
+    for postfix in ("incl_ts", "excl_ts"):
+        (ped_node,) = plink[postfix].dependencies
+        assert ped_node.dependencies == frozenset((dependency,))
+
+
+def test_build_plink_nodes__cohort_keeps_sample_dependencies(tmp_path):
+    config = _plink_config()
+    dependency = Node()
+    cohort, _ = _cohort_node(tmp_path)
+
+    plink = build_plink_nodes(
+        config,
+        config.database,
+        "root",
+        "a.bam",
+        dependencies=(dependency,),
+        ped_node=cohort,
+    )
+
+    for postfix in ("incl_ts", "excl_ts"):
+        assert plink[postfix].dependencies == frozenset((cohort, dependency))
+
+
+###############################################################################
+###############################################################################
+# _admixture_threads
+
+
+def _admixture_config(**kwargs):
+    config = {
+        "admixture_threads": 0,
+        "admixture_convergence": 0,
+        "admixture_replicates": 1,
+        "max_threads": 16,
+    }
+    config.update(kwargs)
+
+    return types.SimpleNamespace(**config)
+
+
+# Two groupings (K = 2 and K = 3), each run for two input files
+_ADMIXTURE_DATA = types.SimpleNamespace(groups={2: {}, 3: {}})
+
+
+def test_admixture_threads__explicit():
+    config = _admixture_config(admixture_threads=3, max_threads=1)
+
+    assert _admixture_threads(config, _ADMIXTURE_DATA) == 3
+
+
+@pytest.mark.parametrize(
+    "max_threads, replicates, expected",
+    ((16, 1, 4), (16, 2, 2), (16, 4, 1), (16, 10, 1), (1, 1, 1), (7, 1, 1)),
+)
+def test_admixture_threads__replicates(max_threads, replicates, expected):
+    config = _admixture_config(max_threads=max_threads, admixture_replicates=replicates)
+
+    assert _admixture_threads(config, _ADMIXTURE_DATA) == expected
+
+
+def test_admixture_threads__convergence():
+    # Replicates are run one at a time, so only the groupings are counted
+    config = _admixture_config(admixture_convergence=2, admixture_replicates=10)
+
+    assert _admixture_threads(config, _ADMIXTURE_DATA) == 4
+
+
+###############################################################################
+###############################################################################
+# AdmixtureConvergenceNode
+
+_FAKE_ADMIXTURE = """#!{executable}
+import os
+import sys
+
+counter = os.environ["FAKE_ADMIXTURE_COUNTER"]
+with open(counter) as handle:
+    idx = len(handle.read())
+with open(counter, "a") as handle:
+    handle.write(".")
+
+likelihood = os.environ["FAKE_ADMIXTURE_LIKELIHOODS"].split(",")[idx]
+prefix = "%s.%s" % (os.path.splitext(sys.argv[-2])[0], sys.argv[-1])
+for ext in os.environ["FAKE_ADMIXTURE_FILES"].split(","):
+    with open("%s.%s" % (prefix, ext), "w") as handle:
+        handle.write("%s %i\\n" % (ext, idx))
+
+print("Loglikelihood: %s" % (likelihood,))
+"""
+
+
+@pytest.fixture
+def fake_admixture(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    executable = bin_dir / "admixture"
+    executable.write_text(_FAKE_ADMIXTURE.format(executable=sys.executable))
+    executable.chmod(0o755)
+
+    counter = tmp_path / "counter"
+    counter.write_text("")
+
+    monkeypatch.setenv("PATH", "%s:%s" % (bin_dir, os.environ["PATH"]))
+    monkeypatch.setenv("FAKE_ADMIXTURE_COUNTER", str(counter))
+
+    def _run(likelihoods, max_replicates, min_hits, tolerance=0.5, files="P,Q"):
+        monkeypatch.setenv("FAKE_ADMIXTURE_LIKELIHOODS", ",".join(likelihoods))
+        monkeypatch.setenv("FAKE_ADMIXTURE_FILES", files)
+        counter.write_text("")
+
+        input_dir = tmp_path / "input"
+        input_dir.mkdir(exist_ok=True)
+        for ext in (".bed", ".bim"):
+            (input_dir / ("data" + ext)).write_text("")
+        (input_dir / "data.fam").write_text("A 0 0 0 0 -9\nB 0 0 0 0 -9\n")
+
+        output_root = tmp_path / "output"
+        node = AdmixtureConvergenceNode(
+            input_file=str(input_dir / "data.bed"),
+            k_groups=2,
+            output_root=str(output_root),
+            groups={"A": "X", "B": "Y"},
+            max_replicates=max_replicates,
+            min_hits=min_hits,
+            tolerance=tolerance,
+        )
+
+        first_command = node._command
+        (tmp_path / "temp").mkdir(exist_ok=True)
+        node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+        # The command of the node itself is not replaced by that of a replicate
+        assert node._command is first_command
+
+        with open(output_root / "data.2.P") as handle:
+            best = int(handle.read().split()[1])
+
+        return len(counter.read_text()), best
+
+    return _run
+
+
+def test_admixture_convergence_node__replicates_built_up_front():
+    node = AdmixtureConvergenceNode(
+        input_file="data.bed",
+        k_groups=2,
+        output_root="output",
+        groups={},
+        max_replicates=5,
+        min_hits=2,
+        tolerance=0.5,
+    )
+
+    assert len(node._replicates) == 5
+    assert node._replicates[0] is node._command
+    assert len(set(map(str, node._replicates))) == 5
+
+
+def test_admixture_convergence_node__converges(fake_admixture):
+    # The best likelihood (-10) is reached by replicates 2 and 4
+    runs, best = fake_admixture(["-20", "-10", "-15", "-10.2", "-5"], 5, 2)
+
+    assert runs == 4
+    assert best == 1
+
+
+def test_admixture_convergence_node__max_replicates(fake_admixture):
+    runs, best = fake_admixture(["-20", "-10", "-15"], 3, 2)
+
+    assert runs == 3
+    assert best == 1
+
+
+def test_admixture_convergence_node__ties_favor_earliest(fake_admixture):
+    runs, best = fake_admixture(["-10", "-10"], 2, 2, tolerance=0.0)
+
+    assert runs == 2
+    assert best == 0
+
+
+@pytest.mark.parametrize(
+    "files, message",
+    (
+        ("P", "required files not created"),
+        ("P,Q,extra", "unexpected files created"),
+    ),
+)
+def test_admixture_convergence_node__incomplete_output(
+    tmp_path, fake_admixture, files, message
+):
+    with pytest.raises(NodeError, match=message):
+        fake_admixture(["-20", "-10"], 2, 2, files=files)
+
+    assert not (tmp_path / "output").exists()
+
+
+@pytest.mark.parametrize("max_replicates, min_hits", ((0, 1), (1, 0)))
+def test_admixture_convergence_node__invalid_arguments(max_replicates, min_hits):
+    with pytest.raises(ValueError):
+        AdmixtureConvergenceNode(
+            input_file="data.bed",
+            k_groups=2,
+            output_root="output",
+            groups={},
+            max_replicates=max_replicates,
+            min_hits=min_hits,
+            tolerance=0.5,
+        )
+
+
+###############################################################################
+###############################################################################
+# FreqToTreemixNode
+
+
+def _reference_convert_freq_table(lines):
+    """Previous implementation of FreqToTreemixNode, using sorted cluster names
+    and a dictionary of rows for every SNP."""
+
+    def _parse_freq_table():
+        for line in lines[1:]:
+            chrom, snp, clst, _, _, _, mac, nchroms = line.split()
+
+            yield (chrom, snp, clst, int(mac), int(nchroms))
+
+    output = []
+    header = None
+    for _, rows in itertools.groupby(_parse_freq_table(), lambda row: row[:2]):
+        if header is None:
+            rows = tuple(rows)
+            header = list(sorted(row[2] for row in rows))
+            output.append("%s\n" % (" ".join(header)))
+
+        result = []
+        rows = dict((row[2], row) for row in rows)
+        for sample in header:
+            _, _, _, mac, nchroms = rows[sample]
+            result.append("%s,%i" % (mac, int(nchroms) - int(mac)))
+
+        output.append("%s\n" % (" ".join(result),))
+
+    return "".join(output)
+
+
+def random_freq_table(rng, num_snps, clusters=("Pop2", "Pop10", "A", "pop1")):
+    lines = [" CHR          SNP     CLST  A1  A2      MAF    MAC  NCHROBS"]
+    for idx in range(num_snps):
+        chrom = rng.choice(("1", "2", "X"))
+        snp = "snp_%i" % (idx,)
+        a1, a2 = rng.sample("ACGT", 2)
+
+        # Clusters are usually, but not always, listed in the same order
+        snp_clusters = list(clusters)
+        if rng.random() < 0.2:
+            rng.shuffle(snp_clusters)
+
+        for clst in snp_clusters:
+            nchroms = rng.randint(0, 40)
+            mac = rng.randint(0, nchroms)
+            maf = mac / nchroms if nchroms else float("nan")
+            lines.append(
+                "%4s %12s %8s %3s %3s %8.4g %6i %8i"
+                % (chrom, snp, clst, a1, a2, maf, mac, nchroms)
+            )
+
+    return [line + "\n" for line in lines]
+
+
+def convert_freq_table(lines):
+    out_handle = io.BytesIO()
+    in_handle = io.BytesIO("".join(lines).encode("ascii"))
+    FreqToTreemixNode._convert_freq_table(in_handle, out_handle)
+
+    return out_handle.getvalue().decode("ascii")
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("num_snps", (1, 10, 250))
+def test_freq_to_treemix__matches_previous_implementation(monkeypatch, seed, num_snps):
+    # Small batches, to test writing multiple batches
+    monkeypatch.setattr(FreqToTreemixNode, "_BATCH_SIZE", 7)
+
+    lines = random_freq_table(random.Random(seed), num_snps)
+
+    assert convert_freq_table(lines) == _reference_convert_freq_table(lines)
+
+
+def test_freq_to_treemix__empty_table():
+    lines = random_freq_table(random.Random(1), 0)
+
+    assert convert_freq_table(lines) == _reference_convert_freq_table(lines) == ""
+
+
+def test_freq_to_treemix__extra_clusters_ignored():
+    lines = random_freq_table(random.Random(1), 10)
+    lines.append("   2   snp_10   Pop2 A G 0.5 1 2\n")
+    lines.append("   2   snp_10   Other A G 0.5 1 2\n")
+    lines.append("   2   snp_10   A A G 0.5 1 2\n")
+    lines.append("   2   snp_10   pop1 A G 0.5 1 2\n")
+    lines.append("   2   snp_10   Pop10 A G 0.5 1 2\n")
+
+    result = convert_freq_table(lines)
+
+    assert result == _reference_convert_freq_table(lines)
+    assert result.endswith("\n1,1 1,1 1,1 1,1\n")
+
+
+def test_freq_to_treemix__missing_cluster():
+    lines = random_freq_table(random.Random(1), 10)
+    lines.append("   2   snp_10   Pop2 A G 0.5 1 2\n")
+    lines.append("   2   snp_10   A A G 0.5 1 2\n")
+    lines.append("   2   snp_10   pop1 A G 0.5 1 2\n")
+
+    with pytest.raises(NodeError, match="Cluster missing"):
+        convert_freq_table(lines)
+
+
+def test_freq_to_treemix__malformed_header():
+    lines = random_freq_table(random.Random(1), 10)
+    lines[0] = lines[0].replace("NCHROBS", "NCHROMS")
+
+    with pytest.raises(NodeError, match="Malformed frequency table header"):
+        convert_freq_table(lines)
+
+
+@pytest.mark.parametrize("compressed", (False, True))
+def test_freq_to_treemix__node(tmp_path, compressed):
+    lines = random_freq_table(random.Random(1), 100)
+
+    input_file = tmp_path / "input.frq.strat"
+    if compressed:
+        input_file = tmp_path / "input.frq.strat.gz"
+        with gzip.open(input_file, "wt") as handle:
+            handle.writelines(lines)
+    else:
+        input_file.write_text("".join(lines))
+
+    output_file = tmp_path / "output" / "treemix.gz"
+    node = FreqToTreemixNode(input_file=str(input_file), output_file=str(output_file))
+
+    (tmp_path / "temp").mkdir()
+    node.run(types.SimpleNamespace(temp_root=str(tmp_path / "temp")))
+
+    with gzip.open(output_file, "rt") as handle:
+        assert handle.read() == _reference_convert_freq_table(lines)